@@ -0,0 +1,6 @@
+"""
+benchmarks package
+
+Deterministic PDF/image corpus generation and the benchmark suite for the inversion pipeline.
+Run the suite from the project root with: python -m benchmarks.run
+"""
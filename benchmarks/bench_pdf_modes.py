@@ -0,0 +1,67 @@
+"""Compare wall time and peak RSS of the copy and incremental PDF inversion modes.
+
+Usage: python benchmarks/bench_pdf_modes.py [path/to/file.pdf] [--pages N] [--repeat N]
+
+Each measurement runs in a freshly spawned process so peak RSS is not polluted by
+earlier runs. Without a path, a synthetic document with text and vector shapes is used.
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, "invert_pdf_reader")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmarks.corpus import build_synthetic_pdf
+
+MODES = ("copy", "incremental")
+
+
+def _measure(pdf_path: str, mode: str, output_folder: str, queue) -> None:
+    """Child process body: invert once and report seconds, peak RSS and output size."""
+    from inverter import PDFInverter
+    import utils
+
+    result = PDFInverter.invert_pdf(pdf_path, mode, input_folder=os.path.dirname(pdf_path), output_folder=output_folder)
+    queue.put((result.status, result.seconds, utils.memory_handler.peak_rss_bytes(), result.bytes_out))
+
+
+def run(pdf_path: str, repeat: int) -> None:
+    context = multiprocessing.get_context("spawn")
+    print(f"{'mode':<12}{'status':<8}{'seconds':>10}{'peak RSS MB':>14}{'output MB':>12}")
+    for mode in MODES:
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory(prefix="bench_out_") as output_folder:
+                queue = context.Queue()
+                process = context.Process(target=_measure, args=(pdf_path, mode, output_folder, queue))
+                process.start()
+                status, seconds, peak_rss, bytes_out = queue.get()
+                process.join()
+            print(f"{mode:<12}{status:<8}{seconds:>10.3f}{peak_rss / 2**20:>14.1f}{bytes_out / 2**20:>12.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdf", nargs="?", help="PDF to benchmark; a synthetic one is generated if omitted")
+    parser.add_argument("--pages", type=int, default=1000, help="pages in the synthetic PDF")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_in_") as input_folder:
+        if args.pdf:
+            pdf_path = os.path.join(input_folder, os.path.basename(args.pdf))
+            shutil.copyfile(args.pdf, pdf_path)
+        else:
+            pdf_path = os.path.join(input_folder, "synthetic.pdf")
+            build_synthetic_pdf(pdf_path, args.pages)
+        run(pdf_path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Compare how fast viewers can render the output of the overlay and recolor inversion modes.
+
+Usage: python benchmarks/bench_render_modes.py [path/to/file.pdf] [--pages N] [--dpi N] [--repeat N]
+
+Every page of the source and of each inverted file is rendered with fitz; the overlay modes
+make the renderer composite a Difference blend group, recolor does not. The pixel difference
+of each output against the incremental overlay shows that the pages look the same.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, "invert_pdf_reader")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmarks.corpus import build_synthetic_pdf
+
+MODES = ("copy", "incremental", "recolor")
+REFERENCE_MODE = "incremental"
+
+
+def render_pages(pdf_path: str, dpi: int, repeat: int):
+    """Best seconds to render all pages, and the last rendering of each page."""
+    import fitz
+
+    best, pixmaps = float("inf"), []
+    with fitz.open(pdf_path) as doc:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            pixmaps = [page.get_pixmap(dpi=dpi, alpha=False) for page in doc]
+            best = min(best, time.perf_counter() - start)
+    return best, pixmaps
+
+
+def pixel_difference(pixmaps, reference):
+    """Mean absolute difference and share of samples off by more than 8, over all pages.
+
+    The maximum is not used: a partly covered pixel at the page edge can legitimately differ.
+    """
+    import numpy as np
+
+    total = off = count = 0
+    for pixmap, other in zip(pixmaps, reference):
+        difference = np.abs(np.frombuffer(pixmap.samples, np.uint8).astype(np.int16)
+                            - np.frombuffer(other.samples, np.uint8))
+        total += int(difference.sum())
+        off += int((difference > 8).sum())
+        count += difference.size
+    return total / max(count, 1), off / max(count, 1)
+
+
+def run(pdf_path: str, dpi: int, repeat: int) -> None:
+    from inverter import PDFInverter
+
+    renders = {"source": render_pages(pdf_path, dpi, repeat)}
+    recolored = None
+    with tempfile.TemporaryDirectory(prefix="bench_out_") as output_folder:
+        for mode in MODES:
+            result = PDFInverter.invert_pdf(pdf_path, mode, input_folder=os.path.dirname(pdf_path),
+                                            output_folder=output_folder)
+            if result.status != "ok":
+                print(f"{mode}: {result.error}")
+                continue
+            if mode == "recolor":
+                recolored = result.pages_recolored
+            renders[mode] = render_pages(result.output_path, dpi, repeat)
+            os.remove(result.output_path)
+
+    reference = renders.get(REFERENCE_MODE, (0, []))[1]
+    print(f"{'output':<14}{'render s':>10}{'ms/page':>10}{'mean diff':>11}{'% off':>8}")
+    for name, (seconds, pixmaps) in renders.items():
+        line = f"{name:<14}{seconds:>10.3f}{seconds * 1000 / max(len(pixmaps), 1):>10.2f}"
+        if name != "source" and reference:
+            mean, off = pixel_difference(pixmaps, reference)
+            line += f"{mean:>11.3f}{off * 100:>8.2f}"
+        print(line)
+    if recolored is not None:
+        print(f"\nrecolor rewrote {recolored} of {len(renders['source'][1])} pages; the rest use the overlay")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdf", nargs="?", help="PDF to benchmark; a synthetic one is generated if omitted")
+    parser.add_argument("--pages", type=int, default=50, help="pages in the synthetic PDF")
+    parser.add_argument("--dpi", type=int, default=96, help="render resolution")
+    parser.add_argument("--repeat", type=int, default=3, help="renders per file, the fastest is kept")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_in_") as input_folder:
+        if args.pdf:
+            pdf_path = os.path.join(input_folder, os.path.basename(args.pdf))
+            shutil.copyfile(args.pdf, pdf_path)
+        else:
+            pdf_path = os.path.join(input_folder, "synthetic.pdf")
+            build_synthetic_pdf(pdf_path, args.pages)
+        run(pdf_path, args.dpi, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
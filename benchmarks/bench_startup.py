@@ -0,0 +1,87 @@
+"""Measure import time and compare one process per file with the warm JSON-lines worker.
+
+Usage: python benchmarks/bench_startup.py [--files N] [--repeat N]
+
+Cold runs start a fresh interpreter for every one-page file, as a shell loop over the CLI
+would; the warm run sends all of them to a single invert_pdf_reader/worker.py process.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, "invert_pdf_reader")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmarks.corpus import build_synthetic_pdf, synthetic_image
+
+PATH_SETUP = f"import sys; sys.path[:0] = [{PROJECT_ROOT!r}, {os.path.join(PROJECT_ROOT, 'invert_pdf_reader')!r}]; "
+
+IMPORT_CASES = {
+    "import inverter": "import inverter",
+    "import inverter + fitz": "import inverter, fitz",
+    "import inverter + Pillow": "import inverter; from PIL import Image",
+}
+
+
+def run_python(code: str, cwd: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", PATH_SETUP + code], cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def loaded_modules(code: str) -> str:
+    """Which of fitz and Pillow the code leaves imported."""
+    check = code + "; print(' '.join(name for name in ('fitz', 'PIL') if name in sys.modules) or '-')"
+    return subprocess.run([sys.executable, "-c", PATH_SETUP + check], capture_output=True, text=True,
+                          check=True).stdout.strip().splitlines()[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=50, help="one-page files in the cold and warm runs")
+    parser.add_argument("--repeat", type=int, default=10, help="interpreter starts per import case, median is kept")
+    args = parser.parse_args()
+
+    print(f"{'case':<28}{'median ms':>10}  loaded")
+    for name, code in IMPORT_CASES.items():
+        median = statistics.median(run_python(code, PROJECT_ROOT) for _ in range(args.repeat))
+        print(f"{name:<28}{median * 1000:>10.0f}  {loaded_modules(code)}")
+
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as folder:
+        pdf_path = os.path.join(folder, "one_page.pdf")
+        build_synthetic_pdf(pdf_path, 1)
+        image_path = os.path.join(folder, "one_page.png")
+        synthetic_image("RGB", 512).save(image_path)
+        output_folder = os.path.join(folder, "output")
+
+        print(f"\n{'run':<28}{'files':>6}{'seconds':>10}{'files/s':>10}")
+        for kind, path in (("pdf", pdf_path), ("image", image_path)):
+            invert = (f"from inverter import PDFInverter; PDFInverter.invert_pdf({os.path.basename(path)!r})"
+                      if kind == "pdf" else
+                      f"from inverter import ImageInverter; ImageInverter.invert_png_file({os.path.basename(path)!r})")
+            code = (f"from configuration import config; config.INPUT_FOLDER = {folder!r}; "
+                    f"config.OUTPUT_FOLDER = {output_folder!r}; " + invert)
+            cold = sum(run_python(code, folder) for _ in range(args.files))
+            print(f"{'cold ' + kind:<28}{args.files:>6}{cold:>10.2f}{args.files / cold:>10.1f}")
+
+            requests = "".join(json.dumps({"id": i, "path": path, "output_folder": output_folder}) + "\n"
+                               for i in range(args.files))
+            start = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(PROJECT_ROOT, "invert_pdf_reader", "worker.py")],
+                           input=requests, text=True, cwd=folder, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            warm = time.perf_counter() - start
+            print(f"{'warm ' + kind:<28}{args.files:>6}{warm:>10.2f}{args.files / warm:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
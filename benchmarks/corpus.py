@@ -0,0 +1,137 @@
+"""Deterministic generator of the PDF and image corpus used by the benchmarks.
+
+Every document is derived from a fixed seed, so two runs on different commits measure the
+same inputs. Generated files are written to a folder and reused when they already exist.
+"""
+
+import io
+import os
+import random
+from typing import Dict, Sequence
+
+import fitz
+from PIL import Image
+
+SEED = 1234
+
+PAGE_SIZES = [fitz.paper_size("a4"), fitz.paper_size("letter"), fitz.paper_size("a3"), fitz.paper_size("a4-l")]
+
+IMAGE_SIZES = (256, 1024, 4096)
+IMAGE_MODES = ("L", "RGB", "RGBA", "P", "I;16")
+
+
+def _text_page(page: fitz.Page, rng: random.Random, lines: int = 45) -> None:
+    words = ("inverted", "dark", "mode", "reader", "page", "colour", "pdf", "overlay", "stream", "glyph")
+    text = "\n".join(" ".join(rng.choice(words) for _ in range(12)) for _ in range(lines))
+    page.insert_text((40, 50), text, fontsize=10, lineheight=1.6)
+
+
+def _vector_page(page: fitz.Page, rng: random.Random, shapes: int = 400) -> None:
+    shape = page.new_shape()
+    width, height = page.rect.width, page.rect.height
+    for _ in range(shapes):
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        shape.draw_line((x, y), (x + rng.uniform(-80, 80), y + rng.uniform(-80, 80)))
+        shape.finish(color=(rng.random(), rng.random(), rng.random()), width=rng.uniform(0.2, 2))
+        shape.draw_circle((x, y), rng.uniform(2, 20))
+        shape.finish(color=None, fill=(rng.random(), rng.random(), rng.random()))
+    shape.commit()
+
+
+def _image_bytes(rng: random.Random, size: int) -> bytes:
+    image = Image.frombytes("RGB", (size, size), rng.randbytes(size * size * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def _image_page(page: fitz.Page, rng: random.Random, images: int = 4) -> None:
+    width, height = page.rect.width, page.rect.height
+    for index in range(images):
+        top = index * height / images
+        page.insert_image(fitz.Rect(20, top + 5, width - 20, top + height / images - 5), stream=_image_bytes(rng, 256))
+
+
+def _annotated_page(page: fitz.Page, rng: random.Random) -> None:
+    _text_page(page, rng, lines=20)
+    page.add_highlight_annot(fitz.Rect(40, 40, 300, 60))
+    page.add_freetext_annot(fitz.Rect(40, 400, 300, 440), "Reviewer note")
+    widget = fitz.Widget()
+    widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+    widget.field_name = f"field_{page.number}"
+    widget.field_value = "filled in"
+    widget.rect = fitz.Rect(40, 500, 300, 530)
+    page.add_widget(widget)
+
+
+def _build_pdf(pdf_path: str, pages: int, fill, page_sizes=None) -> None:
+    rng = random.Random(f"{SEED}-{os.path.basename(pdf_path)}")
+    doc = fitz.open()
+    for page_number in range(pages):
+        width, height = page_sizes[page_number % len(page_sizes)] if page_sizes else PAGE_SIZES[0]
+        fill(doc.new_page(width=width, height=height), rng)
+    doc.set_metadata({"producer": "benchmarks.corpus", "creationDate": "", "modDate": ""})
+    # garbage=3 and above deduplicate objects pairwise, which takes minutes on thousands of pages.
+    doc.save(pdf_path, garbage=1, deflate=True)
+    doc.close()
+
+
+def build_synthetic_pdf(pdf_path: str, pages: int) -> None:
+    """Write a document with some text and vector graphics on every page."""
+    def fill(page: fitz.Page, rng: random.Random) -> None:
+        _text_page(page, rng)
+        _vector_page(page, rng, shapes=20)
+    _build_pdf(pdf_path, pages, fill)
+
+
+def _short_text_page(page: fitz.Page, rng: random.Random) -> None:
+    _text_page(page, rng, lines=10)
+
+
+def generate_pdf_corpus(folder: str, pages: int = 50, large_pages: Sequence[int] = (1000,)) -> Dict[str, str]:
+    """Create (or reuse) the PDF corpus and return {case name: path}."""
+    os.makedirs(folder, exist_ok=True)
+    cases = {
+        "text_only": (pages, _text_page, None),
+        "vector_heavy": (pages, _vector_page, None),
+        "image_heavy": (pages, _image_page, None),
+        "annotated_forms": (pages, _annotated_page, None),
+        "mixed_page_sizes": (pages, _text_page, PAGE_SIZES),
+    }
+    for page_count in large_pages:
+        cases[f"large_{page_count}_pages"] = (page_count, _short_text_page, None)
+    paths = {}
+    for name, (page_count, fill, page_sizes) in cases.items():
+        pdf_path = os.path.join(folder, f"{name}.pdf")
+        if not os.path.exists(pdf_path):
+            _build_pdf(pdf_path, page_count, fill, page_sizes)
+        paths[name] = pdf_path
+    return paths
+
+
+def synthetic_image(mode: str, size: int) -> Image.Image:
+    """A deterministic gradient-like image in the given mode."""
+    base = Image.linear_gradient("L").resize((size, size))
+    if mode == "I;16":
+        return base.convert("I").point(lambda x: x * 257).convert("I;16")
+    if mode == "P":
+        return Image.merge("RGB", (base, base.rotate(90), base.rotate(180))).quantize(256)
+    if mode in ("L", "RGB", "CMYK"):
+        return base.convert(mode)
+    image = Image.merge("RGB", (base, base.rotate(90), base.rotate(180)))
+    image.putalpha(base.rotate(270))
+    return image.convert(mode)
+
+
+def generate_image_corpus(folder: str, sizes=IMAGE_SIZES, modes=IMAGE_MODES) -> Dict[str, str]:
+    """Create (or reuse) one PNG per (mode, size) and return {case name: path}."""
+    os.makedirs(folder, exist_ok=True)
+    paths = {}
+    for mode in modes:
+        for size in sizes:
+            name = f"{mode.replace(';', '')}_{size}"
+            img_path = os.path.join(folder, f"{name}.png")
+            if not os.path.exists(img_path):
+                synthetic_image(mode, size).save(img_path)
+            paths[name] = img_path
+    return paths
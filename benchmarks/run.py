@@ -0,0 +1,205 @@
+"""Run the benchmark suite on the synthetic corpus and write the results as JSON.
+
+Usage:
+    python -m benchmarks.run [--corpus-dir DIR] [--pages N] [--large-pages 1000 10000]
+                             [--image-sizes 256 1024 4096] [--repeat N] [--output results.json]
+                             [--pdf-mode copy] [--timeout 600]
+                             [--baseline old.json] [--threshold 0.10]
+
+Every case runs in a freshly spawned process, so peak RSS belongs to that case alone. Cases
+call the real entry points, PDFInverter.invert_pdf and ImageInverter.invert_png_file, and
+report the stages their StageTimer recorded. With --baseline, a case slower (or heavier) than the
+baseline by more than --threshold is reported as a regression and the exit status is 1.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, "invert_pdf_reader")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmarks import corpus
+from configuration import config
+
+COMPARED_METRICS = ("seconds", "peak_rss_bytes")
+CASE_TIMEOUT = 600  # seconds a single run may take before its process is killed
+
+
+def measure_pdf(pdf_path: str, output_folder: str, mode: str) -> dict:
+    """Invert a PDF with PDFInverter.invert_pdf and report the stages its StageTimer recorded."""
+    from inverter import PDFInverter
+
+    result = PDFInverter.invert_pdf(pdf_path, mode, input_folder=os.path.dirname(pdf_path), output_folder=output_folder)
+    if result.status != "ok":
+        raise RuntimeError(result.error)
+    return {"pages": result.pages, "bytes_in": os.path.getsize(pdf_path), "bytes_out": result.bytes_out,
+            "seconds": result.seconds, "stages": dict(result.stages)}
+
+
+def measure_image(img_path: str, output_folder: str) -> dict:
+    """Invert an image with ImageInverter.invert_png_file and report the stages its StageTimer recorded."""
+    from PIL import Image
+    from inverter import ImageInverter
+
+    result = ImageInverter.invert_png_file(img_path, os.path.dirname(img_path), output_folder)
+    if result.status != "ok":
+        raise RuntimeError(result.error)
+    with Image.open(img_path) as image:
+        pixels, mode = image.width * image.height, image.mode
+    return {"pages": result.pages, "pixels": pixels, "mode": mode, "bytes_in": os.path.getsize(img_path),
+            "bytes_out": result.bytes_out, "seconds": result.seconds, "stages": dict(result.stages)}
+
+
+def _child(function_name: str, input_path: str, args: tuple, queue) -> None:
+    """Child process body: run one measurement and report it together with the peak RSS."""
+    import utils
+
+    with tempfile.TemporaryDirectory(prefix="bench_out_") as output_folder:
+        try:
+            measurement = globals()[function_name](input_path, output_folder, *args)
+        except Exception as e:
+            queue.put({"error": str(e)})
+            return
+    measurement["peak_rss_bytes"] = utils.memory_handler.peak_rss_bytes()
+    queue.put(measurement)
+
+
+def run_isolated(function_name: str, input_path: str, args: tuple = (), timeout: float = CASE_TIMEOUT) -> dict:
+    """Run one measurement in a spawned process; a child that hangs is killed after timeout seconds."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_child, args=(function_name, input_path, args, results))
+    process.start()
+    deadline = time.monotonic() + timeout
+    measurement = None
+    while measurement is None:
+        try:
+            measurement = results.get(timeout=1)
+        except queue.Empty:
+            if process.exitcode is not None:
+                # The child may have exited right after reporting; give its last put a moment.
+                try:
+                    measurement = results.get(timeout=1)
+                except queue.Empty:
+                    measurement = {"error": f"benchmark process exited with code {process.exitcode}"}
+            elif time.monotonic() > deadline:
+                process.kill()
+                measurement = {"error": f"timed out after {timeout:.0f} s"}
+    process.join()
+    return measurement
+
+
+def run_case(function_name: str, input_path: str, repeat: int, args: tuple = (), timeout: float = CASE_TIMEOUT) -> dict:
+    """Best of repeat runs by total time, with throughput derived from that run."""
+    best = None
+    for _ in range(repeat):
+        measurement = run_isolated(function_name, input_path, args, timeout)
+        if "error" in measurement:
+            return measurement
+        if best is None or measurement["seconds"] < best["seconds"]:
+            best = measurement
+    seconds = best["seconds"] or float("inf")
+    best["pages_per_second"] = best["pages"] / seconds
+    best["mb_per_second"] = best["bytes_in"] / 2**20 / seconds
+    if "pixels" in best:
+        best["megapixels_per_second"] = best["pixels"] / 1e6 / seconds
+    return best
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Return one line per case and metric that got worse than the baseline by more than threshold."""
+    regressions = []
+    for kind in ("pdf", "image"):
+        for name, current in results.get(kind, {}).items():
+            previous = baseline.get(kind, {}).get(name)
+            if not previous or "error" in current or "error" in previous:
+                continue
+            for metric in COMPARED_METRICS:
+                if previous.get(metric) and current[metric] > previous[metric] * (1 + threshold):
+                    change = current[metric] / previous[metric] - 1
+                    regressions.append(f"{kind}/{name} {metric}: {previous[metric]:.4g} -> {current[metric]:.4g} (+{change:.0%})")
+    return regressions
+
+
+def print_table(kind: str, cases: Dict[str, dict]) -> None:
+    print(f"\n{kind:<24}{'seconds':>10}{'pages/s':>10}{'MB/s':>9}{'peak RSS MB':>13}  stages")
+    for name, case in cases.items():
+        if "error" in case:
+            print(f"{name:<24}  failed: {case['error']}")
+            continue
+        stages = ", ".join(f"{stage} {seconds:.3f}" for stage, seconds in case["stages"].items())
+        print(f"{name:<24}{case['seconds']:>10.3f}{case['pages_per_second']:>10.1f}{case['mb_per_second']:>9.1f}"
+              f"{case['peak_rss_bytes'] / 2**20:>13.1f}  {stages}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "invert_pdf_reader_corpus"),
+                        help="where the corpus is generated and reused between runs")
+    parser.add_argument("--pages", type=int, default=50, help="pages in each regular PDF case")
+    parser.add_argument("--large-pages", type=int, nargs="*", default=[1000], help="page counts of the large PDF cases")
+    parser.add_argument("--image-sizes", type=int, nargs="*", default=list(corpus.IMAGE_SIZES), help="square image edge lengths")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest is kept")
+    parser.add_argument("--pdf-mode", default=config.PDF_INVERSION_MODE, help="mode PDF cases are inverted with")
+    parser.add_argument("--timeout", type=float, default=CASE_TIMEOUT, help="seconds before a hung run is killed")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before a case counts as a regression")
+    args = parser.parse_args()
+
+    pdf_cases = corpus.generate_pdf_corpus(os.path.join(args.corpus_dir, "pdf"), args.pages, args.large_pages)
+    image_cases = corpus.generate_image_corpus(os.path.join(args.corpus_dir, "images"), args.image_sizes)
+
+    results = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pdf_mode": args.pdf_mode,
+        "pdf": {name: run_case("measure_pdf", path, args.repeat, (args.pdf_mode,), args.timeout)
+                for name, path in pdf_cases.items()},
+        "image": {name: run_case("measure_image", path, args.repeat, timeout=args.timeout)
+                  for name, path in image_cases.items()},
+    }
+    print_table("pdf", results["pdf"])
+    print_table("image", results["image"])
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.threshold)
+    print(f"Compared with {args.baseline} ({baseline.get('commit', 'unknown')[:12]}), threshold {args.threshold:.0%}")
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if not regressions:
+        print("No regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,47 @@
+import os
+
 INPUT_FOLDER = "input"
 OUTPUT_FOLDER = "output"
-COLOR_NUMBER = 255
\ No newline at end of file
+COLOR_NUMBER = 255
+BATCH_WORKERS = os.cpu_count() or 1
+INDEX_WINDOW = 1024  # files the input index holds back to hand them out largest first
+SHARD_MIN_PAGES = 50
+PDF_INVERSION_MODE = "copy"  # "copy" rebuilds every page, "incremental" edits pages in place, "chunked" bounds memory, "recolor" rewrites content colors
+TILED_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes of image strips in flight in tiled mode
+TILED_WORKERS = 1
+CACHE_FOLDER = "cache"
+CACHE_MAX_BYTES = 5 * 1024 ** 3
+CACHE_MAX_AGE_DAYS = 30
+WATCH_QUEUE_SIZE = 256
+WATCH_DEBOUNCE_SECONDS = 2.0  # a file must stop changing for this long before it is queued
+WATCH_METRICS_INTERVAL = 60
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8080
+SERVICE_WORKERS = BATCH_WORKERS
+SERVICE_MAX_PENDING = 2 * SERVICE_WORKERS  # requests admitted at once; more get 429
+SERVICE_MAX_BODY_BYTES = 512 * 1024 * 1024
+SERVICE_CHUNK_SIZE = 64 * 1024
+SERVICE_LATENCY_WINDOW = 1000  # most recent requests used for the latency percentiles
+METRICS_ENABLED = True
+METRICS_FILE = None  # e.g. "logs/metrics.prom"; written after each batch and watch metrics report
+METRICS_FORMAT = "prometheus"  # "prometheus" text exposition or "jsonl"
+PROFILE_DOCUMENT = None  # file name to capture with cProfile and tracemalloc when it is inverted
+PROFILE_FOLDER = os.path.join("logs", "profiles")
+LOG_FILE = os.path.join("logs", "app.log")
+RENDER_CACHE_BYTES = 256 * 1024 * 1024  # rendered pixmaps kept by InvertedDocument
+RENDER_PREFETCH_PAGES = 2  # pages after the current one rendered ahead in the background
+EXPORT_DPI = 150
+EXPORT_FORMAT = "png"  # "png", "jpeg" or "webp"
+EXPORT_QUALITY = 85  # JPEG and WebP quality
+EXPORT_WORKERS = BATCH_WORKERS
+CHUNK_MEMORY_BUDGET = 256 * 1024 * 1024  # bytes of pages held at once in chunked mode
+CHUNK_MEMORY_FACTOR = 8  # in-memory size of a page in flight relative to its share of the file
+CHUNK_MAX_PAGES = 500
+JOB_MAX_ATTEMPTS = 3  # attempts per file, across resumed runs, before a job gives up on it
+MERGE_WORKERS = BATCH_WORKERS  # images decoded at once when merging images into a PDF
+MERGE_COMPRESS_LEVEL = 6  # zlib level of decoded images written to a merged PDF
+PDF_COMPRESS_OUTPUT = False  # run the compression stage on every inverted PDF
+COMPRESS_IMAGE_DPI = 150  # resolution images are downsampled to, at the size they are displayed
+COMPRESS_DPI_THRESHOLD = 1.5  # only images above COMPRESS_IMAGE_DPI by this factor are downsampled
+COMPRESS_JPEG_QUALITY = 75
+COMPRESS_WORKERS = BATCH_WORKERS
@@ -1,12 +1,58 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 
-# Ensure the logs directory exists
-os.makedirs('logs', exist_ok=True)
+from . import config
 
-logging.basicConfig(
-    filename='logs/app.log',
-    filemode='a',
-    level=logging.INFO, # Info level to log general information, also shows errors
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
\ No newline at end of file
+_queue_handler = None
+_file_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def _start_listener() -> None:
+    global _listener
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, _file_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def _restart_listener_in_child() -> None:
+    """A forked worker inherits the queue but not the listener thread, so give it its own."""
+    _queue_handler.queue = queue.SimpleQueue()
+    _start_listener()
+    # Pool workers leave through os._exit, which skips atexit but runs multiprocessing finalizers.
+    import multiprocessing.util
+    multiprocessing.util.Finalize(None, _listener.stop, exitpriority=0)
+
+
+def setup_logging() -> None:
+    """Send the root logger to config.LOG_FILE through a background writer thread.
+
+    Entry points call this once; importing the package has no side effects. Further calls
+    do nothing.
+    """
+    global _queue_handler, _file_handler
+    with _setup_lock:
+        if _queue_handler is not None:
+            return
+        # Ensure the logs directory exists
+        os.makedirs(os.path.dirname(config.LOG_FILE), exist_ok=True)
+
+        # Callers only enqueue records; a listener thread formats them and writes the file, so a
+        # slow disk never stalls the inversion loops.
+        _file_handler = logging.FileHandler(config.LOG_FILE, mode='a')
+        _file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        _queue_handler.setFormatter(logging.Formatter('%(message)s'))
+
+        logging.basicConfig(
+            level=logging.INFO, # Info level to log general information, also shows errors
+            handlers=[_queue_handler],
+        )
+        _start_listener()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_restart_listener_in_child)
@@ -0,0 +1,293 @@
+"""Batch inversion engine that spreads many PDFs over a pool of worker processes."""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import math
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cache import CachedPDFInverter, ResultCache
+from configuration import config
+from inverter import PDF_SAVE_OPTIONS, InversionResult, PDFInverter
+import utils
+
+fitz = utils.pdf_handler.fitz
+
+
+class BatchInverter:
+    """Inverts a list of PDFs concurrently, largest files first, one process per worker."""
+
+    def order_by_size(pdf_paths: List[str]) -> List[str]:
+        """Sort paths so the largest files are scheduled first and the tail stays short."""
+        def size_of(path: str) -> int:
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                return 0
+        return sorted(pdf_paths, key=size_of, reverse=True)
+
+    def _invert_into(path: str, output_folder: str) -> InversionResult:
+        """Worker body: invert a PDF from its own folder into output_folder."""
+        return PDFInverter.invert_pdf(path, input_folder=os.path.dirname(path), output_folder=output_folder)
+
+    def _pool_pass(function: Callable, tasks: Iterable[Tuple[str, tuple]], workers: int,
+                   failed: Callable[[InversionResult], Any], crashed: Optional[list]) -> Iterator[Tuple[str, Any]]:
+        """Run one pool over the tasks, yielding (path, outcome) as each finishes.
+
+        Tasks whose worker died go to crashed when it is a list, and are yielded as crashed otherwise.
+        """
+        in_flight = {}
+
+        def crash(task: Tuple[str, tuple], error: Exception) -> Iterator[Tuple[str, Any]]:
+            if crashed is not None:
+                crashed.append(task)
+            else:
+                yield task[0], failed(InversionResult(input_path=task[0], status="crashed", error=str(error)))
+
+        def settle(futures) -> Iterator[Tuple[str, Any]]:
+            for future in futures:
+                task = in_flight.pop(future)
+                try:
+                    outcome = future.result()
+                except BrokenProcessPool as e:
+                    yield from crash(task, e)
+                    continue
+                except Exception as e:
+                    outcome = failed(InversionResult(input_path=task[0], error=str(e)))
+                yield task[0], outcome
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for task in tasks:
+                try:
+                    in_flight[executor.submit(function, *task[1])] = task
+                except BrokenProcessPool as e:
+                    yield from crash(task, e)
+                    continue
+                if len(in_flight) >= 2 * workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    yield from settle(done)
+            yield from settle(list(as_completed(list(in_flight))))
+
+    def run_in_pool(function: Callable, tasks: Iterable[Tuple[str, tuple]], workers: int,
+                    failed: Optional[Callable[[InversionResult], Any]] = None) -> Iterator[Tuple[str, Any]]:
+        """Run function(*args) for every (path, args) task on a process pool; yield (path, outcome) once final.
+
+        Tasks are submitted as they arrive, at most two per worker ahead, so a slow generator of
+        tasks overlaps with the work. Exceptions become failed InversionResults, passed through
+        failed (if given) to match what function returns.
+
+        A hard crash (e.g. a segfault inside MuPDF) breaks the whole pool and fails every task
+        still queued on it. Those tasks run again on a fresh pool of the same size, and the ones
+        that crash again get a process each, so only a file that crashes on its own is reported
+        as crashed.
+        """
+        failed = failed or (lambda result: result)
+        crashed: List[Tuple[str, tuple]] = []
+        yield from BatchInverter._pool_pass(function, tasks, workers, failed, crashed)
+        if len(crashed) > 1:
+            retry, crashed = crashed, []
+            yield from BatchInverter._pool_pass(function, retry, min(workers, len(retry)), failed, crashed)
+        for task in crashed:
+            yield from BatchInverter._pool_pass(function, [task], 1, failed, None)
+
+    def invert_pdfs(pdf_paths: List[str], workers: int = config.BATCH_WORKERS,
+                    cache: Optional[ResultCache] = None) -> List[InversionResult]:
+        """Invert every path and return one result per file, in scheduling order.
+
+        With a cache, hits are served in this process and only the misses reach the workers.
+        """
+        ordered = BatchInverter.order_by_size(pdf_paths)
+        results: Dict[str, InversionResult] = {}
+        cache_keys: Dict[str, Optional[str]] = {}
+        if cache:
+            for path in ordered:
+                cache_keys[path], cached = CachedPDFInverter.fetch(path, cache)
+                if cached:
+                    results[path] = cached
+        pending = [path for path in ordered if path not in results]
+
+        workers = max(1, min(workers, len(pending) or 1))
+        if workers == 1:
+            results.update((path, PDFInverter.invert_pdf(path)) for path in pending)
+        else:
+            tasks = ((path, (path,)) for path in pending)
+            for path, result in BatchInverter.run_in_pool(PDFInverter.invert_pdf, tasks, workers):
+                results[path] = result
+                # Workers record into their own registries; count the final result here as well.
+                utils.metrics_handler.get_registry().record_file("pdf", result)
+
+        if cache:
+            for path in pending:
+                CachedPDFInverter.store(cache_keys[path], results[path], cache)
+            logging.info(f"Result cache statistics: {cache.stats()}")
+        return [results[path] for path in ordered]
+
+    def invert_pdfs_in_folder(input_folder: str, workers: int = config.BATCH_WORKERS,
+                              cache: Optional[ResultCache] = None, recursive: bool = True) -> List[InversionResult]:
+        """Invert all PDFs under the folder with a pool of workers and log a summary.
+
+        Files come from the input index (utils.index_handler): found by content, largest first
+        within INDEX_WINDOW, and submitted while the tree is still being walked. Each file is
+        written to the subfolder of OUTPUT_FOLDER matching its own.
+        """
+        if not utils.file_handler.exists_folder(input_folder):
+            return []
+        output_root = config.OUTPUT_FOLDER
+        ordered: List[str] = []
+        results: Dict[str, InversionResult] = {}
+        cache_keys: Dict[str, Optional[str]] = {}
+
+        def work() -> Iterator[Tuple[str, str]]:
+            """Yield the files to invert, serving cache hits on the way."""
+            items = utils.index_handler.index_files(input_folder, kinds=(utils.index_handler.PDF_KIND,),
+                                                    recursive=recursive, window=config.INDEX_WINDOW)
+            for item in items:
+                if not utils.pdf_handler.is_pdf_file(item.path):
+                    continue  # the inverter only takes .pdf names
+                output_folder = os.path.join(output_root, os.path.dirname(item.relative_path))
+                os.makedirs(output_folder, exist_ok=True)
+                ordered.append(item.path)
+                if cache:
+                    cache_keys[item.path], cached = CachedPDFInverter.fetch(
+                        item.path, cache, input_folder=os.path.dirname(item.path), output_folder=output_folder)
+                    if cached:
+                        results[item.path] = cached
+                        continue
+                yield item.path, output_folder
+
+        if workers <= 1:
+            for path, output_folder in work():
+                results[path] = BatchInverter._invert_into(path, output_folder)
+        else:
+            tasks = ((path, (path, output_folder)) for path, output_folder in work())
+            for path, result in BatchInverter.run_in_pool(BatchInverter._invert_into, tasks, workers):
+                results[path] = result
+                utils.metrics_handler.get_registry().record_file("pdf", result)
+
+        if cache:
+            for path in ordered:
+                if not results[path].cache_hit:
+                    CachedPDFInverter.store(cache_keys[path], results[path], cache)
+            logging.info(f"Result cache statistics: {cache.stats()}")
+        results = [results[path] for path in ordered]
+
+        succeeded = sum(1 for result in results if result.status == "ok")
+        cached = sum(1 for result in results if result.cache_hit)
+        pages = sum(result.pages for result in results)
+        baked = sum(result.pages_baked for result in results if not result.cache_hit)
+        inverted_pages = sum(result.pages for result in results if not result.cache_hit)
+        logging.info(
+            f"Completed batch inversion of {input_folder}: {succeeded}/{len(results)} files "
+            f"({cached} from cache), {pages} pages with {workers} workers; "
+            f"{baked} pages baked, {inverted_pages - baked} skipped baking"
+        )
+        for result in results:
+            if result.status != "ok":
+                logging.error(f"Batch inversion {result.status} for {result.input_path}: {result.error}")
+        if config.METRICS_FILE:
+            utils.metrics_handler.get_registry().export(config.METRICS_FILE, config.METRICS_FORMAT)
+        return results
+
+
+class ShardedInverter:
+    """Inverts a single large PDF by splitting its page range across worker processes."""
+
+    def page_ranges(page_count: int, workers: int) -> List[range]:
+        """Split the page range into contiguous chunks of at least SHARD_MIN_PAGES pages."""
+        chunk_size = max(config.SHARD_MIN_PAGES, math.ceil(page_count / max(1, workers)))
+        return [range(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+
+    def _invert_shard(source_path: str, page_range: range, segment_path: str,
+                      stamps: Optional[utils.stamp_handler.Stamps] = None) -> Tuple[int, int]:
+        """Invert one page range with its own fitz documents and save it as a segment.
+
+        Stamps are numbered as in the whole source. Returns the reused object count and the
+        number of baked pages.
+        """
+        source_doc = fitz.open(source_path)
+        output_doc = fitz.open()
+        try:
+            registry, pages_baked = PDFInverter._invert_pages(source_doc, output_doc, page_range, stamps=stamps)
+            output_doc.save(segment_path)
+            return registry.deduplicated, pages_baked
+        finally:
+            output_doc.close()
+            source_doc.close()
+
+    def invert_pdf(path_file: str, workers: int = config.BATCH_WORKERS, mode: str = "copy",
+                   compress: bool = config.PDF_COMPRESS_OUTPUT, stamps: Optional[utils.stamp_handler.Stamps] = None,
+                   input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
+        """Invert one PDF with its pages sharded over a process pool, joining the shards in order.
+
+        Shards rebuild their pages as mode "copy" does, which is the only mode accepted; compress,
+        stamps and the folders are as in PDFInverter.invert_pdf. A file too small to split is
+        handed to PDFInverter.invert_pdf.
+        """
+        if mode != "copy":
+            logging.error(f"Sharded inversion only supports mode copy, not {mode}")
+            return InversionResult(input_path=path_file, error=f"Sharded inversion only supports mode copy, not {mode}")
+        start = time.perf_counter()
+        input_folder = config.INPUT_FOLDER if input_folder is None else input_folder
+        output_folder = config.OUTPUT_FOLDER if output_folder is None else output_folder
+        result = InversionResult(input_path=path_file)
+        pdf_filename = os.path.basename(path_file)
+        source_doc = utils.pdf_handler.get_pdf_file(input_folder, pdf_filename)
+        if not source_doc:
+            result.error = f"Could not open {pdf_filename}"
+            return result
+        source_path = source_doc.name
+        page_ranges = ShardedInverter.page_ranges(len(source_doc), workers)
+        source_doc.close()
+
+        if len(page_ranges) <= 1:
+            return PDFInverter.invert_pdf(path_file, mode, compress, stamps, input_folder, output_folder)
+
+        try:
+            with tempfile.TemporaryDirectory(prefix="invert_shards_") as segment_dir:
+                segment_paths = [
+                    os.path.join(segment_dir, f"segment_{index:05d}.pdf") for index in range(len(page_ranges))
+                ]
+                with ProcessPoolExecutor(max_workers=min(workers, len(page_ranges))) as executor:
+                    futures = [
+                        executor.submit(ShardedInverter._invert_shard, source_path, page_range, segment_path, stamps)
+                        for page_range, segment_path in zip(page_ranges, segment_paths)
+                    ]
+                    for future in futures:
+                        deduplicated, pages_baked = future.result()
+                        result.objects_deduplicated += deduplicated
+                        result.pages_baked += pages_baked
+
+                pdf_output_path = os.path.join(output_folder, f"inverted_{pdf_filename}")
+                pages = utils.pdf_handler.merge_pdf_files(segment_paths, pdf_output_path, **PDF_SAVE_OPTIONS)
+            if pages is None:
+                raise RuntimeError(f"could not join the shards into {pdf_output_path}")
+            logging.info(f"Inverted PDF saved to {pdf_output_path} from {len(page_ranges)} shards")
+            result.status = "ok"
+            result.output_path = pdf_output_path
+            result.pages = pages
+            result.bytes_out = os.path.getsize(pdf_output_path)
+        except Exception as e:
+            logging.error(f"Failed to invert PDF {pdf_filename} in shards: {e}")
+            result.error = str(e)
+        finally:
+            result.seconds = time.perf_counter() - start
+        if compress and result.status == "ok":
+            PDFInverter._compress_output(result)
+        utils.metrics_handler.get_registry().record_file("pdf", result)
+        return result
+
+
+def invert_pdfs_in_folder(input_folder: str, workers: int = config.BATCH_WORKERS,
+                          cache: Optional[ResultCache] = None, recursive: bool = True) -> List[InversionResult]:
+    """Wrapper function to invert all PDFs in a folder tree with a process pool."""
+    return BatchInverter.invert_pdfs_in_folder(input_folder, workers, cache, recursive)
+
+
+def invert_pdf_sharded(path_file: str, workers: int = config.BATCH_WORKERS, mode: str = "copy",
+                       compress: bool = config.PDF_COMPRESS_OUTPUT,
+                       stamps: Optional[utils.stamp_handler.Stamps] = None) -> InversionResult:
+    """Wrapper function to invert one large PDF across several processes."""
+    return ShardedInverter.invert_pdf(path_file, workers, mode, compress, stamps)
@@ -0,0 +1,195 @@
+"""Content-addressed cache of inversion outputs, so unchanged inputs are never inverted twice."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from typing import Dict, Optional, Tuple
+
+from configuration import config
+from inverter import INVERTER_VERSION, InversionResult, PDFInverter
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ResultCache:
+    """Maps a hash of (input bytes, inverter version, options) to a stored output file.
+
+    The index is a SQLite database next to the cached files. Entries are evicted by age and,
+    least recently used first, by total size. Hit/miss counters cover the lifetime of the object.
+    """
+
+    def __init__(self, cache_folder: str = config.CACHE_FOLDER, max_bytes: int = config.CACHE_MAX_BYTES,
+                 max_age_days: float = config.CACHE_MAX_AGE_DAYS):
+        os.makedirs(cache_folder, exist_ok=True)
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = sqlite3.connect(os.path.join(cache_folder, "index.sqlite3"))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, file_name TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "pages INTEGER NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def key_for(input_path: str, options: Optional[dict] = None) -> str:
+        """Hash the input bytes together with the inverter version and the options."""
+        digest = hashlib.sha256()
+        digest.update(json.dumps({"version": INVERTER_VERSION, "options": options or {}}, sort_keys=True).encode())
+        with open(input_path, "rb") as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _place(source_path: str, target_path: str) -> None:
+        """Hard-link source to target, copying when links are not possible (e.g. across devices)."""
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        try:
+            os.link(source_path, target_path)
+        except OSError:
+            shutil.copyfile(source_path, target_path)
+
+    def fetch(self, key: str, output_path: str) -> Optional[int]:
+        """Place the cached output for key at output_path and return its page count, or None on a miss.
+
+        Cached files are shared with the outputs through hard links, so an entry whose file was
+        overwritten since it was stored (size or mtime changed) is dropped instead of served.
+        """
+        row = self._db.execute("SELECT file_name, size, mtime_ns, pages FROM entries WHERE key = ?", (key,)).fetchone()
+        if row:
+            file_name, size, mtime_ns, pages = row
+            cached_path = os.path.join(self.cache_folder, file_name)
+            try:
+                stat = os.stat(cached_path)
+                valid = stat.st_size == size and stat.st_mtime_ns == mtime_ns
+            except FileNotFoundError:
+                valid = False
+            if not valid:
+                self._remove(key, file_name)
+                self._db.commit()
+                row = None
+        if not row:
+            self.misses += 1
+            return None
+
+        # Outputs that are still linked to the cached file are skipped entirely.
+        if not (os.path.exists(output_path) and os.path.samefile(cached_path, output_path)):
+            ResultCache._place(cached_path, output_path)
+        self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        self.hits += 1
+        return pages
+
+    def store(self, key: str, output_path: str, pages: int = 0) -> None:
+        """Add a freshly written output to the cache, then evict to stay within bounds."""
+        file_name = f"{key}{os.path.splitext(output_path)[1]}"
+        cached_path = os.path.join(self.cache_folder, file_name)
+        ResultCache._place(output_path, cached_path)
+        stat = os.stat(cached_path)
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries (key, file_name, size, mtime_ns, pages, created, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, file_name, stat.st_size, stat.st_mtime_ns, pages, now, now),
+        )
+        self._db.commit()
+        self.evict()
+
+    def _remove(self, key: str, file_name: str) -> None:
+        try:
+            os.remove(os.path.join(self.cache_folder, file_name))
+        except FileNotFoundError:
+            pass
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self.evictions += 1
+
+    def evict(self) -> None:
+        """Drop entries older than max_age_days, then least recently used ones above max_bytes."""
+        cutoff = time.time() - self.max_age_days * 86400
+        for key, file_name in self._db.execute("SELECT key, file_name FROM entries WHERE last_used < ?", (cutoff,)).fetchall():
+            self._remove(key, file_name)
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            for key, file_name, size in self._db.execute("SELECT key, file_name, size FROM entries ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._remove(key, file_name)
+                total -= size
+        self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters plus the current size of the cache."""
+        entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": total,
+        }
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class CachedPDFInverter:
+    """Runs PDFInverter only for inputs whose content-addressed result is not cached yet."""
+
+    def fetch(path_file: str, cache: ResultCache, mode: str = config.PDF_INVERSION_MODE,
+              input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> Tuple[Optional[str], Optional[InversionResult]]:
+        """Return (cache key, result); the result is set only on a hit, with the output already in place.
+
+        input_folder and output_folder default to INPUT_FOLDER and OUTPUT_FOLDER.
+        """
+        start = time.perf_counter()
+        pdf_filename = os.path.basename(path_file)
+        pdf_input_path = os.path.join(config.INPUT_FOLDER if input_folder is None else input_folder, pdf_filename)
+        pdf_output_path = os.path.join(config.OUTPUT_FOLDER if output_folder is None else output_folder,
+                                       f"inverted_{pdf_filename}")
+        try:
+            options = {"mode": mode, "compress": True} if config.PDF_COMPRESS_OUTPUT else {"mode": mode}
+            key = ResultCache.key_for(pdf_input_path, options)
+        except OSError as e:
+            logging.error(f"Could not hash {pdf_input_path}: {e}")
+            return None, None
+
+        pages = cache.fetch(key, pdf_output_path)
+        if pages is None:
+            return key, None
+
+        logging.info(f"Cache hit for {pdf_filename}, linked to {pdf_output_path}")
+        return key, InversionResult(
+            input_path=path_file,
+            status="ok",
+            output_path=pdf_output_path,
+            pages=pages,
+            seconds=time.perf_counter() - start,
+            bytes_out=os.path.getsize(pdf_output_path),
+            cache_hit=True,
+        )
+
+    def store(key: Optional[str], result: InversionResult, cache: ResultCache) -> None:
+        """Cache a successful result under the key returned by fetch."""
+        if key and result.status == "ok":
+            cache.store(key, result.output_path, result.pages)
+
+    def invert_pdf(path_file: str, cache: ResultCache, mode: str = config.PDF_INVERSION_MODE) -> InversionResult:
+        """Serve the inverted PDF from the cache, or invert it and cache the output."""
+        key, cached = CachedPDFInverter.fetch(path_file, cache, mode)
+        if cached:
+            return cached
+
+        result = PDFInverter.invert_pdf(path_file, mode, config.PDF_COMPRESS_OUTPUT)
+        CachedPDFInverter.store(key, result, cache)
+        return result
@@ -0,0 +1,291 @@
+"""Make PDFs smaller: deduplicate images, downsample and re-encode them, compress bare streams.
+
+Identical images (same stream and dictionary) are merged into one object. Every remaining
+8-bit gray or RGB image drawn at more than COMPRESS_IMAGE_DPI * COMPRESS_DPI_THRESHOLD, at
+the largest size it is displayed on any page, is resampled to COMPRESS_IMAGE_DPI; JPEG images
+are also re-encoded at COMPRESS_JPEG_QUALITY. Streams saved without a filter are deflated.
+Decoding, resampling and encoding run on a thread pool; fitz is only used from the calling
+thread. A new encoding is only kept when it is smaller than the old one.
+"""
+
+from __future__ import annotations  # annotations must not trigger the lazy fitz/Pillow imports
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import logging
+import math
+import os
+import re
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from configuration import config
+from inverter import PDF_SAVE_OPTIONS, InversionResult
+from recolor import ContentRecolorer, RecolorUnsupported
+import utils
+
+fitz = utils.pdf_handler.fitz
+Image = utils.image_handler.Image
+PDFImage = utils.image_handler.PDFImage
+
+REFERENCE = re.compile(r"\b(\d+) 0 R\b")
+IMAGE_MODES = {"gray": "L", "rgb": "RGB"}
+MIN_IMAGE_BYTES = 4096  # smaller images are not worth decoding
+MIN_SAVING = 0.1  # a lossy re-encoding must save at least this share of the image to be kept
+
+
+class PDFCompressor:
+    """Shrinks a PDF in place of, or after, an inversion."""
+
+    def _image_xrefs(doc: fitz.Document) -> List[int]:
+        """Every image XObject in the document."""
+        return [xref for xref in range(1, doc.xref_length())
+                if doc.xref_is_stream(xref) and doc.xref_get_key(xref, "Subtype")[1] == "/Image"]
+
+    def _content_digest(doc: fitz.Document, xref: int, digests: Dict[int, bytes]) -> bytes:
+        """Hash of an object's dictionary and stream, with references hashed by content too.
+
+        Two images with equal copies of the same ICC profile or soft mask get the same digest.
+        """
+        if xref in digests:
+            return digests[xref]
+        digests[xref] = b"cycle"
+        dictionary = re.sub(r"/Length \d+", "", doc.xref_object(xref, compressed=True))
+        digest = hashlib.sha256(REFERENCE.sub(
+            lambda ref: PDFCompressor._content_digest(doc, int(ref.group(1)), digests).hex(), dictionary).encode())
+        if doc.xref_is_stream(xref):
+            digest.update(b"\0" + doc.xref_stream_raw(xref))
+        digests[xref] = digest.digest()
+        return digests[xref]
+
+    def deduplicate_images(doc: fitz.Document) -> Tuple[Dict[int, int], int]:
+        """Point every reference to a duplicate image at its first copy.
+
+        Returns {duplicate xref: kept xref} and the bytes of the duplicates, which the save drops.
+        """
+        canonical: Dict[int, int] = {}
+        first_by_digest: Dict[bytes, int] = {}
+        digests: Dict[int, bytes] = {}
+        saved = 0
+        for xref in PDFCompressor._image_xrefs(doc):
+            digest = PDFCompressor._content_digest(doc, xref, digests)
+            if digest in first_by_digest:
+                canonical[xref] = first_by_digest[digest]
+                saved += len(doc.xref_stream_raw(xref))
+            else:
+                first_by_digest[digest] = xref
+        if canonical:
+            PDFCompressor._redirect_references(doc, canonical)
+        return canonical, saved
+
+    def _redirect_references(doc: fitz.Document, canonical: Dict[int, int]) -> None:
+        """Rewrite "n 0 R" for every n in canonical in all object dictionaries; streams keep their data."""
+        def redirect(ref: re.Match) -> str:
+            return f"{canonical.get(int(ref.group(1)), ref.group(1))} 0 R"
+
+        for xref in range(1, doc.xref_length()):
+            if xref in canonical:
+                continue
+            text = doc.xref_object(xref, compressed=True)
+            updated = REFERENCE.sub(redirect, text)
+            if updated != text:
+                doc.update_object(xref, updated)
+
+    def displayed_sizes(doc: fitz.Document, xrefs: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+        """Largest width and height in points at which each image is drawn on any page."""
+        wanted = set(xrefs)
+        sizes: Dict[int, Tuple[float, float]] = {}
+        for page in doc:
+            for info in page.get_image_info(xrefs=True):
+                xref = info.get("xref", 0)
+                if xref not in wanted:
+                    continue
+                a, b, c, d = info["transform"][:4]
+                width, height = sizes.get(xref, (0.0, 0.0))
+                sizes[xref] = (max(width, math.hypot(a, b)), max(height, math.hypot(c, d)))
+        return sizes
+
+    def _image_mode(doc: fitz.Document, xref: int, recolorer: ContentRecolorer) -> Optional[str]:
+        """Pillow mode of an image this stage can re-encode, or None to leave it as it is."""
+        if doc.xref_get_key(xref, "BitsPerComponent")[1] != "8" or doc.xref_get_key(xref, "ImageMask")[1] == "true":
+            return None
+        if doc.xref_get_key(xref, "Mask")[0] == "array":
+            return None  # color key masking needs the exact sample values
+        image_filter = doc.xref_get_key(xref, "Filter")[1]
+        if image_filter not in ("null", "/FlateDecode", "/DCTDecode"):
+            return None
+        if image_filter == "/DCTDecode" and doc.xref_get_key(xref, "DecodeParms")[0] != "null":
+            return None  # e.g. /ColorTransform, which Pillow would not honor
+        kind, value = doc.xref_get_key(xref, "ColorSpace")
+        try:
+            return IMAGE_MODES.get(recolorer.color_space_kind(kind, value))
+        except RecolorUnsupported:
+            return None
+
+    def prepare_image(data: bytes, jpeg: bool, mode: str, size: Tuple[int, int], target: Tuple[int, int],
+                      old_bytes: int, quality: int = config.COMPRESS_JPEG_QUALITY) -> Optional[PDFImage]:
+        """Worker body: the resampled/re-encoded image, or None if it would not be smaller."""
+        if jpeg:
+            image = Image.open(io.BytesIO(data))
+            if image.mode != mode or image.size != size:
+                return None
+        elif len(data) == size[0] * size[1] * len(mode):
+            image = Image.frombytes(mode, size, data)
+        else:
+            return None
+        if target != size:
+            image = image.resize(target, Image.LANCZOS, reducing_gap=3.0)
+
+        if jpeg:
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True)
+            encoded, image_filter = buffer.getvalue(), "/DCTDecode"
+        else:
+            encoded, image_filter = zlib.compress(image.tobytes(), 9), "/FlateDecode"
+        limit = old_bytes * (1 - MIN_SAVING) if target == size else old_bytes
+        if len(encoded) >= limit:
+            return None
+        return PDFImage(image.width, image.height, "", 8, encoded, filter=image_filter)
+
+    def _resample_size(size: Tuple[int, int], displayed: Optional[Tuple[float, float]], dpi: int) -> Tuple[int, int]:
+        """Pixel size for dpi at the displayed size in points, or size when it is not far enough above dpi."""
+        if displayed is None:
+            return size  # not drawn by any page directly (e.g. only by an annotation): keep every pixel
+        scale = max(displayed[0] / size[0], displayed[1] / size[1]) * dpi / 72
+        if scale * config.COMPRESS_DPI_THRESHOLD >= 1:
+            return size
+        return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+    def compress_images(doc: fitz.Document, workers: int, dpi: int, quality: int,
+                        skip: Iterable[int] = ()) -> Dict[str, int]:
+        """Resample and re-encode the images that allow it, except skip; return bytes saved per category."""
+        recolorer = ContentRecolorer(doc)
+        skip = set(skip)
+        candidates = {}
+        for xref in PDFCompressor._image_xrefs(doc):
+            if xref in skip:
+                continue
+            mode = PDFCompressor._image_mode(doc, xref, recolorer)
+            if mode and len(doc.xref_stream_raw(xref)) >= MIN_IMAGE_BYTES:
+                candidates[xref] = mode
+        sizes = PDFCompressor.displayed_sizes(doc, candidates) if candidates else {}
+        saved = {"images_resampled": 0, "images_reencoded": 0}
+
+        def write(xref: int, old_bytes: int, resampled: bool, pdf_image: Optional[PDFImage]) -> None:
+            if pdf_image is None:
+                return
+            doc.update_stream(xref, pdf_image.data, compress=False)
+            doc.xref_set_key(xref, "Filter", pdf_image.filter)
+            doc.xref_set_key(xref, "Width", str(pdf_image.width))
+            doc.xref_set_key(xref, "Height", str(pdf_image.height))
+            saved["images_resampled" if resampled else "images_reencoded"] += old_bytes - len(pdf_image.data)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            pending = deque()
+            for xref, mode in candidates.items():
+                jpeg = doc.xref_get_key(xref, "Filter")[1] == "/DCTDecode"
+                size = (int(doc.xref_get_key(xref, "Width")[1]), int(doc.xref_get_key(xref, "Height")[1]))
+                target = PDFCompressor._resample_size(size, sizes.get(xref), dpi)
+                if not jpeg and target == size:
+                    continue  # lossless at its size: the save deflates it already
+                raw = doc.xref_stream_raw(xref)
+                data = raw if jpeg else doc.xref_stream(xref)
+                future = executor.submit(PDFCompressor.prepare_image, data, jpeg, mode, size, target, len(raw), quality)
+                pending.append((xref, len(raw), target != size, future))
+                if len(pending) > workers:
+                    xref, old_bytes, resampled, future = pending.popleft()
+                    write(xref, old_bytes, resampled, future.result())
+            while pending:
+                xref, old_bytes, resampled, future = pending.popleft()
+                write(xref, old_bytes, resampled, future.result())
+        return saved
+
+    def compress_streams(doc: fitz.Document, workers: int, skip: Iterable[int] = ()) -> int:
+        """Deflate every stream stored without a filter, except skip; return the bytes saved."""
+        skip = set(skip)
+        xrefs = [xref for xref in range(1, doc.xref_length())
+                 if xref not in skip and doc.xref_is_stream(xref) and doc.xref_get_key(xref, "Filter")[0] == "null"]
+        saved = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            pending = deque()
+
+            def write(xref: int, old_bytes: int, compressed: bytes) -> None:
+                nonlocal saved
+                if len(compressed) < old_bytes:
+                    doc.update_stream(xref, compressed, compress=False)
+                    doc.xref_set_key(xref, "Filter", "/FlateDecode")
+                    saved += old_bytes - len(compressed)
+
+            for xref in xrefs:
+                raw = doc.xref_stream_raw(xref)
+                pending.append((xref, len(raw), executor.submit(zlib.compress, raw, 9)))
+                if len(pending) > workers:
+                    xref, old_bytes, future = pending.popleft()
+                    write(xref, old_bytes, future.result())
+            while pending:
+                xref, old_bytes, future = pending.popleft()
+                write(xref, old_bytes, future.result())
+        return saved
+
+    def compress(path_file: str, output_path: Optional[str] = None, dpi: int = config.COMPRESS_IMAGE_DPI,
+                 quality: int = config.COMPRESS_JPEG_QUALITY, workers: int = config.COMPRESS_WORKERS) -> InversionResult:
+        """Write a compressed copy of path_file to output_path (OUTPUT_FOLDER/compressed_<name> by default).
+
+        output_path may be path_file itself; the file is only replaced once the new one is complete.
+        """
+        start = time.perf_counter()
+        timer = utils.metrics_handler.StageTimer()
+        result = InversionResult(input_path=path_file, stages=timer.stages)
+        if not utils.file_handler.exists_file_path(path_file) or not utils.pdf_handler.check_pdf_validity(path_file):
+            result.error = f"{path_file} is not a readable PDF file"
+            return result
+        if output_path is None:
+            output_path = os.path.join(config.OUTPUT_FOLDER, f"compressed_{os.path.basename(path_file)}")
+
+        bytes_in = os.path.getsize(path_file)
+        partial_path = f"{output_path}.part"
+        try:
+            with fitz.open(path_file) as doc:
+                result.pages = doc.page_count
+                with timer.stage("deduplicate"):
+                    duplicates, deduplicated = PDFCompressor.deduplicate_images(doc)
+                    result.objects_deduplicated = len(duplicates)
+                with timer.stage("images"):
+                    saved = PDFCompressor.compress_images(doc, workers, dpi, quality, skip=duplicates)
+                with timer.stage("streams"):
+                    saved["streams"] = PDFCompressor.compress_streams(doc, workers, skip=duplicates)
+                with timer.stage("save"):
+                    doc.save(partial_path, **PDF_SAVE_OPTIONS, use_objstms=1)
+            os.replace(partial_path, output_path)
+        except Exception as e:
+            logging.error(f"Failed to compress PDF {path_file}: {e}")
+            result.error = str(e)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            result.seconds = time.perf_counter() - start
+            return result
+
+        result.bytes_out = os.path.getsize(output_path)
+        result.bytes_saved = {"images_deduplicated": deduplicated, **saved}
+        # What is left is the object-level cleanup of the save: garbage collection and object streams.
+        result.bytes_saved["structure"] = bytes_in - result.bytes_out - sum(result.bytes_saved.values())
+        result.status = "ok"
+        result.output_path = output_path
+        result.seconds = time.perf_counter() - start
+        logging.info(
+            f"Compressed {path_file} to {output_path}: {bytes_in} -> {result.bytes_out} bytes "
+            f"({result.objects_deduplicated} duplicate images merged; saved "
+            + ", ".join(f"{category} {saved_bytes}" for category, saved_bytes in result.bytes_saved.items()) + ")"
+        )
+        return result
+
+
+def compress_pdf(path_file: str, output_path: Optional[str] = None, dpi: int = config.COMPRESS_IMAGE_DPI,
+                 quality: int = config.COMPRESS_JPEG_QUALITY, workers: int = config.COMPRESS_WORKERS) -> InversionResult:
+    """Wrapper function to write a compressed copy of a PDF file."""
+    result = PDFCompressor.compress(path_file, output_path, dpi, quality, workers)
+    utils.metrics_handler.get_registry().record_file("compress", result)
+    return result
@@ -0,0 +1,278 @@
+"""Watch-folder daemon: inverts PDFs and images as soon as they land in the input folder.
+
+New files are detected with inotify on Linux and by polling elsewhere, debounced until
+they stop changing, and pushed onto a bounded queue that a pool of workers drains.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from configuration import config, logging_config
+from inverter import ImageInverter, InversionResult, PDFInverter
+import utils
+
+
+def invert_file(path_file: str, output_folder: str = config.OUTPUT_FOLDER) -> InversionResult:
+    """Worker body: route a file to the PDF or the image inverter based on its extension."""
+    input_folder = os.path.dirname(path_file)
+    if utils.pdf_handler.is_pdf_file(path_file):
+        return PDFInverter.invert_pdf(path_file, input_folder=input_folder, output_folder=output_folder)
+    return ImageInverter.invert_png_file(path_file, input_folder, output_folder)
+
+
+def is_supported_file(file_name: str) -> bool:
+    return utils.pdf_handler.is_pdf_file(file_name) or utils.image_handler.is_img_file(file_name)
+
+
+class InotifyWatcher:
+    """Reports files closed after writing or moved into a folder, using Linux inotify."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, folder: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(InotifyWatcher.IN_NONBLOCK | InotifyWatcher.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = InotifyWatcher.IN_CLOSE_WRITE | InotifyWatcher.IN_MOVED_TO
+        if libc.inotify_add_watch(self._fd, os.fsencode(folder), mask) < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+
+    def changed(self, timeout: float) -> List[str]:
+        """Wait up to timeout seconds and return the names of files that were written."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        names = []
+        offset = 0
+        header_size = InotifyWatcher.EVENT_HEADER.size
+        while offset < len(data):
+            _, _, _, name_length = InotifyWatcher.EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + header_size:offset + header_size + name_length].rstrip(b"\0")
+            if name:
+                names.append(os.fsdecode(name))
+            offset += header_size + name_length
+        return names
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Reports new or modified files by comparing one os.scandir snapshot with the next."""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def changed(self, timeout: float) -> List[str]:
+        time.sleep(timeout)
+        snapshot = self._scan()
+        names = [name for name, signature in snapshot.items() if self._snapshot.get(name) != signature]
+        self._snapshot = snapshot
+        return names
+
+    def close(self) -> None:
+        pass
+
+
+def create_watcher(folder: str):
+    """inotify where the platform offers it, polling otherwise."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify unavailable, falling back to polling: {e}")
+    return PollingWatcher(folder)
+
+
+class WatchDaemon:
+    """Feeds newly arrived files through a bounded queue to a pool of inversion workers."""
+
+    def __init__(self, input_folder: str = config.INPUT_FOLDER, workers: int = config.BATCH_WORKERS,
+                 queue_size: int = config.WATCH_QUEUE_SIZE, debounce: float = config.WATCH_DEBOUNCE_SECONDS,
+                 process_existing: bool = True, output_folder: str = config.OUTPUT_FOLDER):
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.workers = max(1, workers)
+        self.debounce = debounce
+        self.process_existing = process_existing
+        self.queue: "queue.Queue[Tuple[str, float]]" = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._candidates: Dict[str, Tuple[Tuple[int, int], float, float]] = {}
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._enqueued = 0
+        self._completed = 0
+        self._failed = 0
+        self._latency_total = 0.0
+
+    def metrics(self) -> Dict[str, float]:
+        """Queue depth, counters, throughput and mean latency from detection to finished output."""
+        with self._lock:
+            finished = self._completed + self._failed
+            elapsed = time.monotonic() - self._started
+            return {
+                "queue_depth": self.queue.qsize(),
+                "pending_debounce": len(self._candidates),
+                "enqueued": self._enqueued,
+                "completed": self._completed,
+                "failed": self._failed,
+                "throughput_per_second": finished / elapsed if elapsed else 0.0,
+                "mean_latency_seconds": self._latency_total / finished if finished else 0.0,
+            }
+
+    def _signature(self, name: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(os.path.join(self.input_folder, name))
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _observe(self, names: List[str]) -> None:
+        """Start or restart the debounce timer of each changed file."""
+        now = time.monotonic()
+        for name in names:
+            if not is_supported_file(name):
+                continue
+            signature = self._signature(name)
+            if signature is None:
+                self._candidates.pop(name, None)
+                continue
+            first_seen = self._candidates[name][2] if name in self._candidates else now
+            self._candidates[name] = (signature, now, first_seen)
+
+    def _promote_settled(self) -> None:
+        """Queue files whose size and mtime have not changed for the debounce interval."""
+        now = time.monotonic()
+        for name, (signature, last_change, first_seen) in list(self._candidates.items()):
+            if now - last_change < self.debounce:
+                continue
+            current = self._signature(name)
+            if current is None:
+                del self._candidates[name]
+                continue
+            if current != signature:
+                self._candidates[name] = (current, now, first_seen)
+                continue
+            with self._lock:
+                if name in self._queued:
+                    continue
+                self._queued.add(name)
+            del self._candidates[name]
+            # Blocks while the queue is full, which is the daemon's backpressure.
+            while not self._stop.is_set():
+                try:
+                    self.queue.put((name, first_seen), timeout=0.5)
+                except queue.Full:
+                    continue
+                with self._lock:
+                    self._enqueued += 1
+                break
+
+    def _worker(self, executor: ProcessPoolExecutor) -> None:
+        while not self._stop.is_set() or not self.queue.empty():
+            try:
+                name, first_seen = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                path = os.path.join(self.input_folder, name)
+                result = executor.submit(invert_file, path, self.output_folder).result()
+                succeeded = result.status == "ok"
+                pipeline = "pdf" if utils.pdf_handler.is_pdf_file(path) else "image"
+                utils.metrics_handler.get_registry().record_file(pipeline, result)
+            except Exception as e:
+                logging.error(f"Watch worker failed on {name}: {e}")
+                succeeded = False
+            with self._lock:
+                self._queued.discard(name)
+                self._latency_total += time.monotonic() - first_seen
+                if succeeded:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+            self.queue.task_done()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        """Watch the input folder until stop() is called."""
+        if not utils.file_handler.exists_folder(self.input_folder):
+            return
+
+        watcher = create_watcher(self.input_folder)
+        logging.info(f"Watching {self.input_folder} with {type(watcher).__name__} and {self.workers} workers")
+        if self.process_existing:
+            with os.scandir(self.input_folder) as entries:
+                self._observe([entry.name for entry in entries if entry.is_file()])
+
+        last_report = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            threads = [threading.Thread(target=self._worker, args=(executor,), daemon=True) for _ in range(self.workers)]
+            for thread in threads:
+                thread.start()
+            try:
+                while not self._stop.is_set():
+                    timeout = min(self.debounce, 1.0) if self._candidates else 1.0
+                    self._observe(watcher.changed(timeout))
+                    self._promote_settled()
+                    if time.monotonic() - last_report >= config.WATCH_METRICS_INTERVAL:
+                        logging.info(f"Watch metrics: {self.metrics()}")
+                        if config.METRICS_FILE:
+                            utils.metrics_handler.get_registry().export(config.METRICS_FILE, config.METRICS_FORMAT)
+                        last_report = time.monotonic()
+            finally:
+                self._stop.set()
+                watcher.close()
+                for thread in threads:
+                    thread.join()
+        logging.info(f"Stopped watching {self.input_folder}: {self.metrics()}")
+
+
+def main():
+    logging_config.setup_logging()
+    daemon = WatchDaemon()
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
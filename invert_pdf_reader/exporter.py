@@ -0,0 +1,129 @@
+"""Export the pages of a PDF as inverted images (PNG, JPEG or WebP), e.g. for e-ink or thumbnails.
+
+Pages are rasterized with fitz and inverted directly in the pixmap samples, so nothing goes
+through invert_pdf first and PIL is only used to encode WebP, which MuPDF cannot write.
+"""
+
+from __future__ import annotations  # annotations must not trigger the lazy fitz/Pillow imports
+
+from concurrent.futures import ProcessPoolExecutor
+import io
+import logging
+import math
+import os
+import time
+from typing import List, Optional, Tuple
+
+from configuration import config
+from inverter import InversionResult
+import utils
+
+fitz = utils.pdf_handler.fitz
+# Pillow is only needed for WebP, so it is not imported for PNG and JPEG exports.
+Image = utils.image_handler.Image
+
+# Output format -> file extension.
+EXPORT_FORMATS = {"png": "png", "jpeg": "jpg", "jpg": "jpg", "webp": "webp"}
+
+# The document handle of the current worker process, opened once by the pool initializer.
+_worker_doc: Optional[fitz.Document] = None
+
+
+class PageImageExporter:
+    """Renders, inverts and encodes PDF pages on a pool of worker processes, one document handle each.
+
+    MuPDF is not thread-safe, so pages are never rendered on threads sharing one process.
+    """
+
+    def _open_worker_document(pdf_path: str) -> None:
+        global _worker_doc
+        _worker_doc = fitz.open(pdf_path)
+
+    def encode_pixmap(pixmap: fitz.Pixmap, format: str, quality: int = config.EXPORT_QUALITY) -> bytes:
+        """Encode an RGB pixmap; PNG and JPEG are written by MuPDF, WebP by Pillow without copying the samples."""
+        if format == "png":
+            return pixmap.tobytes("png")
+        if format in ("jpeg", "jpg"):
+            return pixmap.tobytes("jpeg", jpg_quality=quality)
+        image = Image.frombuffer("RGB", (pixmap.width, pixmap.height), pixmap.samples_mv, "raw", "RGB", pixmap.stride, 1)
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=quality)
+        return buffer.getvalue()
+
+    def render_inverted_page(doc: fitz.Document, page_number: int, dpi: int = config.EXPORT_DPI) -> fitz.Pixmap:
+        """Rasterize one page, annotations included, and invert the pixmap samples in place."""
+        pixmap = doc[page_number].get_pixmap(dpi=dpi, alpha=False, annots=True)
+        pixmap.invert_irect(pixmap.irect)
+        return pixmap
+
+    def _export_pages(page_numbers: List[int], output_folder: str, dpi: int, format: str, quality: int) -> Tuple[int, int]:
+        """Worker body: export the given pages with this worker's document, return (pages, bytes written)."""
+        written = 0
+        for page_number in page_numbers:
+            pixmap = PageImageExporter.render_inverted_page(_worker_doc, page_number, dpi)
+            data = PageImageExporter.encode_pixmap(pixmap, format, quality)
+            with open(os.path.join(output_folder, f"page_{page_number + 1:05d}.{EXPORT_FORMATS[format]}"), "wb") as file:
+                file.write(data)
+            written += len(data)
+        return len(page_numbers), written
+
+    def export_pdf(path_file: str, dpi: int = config.EXPORT_DPI, format: str = config.EXPORT_FORMAT,
+                   workers: int = config.EXPORT_WORKERS, quality: int = config.EXPORT_QUALITY) -> InversionResult:
+        """Export every page of a PDF in the input folder as an inverted image.
+
+        Images are written to output/inverted_<name>_pages/page_00001.<ext>.
+        """
+        start = time.perf_counter()
+        result = InversionResult(input_path=path_file)
+        format = format.lower()
+        if format not in EXPORT_FORMATS:
+            logging.error(f"Unsupported export format {format}")
+            result.error = f"Unsupported export format {format}"
+            return result
+
+        pdf_filename = os.path.basename(path_file)
+        source_doc = utils.pdf_handler.get_pdf_file(config.INPUT_FOLDER, pdf_filename)
+        if not source_doc:
+            result.error = f"Could not open {pdf_filename}"
+            return result
+        pdf_path = source_doc.name
+        page_count = len(source_doc)
+        source_doc.close()
+
+        name, _ = os.path.splitext(pdf_filename)
+        output_folder = os.path.join(config.OUTPUT_FOLDER, f"inverted_{name}_pages")
+        os.makedirs(output_folder, exist_ok=True)
+
+        # Several small chunks per worker keep the pool busy when some pages are much heavier.
+        workers = max(1, min(workers, page_count or 1))
+        chunk_size = max(1, math.ceil(page_count / (workers * 4)))
+        chunks = [list(range(first, min(first + chunk_size, page_count))) for first in range(0, page_count, chunk_size)]
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=PageImageExporter._open_worker_document,
+                                     initargs=(pdf_path,)) as pool:
+                futures = [pool.submit(PageImageExporter._export_pages, chunk, output_folder, dpi, format, quality)
+                           for chunk in chunks]
+                for future in futures:
+                    pages, written = future.result()
+                    result.pages += pages
+                    result.bytes_out += written
+            result.status = "ok"
+            result.output_path = output_folder
+        except Exception as e:
+            logging.error(f"Failed to export pages of {pdf_filename}: {e}")
+            result.error = str(e)
+
+        result.seconds = time.perf_counter() - start
+        if result.status == "ok":
+            logging.info(
+                f"Exported {result.pages} inverted pages of {pdf_filename} to {output_folder} at {dpi} dpi "
+                f"({result.pages / result.seconds:.1f} pages/sec with {workers} workers)"
+            )
+        utils.metrics_handler.get_registry().record_file("export", result)
+        return result
+
+
+def export_pdf(path_file: str, dpi: int = config.EXPORT_DPI, format: str = config.EXPORT_FORMAT,
+               workers: int = config.EXPORT_WORKERS, quality: int = config.EXPORT_QUALITY) -> InversionResult:
+    """Wrapper function to export the pages of a PDF as inverted images."""
+    return PageImageExporter.export_pdf(path_file, dpi, format, workers, quality)
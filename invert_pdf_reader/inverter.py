@@ -1,47 +1,436 @@
-import fitz
+from __future__ import annotations  # annotations must not trigger the lazy fitz/Pillow imports
+
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from dataclasses import dataclass, field
+import functools
+import io
 import logging
-from PIL import Image
 import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple, Union
 
 from configuration import config
+from recolor import ContentRecolorer
 import utils
 
+# PDF-only runs never import Pillow and image-only runs never import fitz.
+fitz = utils.pdf_handler.fitz
+Image = utils.image_handler.Image
+ImageSequence = utils.import_handler.lazy_module("PIL.ImageSequence")
+
+# Bump whenever the output for the same input and options changes, to invalidate cached results.
+INVERTER_VERSION = "2"
+
+# Anything exposing the buffer protocol: bytes, bytearray, memoryview or an mmap.mmap.
+BytesLike = Union[bytes, bytearray, memoryview]
+
+PDF_SAVE_OPTIONS = {"garbage": 4, "deflate": True, "clean": True}
+
+if not config.METRICS_ENABLED:
+    utils.metrics_handler.set_registry(utils.metrics_handler.NullRegistry())
+
+
+def _profiling_for(file_name: str):
+    """cProfile/tracemalloc capture when file_name is config.PROFILE_DOCUMENT, a no-op otherwise."""
+    if config.PROFILE_DOCUMENT and file_name == config.PROFILE_DOCUMENT:
+        return utils.metrics_handler.profiled(file_name, config.PROFILE_FOLDER)
+    return contextlib.nullcontext()
+
+
+def _resolve_folders(input_folder: Optional[str], output_folder: Optional[str]) -> Tuple[str, str]:
+    """The given folders, with INPUT_FOLDER and OUTPUT_FOLDER for those left as None."""
+    return (config.INPUT_FOLDER if input_folder is None else input_folder,
+            config.OUTPUT_FOLDER if output_folder is None else output_folder)
+
+
+@dataclass
+class InversionResult:
+    """Per-file summary of an inversion run."""
+    input_path: str
+    status: str = "failed"
+    output_path: Optional[str] = None
+    pages: int = 0
+    seconds: float = 0.0
+    bytes_out: int = 0
+    objects_deduplicated: int = 0
+    peak_rss_bytes: int = 0
+    cache_hit: bool = False
+    pages_baked: int = 0  # pages whose annotations/form fields were flattened; the rest skipped baking
+    pages_recolored: int = 0  # pages inverted by rewriting their colors (recolor mode); the rest got the overlay
+    error: Optional[str] = None
+    stages: Dict[str, float] = field(default_factory=dict)  # seconds spent in each pipeline stage
+    bytes_saved: Dict[str, int] = field(default_factory=dict)  # per category, when the compression stage ran
+
 
 class ColorInverter:
     """Handles color inversion logic."""
 
-    def invert_single_color(color: int) -> int:
-        """Inverts a color value based on the maximum color number defined in config."""
-        return config.COLOR_NUMBER - color
+    # Maximum channel value of each mode handled natively; any alpha band is left untouched.
+    # Only additive modes belong here: 255 - x of each CMYK band is not the inverse color.
+    MODE_MAX_VALUES = {
+        "L": config.COLOR_NUMBER,
+        "LA": config.COLOR_NUMBER,
+        "RGB": config.COLOR_NUMBER,
+        "RGBA": config.COLOR_NUMBER,
+        "I": 65535,     # Pillow opens 16-bit greyscale PNG/TIFF as I or I;16
+        "I;16": 65535,
+        "I;16L": 65535,
+        "I;16B": 65535,
+    }
+
+    def invert_single_color(color: int, max_value: int = config.COLOR_NUMBER) -> int:
+        """Inverts a color value based on the maximum color number of its mode."""
+        return max_value - color
+
+    @functools.lru_cache(maxsize=None)
+    def lookup_table(mode: str) -> List[int]:
+        """Precomputed point() table for an 8-bit mode: inverted color bands, identity alpha."""
+        max_value = ColorInverter.MODE_MAX_VALUES[mode]
+        inverted = [ColorInverter.invert_single_color(value, max_value) for value in range(max_value + 1)]
+        identity = list(range(max_value + 1))
+        return [value for band in mode for value in (identity if band == "A" else inverted)]
+
+    def _invert_16bit_array(image: Image.Image) -> Image.Image:
+        """Inverts a 16-bit image Pillow's point() cannot handle, in place on a NumPy copy."""
+        import numpy as np
+
+        pixels = np.array(image)
+        np.subtract(ColorInverter.MODE_MAX_VALUES[image.mode], pixels, out=pixels)
+        return Image.frombuffer(image.mode, image.size, pixels, "raw", image.mode, 0, 1)
+
+    def invert_palette(image: Image.Image) -> Image.Image:
+        """Inverts a P-mode image by inverting its palette only, leaving the indices untouched."""
+        inverted = image.copy()
+        palette_mode = inverted.palette.mode
+        palette = inverted.getpalette(palette_mode)
+        bands = len(palette_mode)
+        inverted.putpalette(
+            [value if palette_mode[index % bands] == "A" else ColorInverter.invert_single_color(value)
+             for index, value in enumerate(palette)],
+            palette_mode,
+        )
+        return inverted
+
+    def output_mode(image: Image.Image) -> str:
+        """Mode of the image returned by invert_image for this image."""
+        if image.mode in ColorInverter.MODE_MAX_VALUES or image.mode == "P":
+            return image.mode
+        return "RGBA" if image.has_transparency_data else "RGB"
 
     def invert_image(image: Image.Image) -> Image.Image:
-        """Inverts the colors of a PIL Image and returns the inverted image."""
-        return Image.eval(image, lambda x: ColorInverter.invert_single_color(x))
+        """Inverts the colors of a PIL Image and returns the inverted image.
+
+        Supported modes are inverted in a single C pass over the pixel buffer, keeping
+        the mode and any alpha band; P-mode images only get their palette inverted; other
+        modes, CMYK included, are converted to RGB or RGBA first.
+        """
+        if image.mode == "P":
+            return ColorInverter.invert_palette(image)
+        mode = ColorInverter.output_mode(image)
+        if mode != image.mode:
+            image = image.convert(mode)
+
+        max_value = ColorInverter.MODE_MAX_VALUES[mode]
+        if max_value == config.COLOR_NUMBER:
+            return image.point(ColorInverter.lookup_table(mode))
+        if mode in ("I", "I;16"):
+            # point() turns a linear lambda into a scale/offset pass for 32-bit and 16-bit modes.
+            return image.point(lambda value: value * -1 + max_value)
+        return ColorInverter._invert_16bit_array(image)
 
 
 class ImageInverter:
     """Handles image inversion logic."""
 
-    def save_inverted_image(image: Image.Image, output_path: str) -> None:
+    def save_inverted_image(image: Image.Image, output_path: str, save_options: Optional[dict] = None) -> bool:
         """Saves the inverted image to the specified output path."""
         try:
-            image.save(output_path)
+            image.save(output_path, **(save_options or {}))
             logging.info(f"Inverted image saved to {output_path}")
+            return True
         except Exception as e:
             logging.error(f"Failed to save inverted image to {output_path}: {e}")
+            return False
+
+    def _invert_frames(image: Image.Image) -> Tuple[Image.Image, dict]:
+        """Inverts every frame of a multi-frame image, keeping frame durations and GIF disposal."""
+        frames, durations, disposals = [], [], []
+        for frame in ImageSequence.Iterator(image):
+            frames.append(ColorInverter.invert_image(frame))
+            durations.append(frame.info.get("duration", 0))
+            disposals.append(getattr(frame, "disposal_method", 0))
+
+        save_options = {"save_all": True, "append_images": frames[1:], "duration": durations}
+        if image.format == "GIF":
+            save_options["disposal"] = disposals
+        if "loop" in image.info:
+            save_options["loop"] = image.info["loop"]
+        return frames[0], save_options
+
+    def _invert_loaded_image(image: Image.Image) -> Tuple[Image.Image, dict]:
+        """Inverts an opened image, shared by the file and in-memory entry points.
+
+        Returns the inverted (first) image and the extra options needed to save all frames.
+        """
+        if getattr(image, "n_frames", 1) > 1:
+            return ImageInverter._invert_frames(image)
+        return ColorInverter.invert_image(image), {}
+
+    def invert_image_bytes(data: BytesLike, format: Optional[str] = None) -> Optional[bytes]:
+        """Inverts an encoded image held in memory and returns the encoded result.
+
+        The output keeps the input format unless format (e.g. "PNG") is given.
+        """
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                output_format = format or image.format
+                inverted_image, save_options = ImageInverter._invert_loaded_image(image)
+            buffer = io.BytesIO()
+            inverted_image.save(buffer, format=output_format, **save_options)
+            return buffer.getvalue()
+        except Exception as e:
+            logging.error(f"Failed to invert in-memory image: {e}")
+            return None
+
+    def invert_image_tiled(path_file: str, memory_budget: int = config.TILED_MEMORY_BUDGET,
+                           workers: int = config.TILED_WORKERS, input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
+        """Inverts a very large image strip by strip into a PNG in the output folder.
+
+        Strips are sized so that the strips in flight fit in memory_budget bytes, and each
+        one is handed to a streaming PNG encoder as soon as it is inverted. With workers > 1
+        strips are inverted and compressed on a thread pool and written back in order.
+        Uncompressed images and TIFFs are read a strip at a time; PNG, JPEG and other
+        formats have to be decoded whole, and a warning says so when that exceeds memory_budget.
+        """
+        start = time.perf_counter()
+        input_folder, output_folder = _resolve_folders(input_folder, output_folder)
+        result = InversionResult(input_path=path_file)
+        img_filename = os.path.basename(path_file)
+        img_path = os.path.join(input_folder, img_filename)
+        if not utils.file_handler.exists_file_path(img_path) or not utils.image_handler.is_img_file(img_path):
+            result.error = f"Could not read image {img_filename}"
+            return result
 
-    def invert_png_file(path_file: str) -> None:
-        """Inverts the colors of a PNG file and saves it to the output folder."""
+        name, _ = os.path.splitext(img_filename)
+        output_path = os.path.join(output_folder, f"inverted_{name}.png")
+        try:
+            with Image.open(img_path) as image:
+                width, height = image.size
+                output_mode = ColorInverter.output_mode(image)
+                if output_mode == "P":
+                    # PNGStreamWriter writes truecolor only; keep palette transparency as alpha.
+                    output_mode = "RGBA" if image.has_transparency_data else "RGB"
+                row_bytes = len(Image.new(image.mode, (width, 1)).tobytes())
+
+            # Each strip in flight holds roughly four copies: source, inverted, filtered rows, deflated.
+            strips_in_flight = max(1, workers) + 1
+            strip_height = max(1, min(height, memory_budget // (4 * row_bytes * strips_in_flight)))
+
+            def encode(strip: Image.Image) -> Tuple[bytes, bytes]:
+                return writer.encode_strip(ColorInverter.invert_image(strip))
+
+            strips = (strip for _, strip in utils.image_handler.iter_image_strips(img_path, strip_height, memory_budget))
+            with utils.image_handler.PNGStreamWriter(output_path, width, height, output_mode) as writer:
+                if workers <= 1:
+                    for strip in strips:
+                        writer.write_encoded(*encode(strip))
+                else:
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        pending = deque()
+                        for strip in strips:
+                            pending.append(executor.submit(encode, strip))
+                            if len(pending) >= strips_in_flight:
+                                writer.write_encoded(*pending.popleft().result())
+                        while pending:
+                            writer.write_encoded(*pending.popleft().result())
+
+            result.status = "ok"
+            result.output_path = output_path
+            result.bytes_out = os.path.getsize(output_path)
+            result.peak_rss_bytes = utils.memory_handler.peak_rss_bytes()
+            logging.info(
+                f"Inverted image saved to {output_path} in strips of {strip_height} rows, "
+                f"peak RSS {result.peak_rss_bytes / 2**20:.1f} MB"
+            )
+        except Exception as e:
+            logging.error(f"Failed to invert image {img_filename} in strips: {e}")
+            result.error = str(e)
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def _invert_image_file(path_file: str, input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
+        """Decode, convert, invert and encode one image file, timing each stage."""
+        start = time.perf_counter()
+        input_folder, output_folder = _resolve_folders(input_folder, output_folder)
+        timer = utils.metrics_handler.StageTimer()
+        result = InversionResult(input_path=path_file, stages=timer.stages)
         img_filename = os.path.basename(path_file)
-        image = utils.image_handler.get_img_file(config.INPUT_FOLDER, img_filename)
+        with timer.stage("decode"):
+            image = utils.image_handler.get_img_file(input_folder, img_filename)
         if not image:
             logging.error(f"Could not read image {img_filename}")
+            result.error = f"Could not read image {img_filename}"
+            return result
+
+        try:
+            with image:
+                if getattr(image, "n_frames", 1) > 1:
+                    with timer.stage("invert"):
+                        inverted_image, save_options = ImageInverter._invert_frames(image)
+                else:
+                    with timer.stage("decode"):
+                        image.load()
+                    with timer.stage("convert"):
+                        mode = ColorInverter.output_mode(image)
+                        source = image.convert(mode) if mode != image.mode else image
+                    with timer.stage("invert"):
+                        inverted_image, save_options = ColorInverter.invert_image(source), {}
+        except Exception as e:
+            logging.error(f"Failed to invert image {img_filename}: {e}")
+            result.error = str(e)
+            result.seconds = time.perf_counter() - start
+            return result
+
+        output_path = os.path.join(output_folder, f"inverted_{img_filename}")
+        with timer.stage("encode"):
+            saved = ImageInverter.save_inverted_image(inverted_image, output_path, save_options)
+        if saved:
+            result.status = "ok"
+            result.output_path = output_path
+            result.pages = 1 + len(save_options.get("append_images", []))
+            result.bytes_out = os.path.getsize(output_path)
+        else:
+            result.error = f"Could not save {output_path}"
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def invert_png_file(path_file: str, input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
+        """Inverts the colors of a PNG file and saves it to the output folder.
+
+        input_folder and output_folder default to INPUT_FOLDER and OUTPUT_FOLDER.
+        """
+        with _profiling_for(os.path.basename(path_file)):
+            result = ImageInverter._invert_image_file(path_file, input_folder, output_folder)
+        utils.metrics_handler.get_registry().record_file("image", result)
+        return result
+
+
+class BakedPages:
+    """Baked copies of only those source pages that carry visible annotations or form fields.
+
+    The annotated pages are copied into a scratch document and baked there, so the source is
+    never modified and clean pages (most pages of most documents) skip baking entirely.
+    """
+
+    def __init__(self, source_doc: fitz.Document, page_numbers: range):
+        self.source_doc = source_doc
+        self.doc: Optional[fitz.Document] = None
+        self._index: Dict[int, int] = {}
+        annotated = [number for number in page_numbers if BakedPages.has_annotations(source_doc, number)]
+        if not annotated:
             return
+        self.doc = fitz.open()
+        for index, page_number in enumerate(annotated):
+            # Keep the graft map between insertions so shared fonts are copied only once.
+            self.doc.insert_pdf(source_doc, from_page=page_number, to_page=page_number,
+                                final=page_number == annotated[-1])
+            self._index[page_number] = index
+        self.doc.bake()
+
+    @property
+    def count(self) -> int:
+        return len(self._index)
+
+    def has_annotations(doc: fitz.Document, page_number: int) -> bool:
+        """Read /Annots from the page dictionary, without loading the page; links are ignored."""
+        kind, value = doc.xref_get_key(doc.page_xref(page_number), "Annots")
+        if kind == "xref":
+            value = doc.xref_object(int(value.split()[0]), compressed=True)
+        elif kind != "array":
+            return False
+        tokens = value.strip("[] \n").split()
+        annot_xrefs = [int(tokens[i]) for i in range(0, len(tokens) - 2, 3) if tokens[i + 2] == "R"]
+        return any(doc.xref_get_key(xref, "Subtype")[1] != "/Link" for xref in annot_xrefs)
+
+    def source(self, page_number: int) -> Tuple[fitz.Document, int]:
+        """The document and page number to copy the content of page_number from."""
+        if page_number in self._index:
+            return self.doc, self._index[page_number]
+        return self.source_doc, page_number
+
+    def close(self) -> None:
+        if self.doc:
+            self.doc.close()
+
+
+class PDFObjectRegistry:
+    """Document-level registry of the objects shared by every inverted page.
+
+    The Difference ExtGState is created once per document and each overlay stream is
+    created once per distinct page box, instead of new objects for every page.
+    """
+
+    def __init__(self, doc: fitz.Document):
+        self.doc = doc
+        self._gs_xref: Optional[int] = None
+        self._stream_xrefs: Dict[Tuple, int] = {}
+        self.created = 0
+        self.requested = 0
+
+    @property
+    def deduplicated(self) -> int:
+        """Number of objects that would have been created without sharing."""
+        return self.requested - self.created
+
+    def difference_extgstate(self) -> int:
+        """Return the xref of the shared ExtGState with BM=Difference."""
+        self.requested += 1
+        if self._gs_xref is None:
+            self._gs_xref = self.doc.get_new_xref()
+            self.doc.update_object(self._gs_xref, "<</Type /ExtGState /BM /Difference>>")
+            self.created += 1
+        return self._gs_xref
+
+    def _shared_stream(self, key: Tuple, ops: str) -> int:
+        """Return the xref of the stream registered under key, creating it on first use."""
+        self.requested += 1
+        stream_xref = self._stream_xrefs.get(key)
+        if stream_xref is None:
+            stream_xref = self.doc.get_new_xref()
+            self.doc.update_object(stream_xref, "<</Length 0>>")
+            self.doc.update_stream(stream_xref, ops.encode())
+            self._stream_xrefs[key] = stream_xref
+            self.created += 1
+        return stream_xref
+
+    def overlay_stream(self, width: float, height: float) -> int:
+        """Return the xref of the white Difference overlay stream for this page size."""
+        # Difference+white overlay drawn LAST to invert all visible colors.
+        box = f"0 0 {width:.4f} {height:.4f}"
+        return self._shared_stream(("overlay", box), f"q /GSDiff gs 1 1 1 rg {box} re f Q\n")
+
+    def in_place_streams(self, mediabox: fitz.Rect) -> Tuple[int, int]:
+        """Return (base, overlay) stream xrefs that wrap an existing page's own content.
+
+        The base paints white under the original content and opens a graphics state so
+        any CTM or colour left behind by the original streams is dropped before the overlay.
+        """
+        box = f"{mediabox.x0:.4f} {mediabox.y0:.4f} {mediabox.width:.4f} {mediabox.height:.4f}"
+        base_xref = self._shared_stream(("base", box), f"q 1 1 1 rg {box} re f Q\nq\n")
+        overlay_xref = self._shared_stream(("wrapped_overlay", box), f"Q\nq /GSDiff gs 1 1 1 rg {box} re f Q\n")
+        return base_xref, overlay_xref
+
+    def recolor_base_stream(self, mediabox: fitz.Rect) -> int:
+        """Return the xref of the stream put before a recolored page's content.
 
-        image = image.convert("RGB")
-        inverted_image = ColorInverter.invert_image(image)
-        output_path = os.path.join(config.OUTPUT_FOLDER, f"inverted_{img_filename}")
-        ImageInverter.save_inverted_image(inverted_image, output_path)
+        It paints the paper black and makes white the initial fill and stroke color.
+        """
+        box = f"{mediabox.x0:.4f} {mediabox.y0:.4f} {mediabox.width:.4f} {mediabox.height:.4f}"
+        return self._shared_stream(("recolor_base", box), f"q 0 g {box} re f Q\n1 g 1 G\n")
 
 
 class PDFInverter:
@@ -49,93 +438,403 @@ class PDFInverter:
 
     def _register_difference_extgstate(doc: fitz.Document, page_xref: int, gs_xref: int) -> None:
         """Register GSDiff in page resources, resolving indirect Resources safely."""
-        resources_type, resources_value = doc.xref_get_key(page_xref, "Resources")
+        utils.pdf_handler.set_page_resource(doc, page_xref, "ExtGState", "GSDiff", f"{gs_xref} 0 R")
 
-        if resources_type == "xref":
-            resources_xref = int(resources_value.split()[0])
-            doc.xref_set_key(resources_xref, "ExtGState/GSDiff", f"{gs_xref} 0 R")
-            return
-
-        if resources_type == "dict":
-            doc.xref_set_key(page_xref, "Resources/ExtGState/GSDiff", f"{gs_xref} 0 R")
-            return
-
-        resources_xref = doc.get_new_xref()
-        doc.update_object(resources_xref, "<<>>")
-        doc.xref_set_key(page_xref, "Resources", f"{resources_xref} 0 R")
-        doc.xref_set_key(resources_xref, "ExtGState/GSDiff", f"{gs_xref} 0 R")
-
-    def _invert_page_colors(doc: fitz.Document, page: fitz.Page) -> None:
+    def _invert_page_colors(doc: fitz.Document, page: fitz.Page, registry: Optional[PDFObjectRegistry] = None) -> None:
         """Append a white Difference-blend rectangle as a separate content stream."""
-        w = page.rect.width
-        h = page.rect.height
+        if registry is None:
+            registry = PDFObjectRegistry(doc)
         page_xref = page.xref
 
-        # Register ExtGState with BM=Difference in page Resources.
-        gs_xref = doc.get_new_xref()
-        doc.update_object(gs_xref, "<</Type /ExtGState /BM /Difference>>")
+        # Register the shared ExtGState with BM=Difference in page Resources.
+        gs_xref = registry.difference_extgstate()
         PDFInverter._register_difference_extgstate(doc, page_xref, gs_xref)
 
-        # Difference+white overlay drawn LAST to invert all visible colors.
-        invert_ops = (f"q /GSDiff gs 1 1 1 rg 0 0 {w:.4f} {h:.4f} re f Q\n").encode()
-        overlay_xref = doc.get_new_xref()
-        doc.update_object(overlay_xref, "<</Length 0>>")
-        doc.update_stream(overlay_xref, invert_ops)
+        overlay_xref = registry.overlay_stream(page.rect.width, page.rect.height)
 
         existing = page.get_contents()
         refs = " ".join(f"{x} 0 R" for x in existing + [overlay_xref])
         doc.xref_set_key(page_xref, "Contents", f"[{refs}]")
 
-    def invert_pdf(path_file: str) -> None:
-        """Invert PDF page colors without rasterizing."""
+    def _invert_page_in_place(doc: fitz.Document, page: fitz.Page, registry: PDFObjectRegistry) -> None:
+        """Wrap an existing page's content between a white base and the Difference overlay."""
+        gs_xref = registry.difference_extgstate()
+        PDFInverter._register_difference_extgstate(doc, page.xref, gs_xref)
+
+        # Content streams are in unrotated user space, so cover the raw MediaBox.
+        base_xref, overlay_xref = registry.in_place_streams(page.mediabox)
+
+        existing = page.get_contents()
+        refs = " ".join(f"{x} 0 R" for x in [base_xref] + existing + [overlay_xref])
+        doc.xref_set_key(page.xref, "Contents", f"[{refs}]")
+
+    def _recolor_page(doc: fitz.Document, page: fitz.Page, registry: PDFObjectRegistry) -> None:
+        """Put the black paper under a page whose content colors were already inverted."""
+        base_xref = registry.recolor_base_stream(page.mediabox)
+        refs = " ".join(f"{x} 0 R" for x in [base_xref] + page.get_contents())
+        doc.xref_set_key(page.xref, "Contents", f"[{refs}]")
+
+    def _invert_pages(source_doc: fitz.Document, output_doc: fitz.Document, page_numbers: range,
+                      timer: Optional[utils.metrics_handler.StageTimer] = None,
+                      stamps: Optional[utils.stamp_handler.Stamps] = None) -> Tuple[PDFObjectRegistry, int]:
+        """Copy the given source pages into output_doc on a white base and invert them.
+
+        With stamps, they are drawn over each inverted page, numbered as in the source.
+        Returns the object registry and the number of pages that had to be baked.
+        """
+        timer = timer or utils.metrics_handler.StageTimer()
+        registry = PDFObjectRegistry(output_doc)
+        stamper = utils.stamp_handler.PageStamper(output_doc, stamps, inverted=True, page_count=len(source_doc)) if stamps else None
+        # Flatten annotations/widgets so they are part of normal content, on the pages that have any.
+        with timer.stage("bake"):
+            baked = BakedPages(source_doc, page_numbers)
+        try:
+            for page_number in page_numbers:
+                with timer.stage("copy_page"):
+                    content_doc, content_page_number = baked.source(page_number)
+                    source_page = content_doc[content_page_number]
+                    output_page = output_doc.new_page(
+                        width=source_page.rect.width,
+                        height=source_page.rect.height,
+                    )
+                    # Paint a stable white base in the output page before copying content.
+                    output_page.draw_rect(output_page.rect, fill=(1, 1, 1), color=None, overlay=False)
+                    output_page.show_pdf_page(output_page.rect, content_doc, content_page_number)
+                with timer.stage("overlay"):
+                    PDFInverter._invert_page_colors(output_doc, output_page, registry)
+                if stamper:
+                    with timer.stage("stamp"):
+                        stamper.stamp(output_page, page_number)
+        finally:
+            baked.close()
+        return registry, baked.count
+
+    def _invert_document(source_doc: fitz.Document, timer: Optional[utils.metrics_handler.StageTimer] = None,
+                         stamps: Optional[utils.stamp_handler.Stamps] = None
+                         ) -> Tuple[fitz.Document, PDFObjectRegistry, int]:
+        """Build the inverted copy of an opened document; the caller closes the returned document.
+
+        Returns the output document, its object registry and the number of baked pages.
+        """
+        output_doc = fitz.open()
+        try:
+            registry, pages_baked = PDFInverter._invert_pages(source_doc, output_doc, range(len(source_doc)), timer, stamps)
+        except Exception:
+            output_doc.close()
+            raise
+        return output_doc, registry, pages_baked
+
+    def invert_pdf_bytes(data: BytesLike) -> Optional[bytes]:
+        """Invert a PDF held in memory and return the inverted PDF bytes, without touching the filesystem."""
+        if not isinstance(data, (bytes, bytearray)):
+            # fitz only takes bytes-like streams; a memoryview also covers mmap without a copy.
+            data = memoryview(data)
+        try:
+            with fitz.open(stream=data, filetype="pdf") as source_doc:
+                output_doc, _, _ = PDFInverter._invert_document(source_doc)
+                try:
+                    return output_doc.tobytes(**PDF_SAVE_OPTIONS)
+                finally:
+                    output_doc.close()
+        except Exception as e:
+            logging.error(f"Failed to invert in-memory PDF: {e}")
+            return None
+
+    def invert_pdf_in_place(path_file: str, recolor: bool = False, stamps: Optional[utils.stamp_handler.Stamps] = None,
+                            input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
+        """Invert a copy of the PDF by editing its pages directly and appending an incremental update.
+
+        Unlike the copy mode, source pages are not re-embedded as Form XObjects and unchanged
+        objects are never re-serialized: the output is the original bytes plus one update section.
+        With recolor, the colors in the content streams are inverted instead wherever possible
+        (see recolor.py) and only the remaining pages get the Difference overlay.
+        """
+        start = time.perf_counter()
+        input_folder, output_folder = _resolve_folders(input_folder, output_folder)
+        timer = utils.metrics_handler.StageTimer()
+        result = InversionResult(input_path=path_file, stages=timer.stages)
         pdf_filename = os.path.basename(path_file)
-        source_doc = utils.pdf_handler.get_pdf_file(config.INPUT_FOLDER, pdf_filename)
+        pdf_input_path = os.path.join(input_folder, pdf_filename)
+        if not utils.file_handler.exists_file_path(pdf_input_path) or not utils.pdf_handler.check_pdf_validity(pdf_input_path):
+            result.error = f"Could not open {pdf_filename}"
+            return result
+
+        pdf_output_path = os.path.join(output_folder, f"inverted_{pdf_filename}")
+        # The copy is edited under a temporary name and only takes the output name once it
+        # is inverted, so a failure never leaves an uninverted copy that looks finished.
+        partial_path = f"{pdf_output_path}.part"
+        rebuilt_path = None
+        try:
+            with timer.stage("open"):
+                shutil.copyfile(pdf_input_path, partial_path)
+                doc = fitz.open(partial_path)
+        except Exception as e:
+            logging.error(f"Failed to open PDF {pdf_filename} for in-place inversion: {e}")
+            result.error = str(e)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return result
+
+        try:
+            # Flatten annotations/widgets so the overlay inverts them too. The pages are edited
+            # in this document, so it is baked as a whole, and only when some page needs it.
+            with timer.stage("bake"):
+                result.pages_baked = sum(1 for number in range(len(doc)) if BakedPages.has_annotations(doc, number))
+                if result.pages_baked:
+                    doc.bake()
+            registry = PDFObjectRegistry(doc)
+            recolored, fallback = [], {}
+            if recolor:
+                with timer.stage("recolor"):
+                    recolored, fallback = ContentRecolorer(doc).recolor(range(len(doc)))
+                    for page_number in recolored:
+                        PDFInverter._recolor_page(doc, doc[page_number], registry)
+                result.pages_recolored = len(recolored)
+            with timer.stage("overlay"):
+                for page in doc:
+                    if recolor and page.number not in fallback:
+                        continue
+                    PDFInverter._invert_page_in_place(doc, page, registry)
+            if stamps:
+                with timer.stage("stamp"):
+                    stamper = utils.stamp_handler.PageStamper(doc, stamps, inverted=True)
+                    for page in doc:
+                        stamper.stamp(page)
+
+            with timer.stage("save"):
+                if doc.can_save_incrementally():
+                    doc.save(partial_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+                else:
+                    # Repaired or otherwise damaged files cannot take an incremental update.
+                    rebuilt_path = f"{pdf_output_path}.rebuilt.part"
+                    doc.save(rebuilt_path, garbage=1)
+            result.pages = len(doc)
+            result.objects_deduplicated = registry.deduplicated
+        except Exception as e:
+            logging.error(f"Failed to invert PDF {pdf_filename} in place: {e}")
+            result.error = str(e)
+        finally:
+            doc.close()
+
+        if result.error is not None:
+            for path in (partial_path, rebuilt_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        else:
+            if rebuilt_path:
+                os.replace(rebuilt_path, pdf_output_path)
+                os.remove(partial_path)
+            else:
+                os.replace(partial_path, pdf_output_path)
+            recolored_note = ""
+            if recolor:
+                reasons = Counter(fallback.values())
+                recolored_note = f", {result.pages_recolored} pages recolored" + "".join(
+                    f", {count} on the overlay ({reason})" for reason, count in reasons.most_common())
+            logging.info(
+                f"Inverted PDF saved in place to {pdf_output_path} ({registry.deduplicated} shared objects reused, "
+                f"{result.pages_baked} of {result.pages} pages baked{recolored_note})"
+            )
+            result.status = "ok"
+            result.output_path = pdf_output_path
+            result.bytes_out = os.path.getsize(pdf_output_path)
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def invert_pdf_copy(path_file: str, stamps: Optional[utils.stamp_handler.Stamps] = None,
+                        input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
+        """Invert a PDF by rebuilding every page in a new document, timing each stage."""
+        start = time.perf_counter()
+        input_folder, output_folder = _resolve_folders(input_folder, output_folder)
+        timer = utils.metrics_handler.StageTimer()
+        result = InversionResult(input_path=path_file, stages=timer.stages)
+        pdf_filename = os.path.basename(path_file)
+        with timer.stage("open"):
+            source_doc = utils.pdf_handler.get_pdf_file(input_folder, pdf_filename)
         if not source_doc:
-            return
+            result.error = f"Could not open {pdf_filename}"
+            return result
 
-        output_doc = fitz.open()
+        output_doc = None
         try:
-            # Flatten annotations/widgets once so they are part of normal content.
-            source_doc.bake()
-
-            for source_page in source_doc:
-                output_page = output_doc.new_page(
-                    width=source_page.rect.width,
-                    height=source_page.rect.height,
-                )
-                # Paint a stable white base in the output page before copying content.
-                output_page.draw_rect(output_page.rect, fill=(1, 1, 1), color=None, overlay=False)
-                output_page.show_pdf_page(output_page.rect, source_doc, source_page.number)
-                PDFInverter._invert_page_colors(output_doc, output_page)
-
-            pdf_output_path = os.path.join(config.OUTPUT_FOLDER, f"inverted_{pdf_filename}")
-            output_doc.save(pdf_output_path, garbage=4, deflate=True, clean=True)
-            logging.info(f"Inverted PDF saved to {pdf_output_path}")
+            output_doc, registry, result.pages_baked = PDFInverter._invert_document(source_doc, timer, stamps)
+
+            pdf_output_path = os.path.join(output_folder, f"inverted_{pdf_filename}")
+            with timer.stage("save"):
+                output_doc.save(pdf_output_path, **PDF_SAVE_OPTIONS)
+            result.pages = len(output_doc)
+            logging.info(
+                f"Inverted PDF saved to {pdf_output_path} ({registry.deduplicated} shared objects reused, "
+                f"{result.pages_baked} of {result.pages} pages baked)"
+            )
+            result.status = "ok"
+            result.output_path = pdf_output_path
+            result.bytes_out = os.path.getsize(pdf_output_path)
+            result.objects_deduplicated = registry.deduplicated
         except Exception as e:
             logging.error(f"Failed to invert PDF {pdf_filename}: {e}")
+            result.error = str(e)
         finally:
-            output_doc.close()
+            if output_doc:
+                output_doc.close()
             source_doc.close()
+            result.seconds = time.perf_counter() - start
+        return result
+
+    def chunk_page_count(file_size: int, page_count: int, memory_budget: int) -> int:
+        """Pages per chunk so that one chunk's source and output pages fit in memory_budget."""
+        average_page_bytes = max(1, file_size // max(1, page_count))
+        pages = memory_budget // (config.CHUNK_MEMORY_FACTOR * average_page_bytes)
+        return max(1, min(page_count, config.CHUNK_MAX_PAGES, pages))
+
+    def invert_pdf_chunked(path_file: str, memory_budget: int = config.CHUNK_MEMORY_BUDGET,
+                           stamps: Optional[utils.stamp_handler.Stamps] = None,
+                           input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
+        """Invert a PDF a chunk of pages at a time so peak memory does not grow with the page count.
+
+        Each chunk is inverted from a fresh source handle, saved as a temporary segment and
+        released together with everything that handle had loaded. The segments are then
+        appended to the output one incremental save at a time. Fonts shared by pages of
+        different chunks are stored once per segment, so the output can be larger than in copy mode.
+        """
+        start = time.perf_counter()
+        input_folder, output_folder = _resolve_folders(input_folder, output_folder)
+        timer = utils.metrics_handler.StageTimer()
+        result = InversionResult(input_path=path_file, stages=timer.stages)
+        pdf_filename = os.path.basename(path_file)
+        with timer.stage("open"):
+            source_doc = utils.pdf_handler.get_pdf_file(input_folder, pdf_filename)
+        if not source_doc:
+            result.error = f"Could not open {pdf_filename}"
+            return result
+        source_path = source_doc.name
+        page_count = len(source_doc)
+        source_doc.close()
+
+        chunk_size = PDFInverter.chunk_page_count(os.path.getsize(source_path), page_count, memory_budget)
+        pdf_output_path = os.path.join(output_folder, f"inverted_{pdf_filename}")
+        partial_path = f"{pdf_output_path}.part"
+        try:
+            with tempfile.TemporaryDirectory(prefix="invert_chunks_") as segment_dir:
+                segment_paths = []
+                for first in range(0, page_count, chunk_size):
+                    with timer.stage("open"):
+                        source_doc = fitz.open(source_path)
+                    output_doc = fitz.open()
+                    try:
+                        chunk = range(first, min(first + chunk_size, page_count))
+                        registry, pages_baked = PDFInverter._invert_pages(source_doc, output_doc, chunk, timer, stamps)
+                        result.pages_baked += pages_baked
+                        segment_paths.append(os.path.join(segment_dir, f"segment_{len(segment_paths):05d}.pdf"))
+                        with timer.stage("save"):
+                            output_doc.save(segment_paths[-1], **PDF_SAVE_OPTIONS)
+                        result.objects_deduplicated += registry.deduplicated
+                    finally:
+                        output_doc.close()
+                        source_doc.close()
+
+                with timer.stage("assemble"):
+                    shutil.copyfile(segment_paths[0], partial_path)
+                    for segment_path in segment_paths[1:]:
+                        with fitz.open(partial_path) as output_doc, fitz.open(segment_path) as segment_doc:
+                            output_doc.insert_pdf(segment_doc)
+                            output_doc.save(partial_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+            os.replace(partial_path, pdf_output_path)
+            logging.info(
+                f"Inverted PDF saved to {pdf_output_path} from {len(segment_paths)} chunks of {chunk_size} pages "
+                f"({result.pages_baked} of {page_count} pages baked)"
+            )
+            result.status = "ok"
+            result.output_path = pdf_output_path
+            result.pages = page_count
+            result.bytes_out = os.path.getsize(pdf_output_path)
+            result.peak_rss_bytes = utils.memory_handler.peak_rss_bytes()
+        except Exception as e:
+            logging.error(f"Failed to invert PDF {pdf_filename} in chunks: {e}")
+            result.error = str(e)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def invert_pdf(path_file: str, mode: str = config.PDF_INVERSION_MODE, compress: bool = config.PDF_COMPRESS_OUTPUT,
+                   stamps: Optional[utils.stamp_handler.Stamps] = None,
+                   input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
+        """Invert PDF page colors without rasterizing.
+
+        mode "copy" rebuilds every page in a new document; mode "incremental" edits the pages
+        of a copy of the file in place and appends an incremental update; mode "chunked" works
+        through the pages in chunks under CHUNK_MEMORY_BUDGET; mode "recolor" is "incremental"
+        with the content colors rewritten instead of overlaid wherever possible. With compress,
+        the output then goes through the compression stage (see compressor.py). stamps (page
+        numbers, header, footer, watermark) are drawn over the inverted pages in the same pass.
+        input_folder and output_folder default to INPUT_FOLDER and OUTPUT_FOLDER.
+        """
+        modes = {
+            "copy": PDFInverter.invert_pdf_copy,
+            "incremental": PDFInverter.invert_pdf_in_place,
+            "chunked": PDFInverter.invert_pdf_chunked,
+            "recolor": functools.partial(PDFInverter.invert_pdf_in_place, recolor=True),
+        }
+        if mode not in modes:
+            logging.error(f"Unknown PDF inversion mode {mode}")
+            return InversionResult(input_path=path_file, error=f"Unknown PDF inversion mode {mode}")
+
+        with _profiling_for(os.path.basename(path_file)):
+            result = modes[mode](path_file, stamps=stamps, input_folder=input_folder, output_folder=output_folder)
+        if compress and result.status == "ok":
+            PDFInverter._compress_output(result)
+        utils.metrics_handler.get_registry().record_file("pdf", result)
+        return result
+
+    def _compress_output(result: InversionResult) -> None:
+        """Run a finished output through the compression stage and account for it in the result."""
+        from compressor import PDFCompressor
+
+        compressed = PDFCompressor.compress(result.output_path, result.output_path)
+        if compressed.status == "ok":
+            result.bytes_out = compressed.bytes_out
+            result.bytes_saved = compressed.bytes_saved
+            result.stages["compress"] = compressed.seconds
+            result.seconds += compressed.seconds
+
+    def invert_pdfs_in_folder(input_folder: str) -> List[InversionResult]:
+        """Inverts all PDFs directly in the input folder, one file at a time, into OUTPUT_FOLDER.
+
+        This is BatchInverter.invert_pdfs_in_folder with a single worker and no recursion.
+        """
+        from batch import BatchInverter  # batch imports this module
+        return BatchInverter.invert_pdfs_in_folder(input_folder, workers=1, recursive=False)
+
+
+def invert_png_file(path_file: str, input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
+    """Wrapper function to invert a PNG file."""
+    return ImageInverter.invert_png_file(path_file, input_folder, output_folder)
 
-    def invert_pdfs_in_folder(input_folder: str) -> None:
-        """Inverts all PDFs in the specified input folder."""
-        pdf_files = utils.pdf_handler.get_pdf_files(input_folder)
-        for pdf_path in pdf_files:
-            PDFInverter.invert_pdf(pdf_path)
 
-        logging.info(f"Completed inversion of all PDFs in folder {input_folder}")
+def invert_image_tiled(path_file: str, memory_budget: int = config.TILED_MEMORY_BUDGET,
+                       workers: int = config.TILED_WORKERS) -> InversionResult:
+    """Wrapper function to invert a very large image under a memory budget."""
+    return ImageInverter.invert_image_tiled(path_file, memory_budget, workers)
 
 
-def invert_png_file(path_file: str) -> None:
-    """Wrapper function to invert a PNG file."""
-    ImageInverter.invert_png_file(path_file)
+def invert_image_bytes(data: BytesLike, format: Optional[str] = None) -> Optional[bytes]:
+    """Wrapper function to invert an encoded image held in memory."""
+    return ImageInverter.invert_image_bytes(data, format)
+
+
+def invert_pdf_bytes(data: BytesLike) -> Optional[bytes]:
+    """Wrapper function to invert a PDF held in memory."""
+    return PDFInverter.invert_pdf_bytes(data)
 
 
-def invert_pdf(path_file: str) -> None:
+def invert_pdf(path_file: str, mode: str = config.PDF_INVERSION_MODE, compress: bool = config.PDF_COMPRESS_OUTPUT,
+               stamps: Optional[utils.stamp_handler.Stamps] = None,
+               input_folder: Optional[str] = None, output_folder: Optional[str] = None) -> InversionResult:
     """Wrapper function to recolor a PDF file."""
-    PDFInverter.invert_pdf(path_file)
+    return PDFInverter.invert_pdf(path_file, mode, compress, stamps, input_folder, output_folder)
 
 
-def invert_pdfs_in_folder(input_folder: str) -> None:
+def invert_pdfs_in_folder(input_folder: str) -> List[InversionResult]:
     """Wrapper function to recolor all PDFs in a folder."""
-    PDFInverter.invert_pdfs_in_folder(input_folder)
+    return PDFInverter.invert_pdfs_in_folder(input_folder)
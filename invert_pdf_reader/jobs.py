@@ -0,0 +1,231 @@
+"""Resumable batch jobs: invert every file listed in a manifest, surviving crashes and restarts.
+
+A manifest is a JSON file such as
+
+    {"inputs": ["input/*.pdf", "scans/**/*.png", "/data/book.pdf"], "output_folder": "output",
+     "pdf_mode": "copy", "max_attempts": 3}
+
+Relative entries are resolved against the manifest's folder. Each input is known by its path
+relative to that folder (its absolute path if it lies outside), and its output inverted_<file
+name> goes to the same relative folder under output_folder, so inputs sharing a file name in
+different folders do not overwrite each other.
+
+Every finished attempt is appended to a journal (JSON lines, fsynced), keyed by that relative
+path, with the checksum of its output. Running the same manifest again skips the files the journal records as done, as long as
+their output still has the recorded checksum, and retries failed ones until max_attempts.
+A JSON report of the whole job is written at the end.
+
+Usage: python invert_pdf_reader/jobs.py manifest.json [--workers N]
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from batch import BatchInverter
+from configuration import config, logging_config
+from inverter import ImageInverter, InversionResult, PDFInverter
+import utils
+
+
+def _invert_item(path: str, output_folder: str, pdf_mode: str) -> Tuple[InversionResult, Optional[str]]:
+    """Worker body: invert one file from wherever it lives and checksum the output."""
+    os.makedirs(output_folder, exist_ok=True)
+    if utils.pdf_handler.is_pdf_file(path):
+        result = PDFInverter.invert_pdf(path, pdf_mode, input_folder=os.path.dirname(path), output_folder=output_folder)
+    else:
+        result = ImageInverter.invert_png_file(path, os.path.dirname(path), output_folder)
+    checksum = utils.file_handler.file_sha256(result.output_path) if result.status == "ok" else None
+    return result, checksum
+
+
+class JobRunner:
+    """Runs one manifest to completion, journaling every attempt so a rerun resumes where it stopped."""
+
+    def __init__(self, manifest_path: str, workers: int = config.BATCH_WORKERS,
+                 journal_path: Optional[str] = None, report_path: Optional[str] = None):
+        self.manifest_path = manifest_path
+        self.manifest_folder = os.path.dirname(os.path.abspath(manifest_path))
+        self.workers = max(1, workers)
+        base, _ = os.path.splitext(manifest_path)
+        self.journal_path = journal_path or f"{base}.journal.jsonl"
+        self.report_path = report_path or f"{base}.report.json"
+        with open(manifest_path) as file:
+            self.manifest = json.load(file)
+        self.output_folder = os.path.join(self.manifest_folder, self.manifest.get("output_folder", config.OUTPUT_FOLDER))
+        self.pdf_mode = self.manifest.get("pdf_mode", config.PDF_INVERSION_MODE)
+        self.max_attempts = int(self.manifest.get("max_attempts", config.JOB_MAX_ATTEMPTS))
+
+    def expand_inputs(patterns: List[str], base_folder: str = ".") -> Tuple[List[str], List[str]]:
+        """Resolve globs and paths (relative to base_folder) to supported files.
+
+        Returns the absolute paths, without duplicates and in manifest order, and the
+        entries that matched no supported file.
+        """
+        paths, unmatched = [], []
+        seen = set()
+        for pattern in patterns:
+            matches = sorted(glob.glob(os.path.join(base_folder, pattern), recursive=True))
+            supported = [
+                os.path.abspath(match) for match in matches
+                if os.path.isfile(match) and (utils.pdf_handler.is_pdf_file(match) or utils.image_handler.is_img_file(match))
+            ]
+            if not supported:
+                unmatched.append(pattern)
+            for path in supported:
+                if path not in seen:
+                    seen.add(path)
+                    paths.append(path)
+        return paths, unmatched
+
+    def input_key(self, path: str) -> str:
+        """The journal key of an input: its path relative to the manifest folder, or absolute outside it."""
+        absolute = os.path.normpath(os.path.join(self.manifest_folder, path))
+        relative = os.path.relpath(absolute, self.manifest_folder)
+        return absolute if relative.split(os.sep)[0] == os.pardir else relative
+
+    def item_output_folder(self, key: str) -> str:
+        """The folder under output_folder mirroring the input's own folder."""
+        folder = os.path.splitdrive(os.path.dirname(key))[1].lstrip(os.sep)
+        return os.path.join(self.output_folder, folder)
+
+    def read_journal(self) -> Dict[str, List[dict]]:
+        """Journal records grouped by input key; a torn last line from a crash is ignored."""
+        records: Dict[str, List[dict]] = {}
+        if not os.path.exists(self.journal_path):
+            return records
+        with open(self.journal_path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                # Journals written before inputs were keyed by relative path hold absolute paths.
+                records.setdefault(self.input_key(record["input"]), []).append(record)
+        return records
+
+    def _append_journal(self, journal, record: dict) -> None:
+        journal.write(json.dumps(record) + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+
+    def is_done(records: List[dict]) -> bool:
+        """True if the last attempt succeeded and its output is still there, unchanged."""
+        if not records or records[-1]["status"] != "ok":
+            return False
+        output_path = records[-1]["output"]
+        return os.path.exists(output_path) and utils.file_handler.file_sha256(output_path) == records[-1]["sha256"]
+
+    def _record(self, journal, records: Dict[str, List[dict]], attempts: Dict[str, int], path: str,
+                result: InversionResult, checksum: Optional[str]) -> None:
+        """Count one attempt of path and append it to the journal."""
+        attempts[path] += 1
+        key = self.input_key(path)
+        record = {
+            "input": key,
+            "status": result.status,
+            "attempt": attempts[path],
+            "output": result.output_path,
+            "sha256": checksum,
+            "pages": result.pages,
+            "seconds": result.seconds,
+            "error": result.error,
+            "time": time.time(),
+        }
+        self._append_journal(journal, record)
+        records.setdefault(key, []).append(record)
+        if result.status != "ok":
+            logging.error(f"Job item {path} {result.status} (attempt {attempts[path]}): {result.error}")
+
+    def run(self) -> dict:
+        """Invert everything the journal does not record as done, then write and return the report."""
+        started = time.time()
+        paths, unmatched = JobRunner.expand_inputs(self.manifest.get("inputs", []), self.manifest_folder)
+        for pattern in unmatched:
+            logging.warning(f"Manifest entry {pattern} matched no supported file")
+
+        records = self.read_journal()
+        keys = {path: self.input_key(path) for path in paths}
+        resumed = [path for path in paths if JobRunner.is_done(records.get(keys[path], []))]
+        attempts = {path: sum(1 for record in records.get(keys[path], []) if record["status"] != "ok") for path in paths}
+        pending = [path for path in BatchInverter.order_by_size(paths)
+                   if path not in resumed and attempts[path] < self.max_attempts]
+        logging.info(
+            f"Job {self.manifest_path}: {len(paths)} files, {len(resumed)} already done, {len(pending)} to run"
+        )
+
+        os.makedirs(self.output_folder, exist_ok=True)
+        with open(self.journal_path, "a") as journal:
+            while pending:
+                # One attempt per file and round; run_in_pool reruns the files a crash took down
+                # with it, so only a file that crashes on its own is charged for the crash.
+                tasks = ((path, (path, self.item_output_folder(keys[path]), self.pdf_mode)) for path in pending)
+                outcomes = BatchInverter.run_in_pool(_invert_item, tasks, min(self.workers, len(pending)),
+                                                     lambda result: (result, None))
+                for path, (result, checksum) in outcomes:
+                    self._record(journal, records, attempts, path, result, checksum)
+                pending = [path for path in pending
+                           if records[keys[path]][-1]["status"] != "ok" and attempts[path] < self.max_attempts]
+
+        items = []
+        for path in paths:
+            last = records.get(keys[path], [{}])[-1]
+            items.append({
+                "input": path,
+                "status": "ok" if last.get("status") == "ok" else "failed",
+                "resumed": path in resumed,
+                "attempts": len(records.get(keys[path], [])),
+                "output": last.get("output"),
+                "sha256": last.get("sha256"),
+                "pages": last.get("pages", 0),
+                "error": last.get("error"),
+            })
+        report = {
+            "manifest": os.path.abspath(self.manifest_path),
+            "journal": os.path.abspath(self.journal_path),
+            "started": started,
+            "finished": time.time(),
+            "total": len(paths),
+            "succeeded": sum(1 for item in items if item["status"] == "ok"),
+            "failed": sum(1 for item in items if item["status"] != "ok"),
+            "resumed": len(resumed),
+            "unmatched": unmatched,
+            "items": items,
+        }
+        partial_path = f"{self.report_path}.part"
+        with open(partial_path, "w") as file:
+            json.dump(report, file, indent=2)
+        os.replace(partial_path, self.report_path)
+        logging.info(
+            f"Job {self.manifest_path} finished: {report['succeeded']}/{report['total']} ok, "
+            f"{report['failed']} failed, {report['resumed']} resumed; report at {self.report_path}"
+        )
+        return report
+
+
+def run_job(manifest_path: str, workers: int = config.BATCH_WORKERS) -> dict:
+    """Wrapper function to run or resume the job described by a manifest."""
+    return JobRunner(manifest_path, workers).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("manifest", help="JSON manifest with an \"inputs\" list of paths and globs")
+    parser.add_argument("--workers", type=int, default=config.BATCH_WORKERS, help="worker processes")
+    args = parser.parse_args()
+    logging_config.setup_logging()
+    report = run_job(args.manifest, args.workers)
+    sys.exit(0 if report["failed"] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
+from configuration import logging_config
 from inverter import ImageInverter, PDFInverter
 
 load_dotenv()
@@ -15,6 +16,7 @@ load_dotenv()
 pdf_filename = os.getenv("PDF_FILENAME")
 
 def main():
+    logging_config.setup_logging()
     try:
         PDFInverter.invert_pdf(pdf_filename)
     except Exception as e:
@@ -0,0 +1,134 @@
+"""Merge images into one PDF as a stream, optionally inverting each image on the way.
+
+Images are decoded a few at a time on a thread pool and every page is written to disk as soon
+as it is ready, in input order, so memory does not grow with the number of images. JPEG files
+are embedded as they are (DCTDecode); inverting a grayscale or RGB one only flips the image's
+/Decode array. Flipping CMYK bands is not a color inversion, so CMYK JPEGs are decoded and
+inverted through RGB instead.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+from typing import Iterable, Optional
+
+from configuration import config
+from inverter import ColorInverter, InversionResult
+import utils
+
+Image = utils.image_handler.Image
+PDFImage = utils.image_handler.PDFImage
+PDFStreamWriter = utils.image_handler.PDFStreamWriter
+
+EXIF_ORIENTATION = 0x0112
+
+
+class ImagePDFMerger:
+    """Turns a sequence of image files into a PDF with one page per image."""
+
+    def jpeg_passthrough(img_path: str, invert: bool = False) -> Optional[PDFImage]:
+        """The JPEG file as a DCTDecode image without decoding it, or None if it has to be decoded."""
+        with Image.open(img_path) as image:
+            if image.format != "JPEG" or image.mode not in PDFStreamWriter.PDF_MODES:
+                return None
+            if invert and image.mode == "CMYK":
+                return None  # only a decode can invert the color rather than each ink
+            if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+                return None  # only a decode can apply the rotation
+            width, height = image.size
+            mode = image.mode
+            dpi = utils.image_handler.image_dpi(image)
+            # Adobe CMYK JPEGs store inverted values, which Pillow and PDF readers both undo.
+            inverted_cmyk = mode == "CMYK" and "adobe" in image.info
+
+        decode = [1, 0] * len(mode) if inverted_cmyk else [0, 1] * len(mode)
+        if invert:
+            decode = [1 - value for value in decode]
+        with open(img_path, "rb") as file:
+            data = file.read()
+        colorspace, bits, _ = PDFStreamWriter.PDF_MODES[mode]
+        return PDFImage(width, height, colorspace, bits, data, filter="/DCTDecode",
+                        decode=decode if decode != [0, 1] * len(mode) else None, dpi=dpi)
+
+    def prepare_page(img_path: str, invert: bool = False, compress_level: int = config.MERGE_COMPRESS_LEVEL) -> PDFImage:
+        """Worker body: the page image for one file, inverted if asked; only the first frame is used."""
+        pdf_image = ImagePDFMerger.jpeg_passthrough(img_path, invert)
+        if pdf_image is not None:
+            return pdf_image
+        from PIL import ImageOps
+
+        with Image.open(img_path) as image:
+            image = ImageOps.exif_transpose(image)
+            if invert:
+                image = ColorInverter.invert_image(image)
+            return PDFStreamWriter.encode_image(image, compress_level)
+
+    def merge(img_paths: Iterable[str], output_path: str, invert: bool = False,
+              workers: int = config.MERGE_WORKERS) -> InversionResult:
+        """Write every image of img_paths, in order, as one page of the PDF at output_path.
+
+        img_paths may be any iterable, e.g. a generator over a huge folder; at most workers + 1
+        images are held at a time.
+        """
+        start = time.perf_counter()
+        result = InversionResult(input_path=output_path)
+        if not utils.pdf_handler.is_pdf_file(output_path):
+            logging.error(f"Output path {output_path} is not a valid PDF file")
+            result.error = f"Output path {output_path} is not a valid PDF file"
+            return result
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not utils.file_handler.exists_folder(output_dir):
+            logging.error(f"Output directory {output_dir} does not exist")
+            result.error = f"Output directory {output_dir} does not exist"
+            return result
+
+        partial_path = f"{output_path}.part"
+        passed_through = 0
+        try:
+            with PDFStreamWriter(partial_path) as writer:
+                def write(pdf_image: PDFImage) -> None:
+                    nonlocal passed_through
+                    writer.write_image_page(pdf_image)
+                    passed_through += pdf_image.filter == "/DCTDecode"
+
+                if workers <= 1:
+                    for img_path in img_paths:
+                        write(ImagePDFMerger.prepare_page(img_path, invert))
+                else:
+                    pages_in_flight = workers + 1
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        pending = deque()
+                        for img_path in img_paths:
+                            pending.append(executor.submit(ImagePDFMerger.prepare_page, img_path, invert))
+                            if len(pending) >= pages_in_flight:
+                                write(pending.popleft().result())
+                        while pending:
+                            write(pending.popleft().result())
+                if writer.page_count == 0:
+                    raise ValueError("No images provided to merge into PDF")
+                result.pages = writer.page_count
+            os.replace(partial_path, output_path)
+            result.status = "ok"
+            result.output_path = output_path
+            result.bytes_out = os.path.getsize(output_path)
+            result.peak_rss_bytes = utils.memory_handler.peak_rss_bytes()
+            logging.info(
+                f"Merged {result.pages} images into {output_path} ({passed_through} JPEG passed through"
+                f"{', inverted' if invert else ''}), peak RSS {result.peak_rss_bytes / 2**20:.1f} MB"
+            )
+        except Exception as e:
+            logging.error(f"Failed to merge images into PDF {output_path}: {e}")
+            result.error = str(e)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        result.seconds = time.perf_counter() - start
+        utils.metrics_handler.get_registry().record_file("merge", result)
+        return result
+
+
+def merge_images_to_pdf(img_paths: Iterable[str], output_path: str, invert: bool = False,
+                        workers: int = config.MERGE_WORKERS) -> InversionResult:
+    """Wrapper function to merge images into one PDF, streaming, optionally inverted."""
+    return ImagePDFMerger.merge(img_paths, output_path, invert, workers)
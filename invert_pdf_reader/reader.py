@@ -0,0 +1,156 @@
+"""Lazy, page-at-a-time dark-mode rendering for interactive reading.
+
+Only the pages that are asked for are rasterized and inverted, so the time to the first page
+does not depend on the length of the document. Rendered pixmaps are kept in a memory-bounded
+LRU cache and the pages after the current one are rendered ahead on a background thread.
+"""
+
+from __future__ import annotations  # annotations must not trigger the lazy fitz import
+
+from collections import OrderedDict, deque
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from configuration import config
+import utils
+
+fitz = utils.pdf_handler.fitz
+
+
+class InvertedDocument:
+    """A PDF whose pages are inverted and rasterized on demand.
+
+    MuPDF is not thread-safe, so every call into the document is serialized by one lock; the
+    prefetch thread only renders while the reader is idle between pages. The pixmaps returned
+    by render_page are shared with the cache and must not be modified by the caller.
+    """
+
+    def __init__(self, path: str, cache_bytes: int = config.RENDER_CACHE_BYTES,
+                 prefetch_pages: int = config.RENDER_PREFETCH_PAGES):
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self.prefetch_pages = prefetch_pages
+        self.hits = 0
+        self.misses = 0
+        # Opening reads the cross-reference table only; no page is parsed until it is rendered.
+        self._doc = fitz.open(path)
+        self.page_count = len(self._doc)
+        self._doc_lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[int, float], fitz.Pixmap]" = OrderedDict()
+        self._cached_bytes = 0
+        self._cache_lock = threading.Lock()
+        self._wanted: "deque[Tuple[int, float]]" = deque()
+        self._wakeup = threading.Condition()
+        self._closed = False
+        self._prefetcher = None
+        if prefetch_pages > 0:
+            self._prefetcher = threading.Thread(target=self._prefetch_loop, name="page-prefetch", daemon=True)
+            self._prefetcher.start()
+
+    def __enter__(self) -> "InvertedDocument":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.page_count
+
+    def _cached(self, key: Tuple[int, float]) -> Optional[fitz.Pixmap]:
+        with self._cache_lock:
+            pixmap = self._cache.get(key)
+            if pixmap is not None:
+                self._cache.move_to_end(key)
+            return pixmap
+
+    def _store(self, key: Tuple[int, float], pixmap: fitz.Pixmap) -> None:
+        """Add a pixmap and evict the least recently used ones until the cache fits its budget."""
+        if pixmap.size > self.cache_bytes:
+            return
+        with self._cache_lock:
+            if key in self._cache:
+                return
+            self._cache[key] = pixmap
+            self._cached_bytes += pixmap.size
+            while self._cached_bytes > self.cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= evicted.size
+
+    def _render(self, key: Tuple[int, float]) -> Optional[fitz.Pixmap]:
+        """Rasterize and invert one page, unless another thread got there first."""
+        page_number, zoom = key
+        with self._doc_lock:
+            pixmap = self._cached(key)
+            if pixmap is not None or self._closed:
+                return pixmap
+            page = self._doc.load_page(page_number)
+            # Annotations and form fields are drawn like baked content; no alpha so the
+            # inversion turns the white paper black.
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False, annots=True)
+            pixmap.invert_irect(pixmap.irect)
+        self._store(key, pixmap)
+        return pixmap
+
+    def _schedule_prefetch(self, page_number: int, zoom: float) -> None:
+        """Replace any pending prefetch with the pages around the one just shown."""
+        if not self._prefetcher:
+            return
+        neighbours = [page_number + offset for offset in range(1, self.prefetch_pages + 1)] + [page_number - 1]
+        with self._wakeup:
+            self._wanted.clear()
+            self._wanted.extend((number, zoom) for number in neighbours if 0 <= number < self.page_count)
+            self._wakeup.notify()
+
+    def _prefetch_loop(self) -> None:
+        while True:
+            with self._wakeup:
+                while not self._wanted and not self._closed:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                key = self._wanted.popleft()
+            if self._cached(key) is None:
+                try:
+                    self._render(key)
+                except Exception as e:
+                    logging.error(f"Failed to prefetch page {key[0]} of {self.path}: {e}")
+
+    def render_page(self, page_number: int, zoom: float = 1.0) -> Optional[fitz.Pixmap]:
+        """Return page page_number (0-based) inverted and rasterized at zoom, or None on failure."""
+        if not 0 <= page_number < self.page_count:
+            logging.error(f"Page {page_number} is out of range for {self.path} ({self.page_count} pages)")
+            return None
+        key = (page_number, float(zoom))
+        pixmap = self._cached(key)
+        if pixmap is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            try:
+                pixmap = self._render(key)
+            except Exception as e:
+                logging.error(f"Failed to render page {page_number} of {self.path}: {e}")
+                return None
+        self._schedule_prefetch(page_number, key[1])
+        return pixmap
+
+    def stats(self) -> Dict[str, int]:
+        with self._cache_lock:
+            return {"hits": self.hits, "misses": self.misses, "cached_pages": len(self._cache),
+                    "cached_bytes": self._cached_bytes}
+
+    def close(self) -> None:
+        """Stop the prefetch thread, drop the cache and close the document."""
+        with self._wakeup:
+            self._closed = True
+            self._wanted.clear()
+            self._wakeup.notify()
+        if self._prefetcher:
+            self._prefetcher.join()
+        with self._doc_lock:
+            if not self._doc.is_closed:
+                self._doc.close()
+        with self._cache_lock:
+            self._cache.clear()
+            self._cached_bytes = 0
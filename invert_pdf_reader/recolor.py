@@ -0,0 +1,386 @@
+"""Invert PDF pages by rewriting the color operators of their content streams.
+
+Instead of a Difference-blend overlay, every color set with g/G, rg/RG, k/K, sc/SC or scn/SCN
+is replaced by its inverse, in the page content and in every Form XObject it draws, and
+images get an inverted /Decode array. Graphics states with a blend mode such as Multiply
+are swapped for a copy using the inverse mode (Screen). Without a blend group the result renders as fast as
+the source. CMYK colors are written as the RGB inverse of their conversion by MuPDF.
+
+Pages that draw something this cannot invert exactly (patterns, shadings, inline images,
+Indexed/Separation/Lab/CalRGB colors, soft masks, blend modes without an inverse, Type3 fonts) are left
+untouched and reported, so the caller can invert them with the overlay instead.
+"""
+
+from __future__ import annotations
+
+import functools
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+import utils
+
+fitz = utils.pdf_handler.fitz
+
+# One lexical token of a content stream; literal strings are matched separately because
+# their parentheses nest.
+TOKEN_PATTERN = re.compile(rb"""
+    (?P<space>[\x00\t\n\x0c\r ]+)
+  | (?P<comment>%[^\r\n]*)
+  | (?P<number>[+-]?(?:\d+\.?\d*|\.\d+)(?![^\x00\t\n\x0c\r ()<>\[\]{}/%]))
+  | (?P<name>/[^\x00\t\n\x0c\r ()<>\[\]{}/%]*)
+  | (?P<delimiter><<|>>|[\[\]{}])
+  | (?P<hex><[0-9A-Fa-f\x00\t\n\x0c\r ]*>)
+  | (?P<string>\((?:[^()\\]|\\.)*\))
+  | (?P<operator>[^\x00\t\n\x0c\r ()<>\[\]{}/%]+)
+""", re.VERBOSE | re.DOTALL)
+
+# Color operator -> (number of operands in the original color space, or None for the current
+# space, True for stroking)
+COLOR_OPERATORS = {
+    b"g": (1, False), b"G": (1, True),
+    b"rg": (3, False), b"RG": (3, True),
+    b"k": (4, False), b"K": (4, True),
+    b"sc": (None, False), b"SC": (None, True),
+    b"scn": (None, False), b"SCN": (None, True),
+}
+DEVICE_SPACES = {b"/DeviceGray": "gray", b"/DeviceRGB": "rgb", b"/DeviceCMYK": "cmyk",
+                 b"/G": "gray", b"/RGB": "rgb", b"/CMYK": "cmyk"}
+SPACE_COMPONENTS = {"gray": 1, "rgb": 3, "cmyk": 4}
+# Blend mode -> the mode giving the inverse result on inverted colors, e.g. a highlight's
+# Multiply becomes Screen. Other modes (Difference, Hue, ...) have no such counterpart.
+INVERSE_BLEND_MODES = {
+    "/Normal": "/Normal", "/Compatible": "/Compatible",
+    "/Multiply": "/Screen", "/Screen": "/Multiply",
+    "/Darken": "/Lighten", "/Lighten": "/Darken",
+    "/ColorDodge": "/ColorBurn", "/ColorBurn": "/ColorDodge",
+    "/Overlay": "/Overlay", "/HardLight": "/HardLight",
+}
+
+
+class RecolorUnsupported(Exception):
+    """Raised when a page draws something that cannot be inverted by recoloring."""
+
+
+def tokenize(data: bytes) -> List[Tuple[str, bytes]]:
+    """Split a content stream into (kind, bytes) tokens, skipping white space and comments."""
+    tokens = []
+    position, length = 0, len(data)
+    while position < length:
+        match = TOKEN_PATTERN.match(data, position)
+        if match is None:
+            if data[position:position + 1] != b"(":
+                raise RecolorUnsupported(f"unreadable content at byte {position}")
+            end = _string_end(data, position)
+            tokens.append(("string", data[position:end]))
+            position = end
+            continue
+        kind = match.lastgroup
+        if kind not in ("space", "comment"):
+            tokens.append((kind, match.group()))
+        position = match.end()
+    return tokens
+
+
+def _string_end(data: bytes, start: int) -> int:
+    """Index after the literal string starting at start, which contains nested parentheses."""
+    depth, position = 0, start
+    while position < len(data):
+        char = data[position:position + 1]
+        if char == b"\\":
+            position += 2
+            continue
+        if char == b"(":
+            depth += 1
+        elif char == b")":
+            depth -= 1
+            if depth == 0:
+                return position + 1
+        position += 1
+    raise RecolorUnsupported("unterminated string")
+
+
+def _format_number(value: float) -> bytes:
+    return (b"%.5f" % value).rstrip(b"0").rstrip(b".") or b"0"
+
+
+@functools.lru_cache(maxsize=4096)
+def cmyk_to_rgb(cmyk: Tuple[int, int, int, int]) -> Tuple[int, int, int]:
+    """8-bit CMYK to RGB, converted by MuPDF the way it renders DeviceCMYK."""
+    pixmap = fitz.Pixmap(fitz.csCMYK, 1, 1, bytes(cmyk), False)
+    return fitz.Pixmap(fitz.csRGB, pixmap).pixel(0, 0)
+
+
+def invert_components(space: str, values: List[float]) -> Tuple[str, List[float]]:
+    """Inverse of a color; CMYK comes back as the inverse of its RGB conversion."""
+    if space == "cmyk":
+        rgb = cmyk_to_rgb(tuple(round(min(1.0, max(0.0, value)) * 255) for value in values))
+        return "rgb", [1.0 - value / 255 for value in rgb]
+    return space, [1.0 - value for value in values]
+
+
+class _Resources:
+    """Looks up named resources of a page or form, following inheritance for pages."""
+
+    def __init__(self, doc: fitz.Document, owner_xref: Optional[int], prefix: str):
+        self.doc = doc
+        self.owner_xref = owner_xref
+        self.prefix = prefix
+
+    def of(doc: fitz.Document, xref: int, inherit: bool, fallback: Optional[_Resources] = None) -> _Resources:
+        """Resources of a page (inherit=True walks up the page tree) or a form (else fallback)."""
+        node = xref
+        while True:
+            kind, value = doc.xref_get_key(node, "Resources")
+            if kind == "xref":
+                return _Resources(doc, int(value.split()[0]), "")
+            if kind == "dict":
+                return _Resources(doc, node, "Resources/")
+            parent_kind, parent = doc.xref_get_key(node, "Parent") if inherit else ("null", "")
+            if parent_kind != "xref":
+                return fallback or _Resources(doc, None, "")
+            node = int(parent.split()[0])
+
+    def get(self, category: str, name: bytes) -> Tuple[str, str]:
+        if self.owner_xref is None:
+            return "null", "null"
+        return self.doc.xref_get_key(self.owner_xref, f"{self.prefix}{category}/{name[1:].decode('latin-1')}")
+
+    def target(self, category: str) -> Tuple[int, str]:
+        """The xref and key prefix to write /category entries into, following an indirect dictionary.
+
+        Raises RecolorUnsupported if there is no dictionary of that category to add to.
+        """
+        if self.owner_xref is not None:
+            kind, value = self.doc.xref_get_key(self.owner_xref, f"{self.prefix}{category}")
+            if kind == "xref":
+                return int(value.split()[0]), ""
+            if kind == "dict":
+                return self.owner_xref, f"{self.prefix}{category}/"
+        raise RecolorUnsupported(f"{category} resources that cannot be written")
+
+
+class ContentRecolorer:
+    """Plans and applies the recoloring of the pages of one document.
+
+    Every page is analysed first; nothing is written until it is known which pages can be
+    recolored, so objects shared with a page that falls back to the overlay stay untouched.
+    """
+
+    def __init__(self, doc: fitz.Document):
+        self.doc = doc
+
+    def _object_value(self, kind: str, value: str) -> str:
+        """The object text behind an indirect reference, or the direct value itself."""
+        if kind == "xref":
+            return self.doc.xref_object(int(value.split()[0]), compressed=True)
+        return value
+
+    def color_space_kind(self, kind: str, value: str) -> str:
+        """"gray", "rgb" or "cmyk" for a color space object; other spaces are unsupported."""
+        value = self._object_value(kind, value).strip()
+        if value.encode() in DEVICE_SPACES:
+            return DEVICE_SPACES[value.encode()]
+        family = re.match(r"\[\s*/(\w+)", value)
+        if family and family.group(1) == "ICCBased":
+            profile = re.match(r"\[\s*/ICCBased\s+(\d+)\s+0\s+R", value)
+            components = self.doc.xref_get_key(int(profile.group(1)), "N")[1] if profile else ""
+            spaces = {"1": "gray", "3": "rgb", "4": "cmyk"}
+            if components in spaces:
+                return spaces[components]
+        raise RecolorUnsupported(f"color space {value[:40]}")
+
+    def _image_decode(self, image_xref: int) -> Optional[str]:
+        """The inverted /Decode array of an image, or None for a stencil mask painted in the fill color."""
+        if self.doc.xref_get_key(image_xref, "ImageMask")[1] == "true":
+            return None
+        kind, value = self.doc.xref_get_key(image_xref, "ColorSpace")
+        if kind == "null":
+            raise RecolorUnsupported("image without a color space")
+        space = self.color_space_kind(kind, value)
+        if space == "cmyk":
+            raise RecolorUnsupported("CMYK image")
+        kind, value = self.doc.xref_get_key(image_xref, "Decode")
+        if kind == "array":
+            decode = [float(number) for number in value.strip("[] ").split()]
+        else:
+            decode = [0.0, 1.0] * SPACE_COMPONENTS[space]
+        inverted = [decode[index ^ 1] for index in range(len(decode))]
+        return "[" + " ".join(_format_number(number).decode() for number in inverted) + "]"
+
+    def _inverse_extgstate(self, resources: _Resources, name: bytes) -> Optional[str]:
+        """None if the graphics state can be used as it is, else a copy with the inverse blend mode."""
+        kind, value = resources.get("ExtGState", name)
+        if kind == "null":
+            return None
+        state = self._object_value(kind, value)
+        soft_mask = re.search(r"/SMask\s*(/\w+|<<|\d+\s+0\s+R)", state)
+        if soft_mask and soft_mask.group(1) != "/None":
+            raise RecolorUnsupported("soft mask")
+        blend_mode = re.search(r"/BM\s*(/\w+|\[)", state)
+        if not blend_mode or blend_mode.group(1) in ("/Normal", "/Compatible"):
+            return None
+        if blend_mode.group(1) not in INVERSE_BLEND_MODES:
+            raise RecolorUnsupported("blend mode")
+        inverse = INVERSE_BLEND_MODES[blend_mode.group(1)]
+        return state[:blend_mode.start(1)] + inverse + state[blend_mode.end(1):]
+
+    def _check_font(self, resources: _Resources, name: bytes) -> None:
+        kind, value = resources.get("Font", name)
+        if kind == "xref" and self.doc.xref_get_key(int(value.split()[0]), "Subtype")[1] == "/Type3":
+            raise RecolorUnsupported("Type3 font")
+
+    def rewrite_stream(self, data: bytes, resources: _Resources, state: List[str], plan: dict,
+                       forms: Tuple[int, ...]) -> bytes:
+        """Return the stream with every color inverted; state is [fill space, stroke space]
+        on entry and is left as it is at the end of the stream."""
+        output: List[bytes] = []
+        operands: List[Tuple[str, bytes]] = []
+        saved: List[Tuple[str, str]] = []
+        for kind, token in tokenize(data):
+            if kind != "operator":
+                operands.append((kind, token))
+                continue
+            if token in COLOR_OPERATORS:
+                count, stroke = COLOR_OPERATORS[token]
+                space = state[stroke] if count is None else {1: "gray", 3: "rgb", 4: "cmyk"}[count]
+                if any(operand_kind != "number" for operand_kind, _ in operands):
+                    raise RecolorUnsupported("pattern color")
+                values = [float(operand) for _, operand in operands]
+                if len(values) != SPACE_COMPONENTS[space]:
+                    raise RecolorUnsupported(f"malformed {token.decode()} operator")
+                new_space, values = invert_components(space, values)
+                if count is None:
+                    new_token = token
+                else:
+                    new_token = {"gray": b"g", "rgb": b"rg"}[new_space]
+                    new_token = new_token.upper() if stroke else new_token
+                    state[stroke] = space
+                operands = [("number", _format_number(value)) for value in values]
+                token = new_token
+            elif token in (b"cs", b"CS"):
+                stroke = token == b"CS"
+                name = operands[-1][1] if operands else b""
+                if name in DEVICE_SPACES:
+                    space = DEVICE_SPACES[name]
+                else:
+                    space = self.color_space_kind(*resources.get("ColorSpace", name))
+                state[stroke] = space
+                # A new color space starts out black, which inverts to white.
+                if space == "cmyk":
+                    operands = [("name", b"/DeviceRGB")]
+                white = b" ".join([b"1"] * (1 if space == "gray" else 3))
+                token = token + b" " + white + (b" SC" if stroke else b" sc")
+            elif token == b"q":
+                saved.append(tuple(state))
+            elif token == b"Q":
+                if saved:
+                    state[:] = saved.pop()
+            elif token == b"Do":
+                self._draw_xobject(resources, operands[-1][1] if operands else b"", state, plan, forms)
+            elif token == b"gs":
+                name = operands[-1][1] if operands else b""
+                inverse = self._inverse_extgstate(resources, name)
+                if inverse is not None:
+                    # Added under a new name, so pages still using the original are unaffected.
+                    inverse_name = name + b"_inv"
+                    target_xref, prefix = resources.target("ExtGState")
+                    plan["extgstates"][(target_xref, prefix, inverse_name)] = inverse
+                    operands[-1] = ("name", inverse_name)
+            elif token == b"Tf":
+                self._check_font(resources, operands[0][1] if operands else b"")
+            elif token in (b"sh", b"BI"):
+                raise RecolorUnsupported("shading" if token == b"sh" else "inline image")
+            output.append(b" ".join(operand for _, operand in operands) + b" " + token if operands else token)
+            operands = []
+        if operands:
+            raise RecolorUnsupported("operator split across content streams")
+        return b"\n".join(output) + b"\n"
+
+    def _draw_xobject(self, resources: _Resources, name: bytes, state: List[str], plan: dict,
+                      forms: Tuple[int, ...]) -> None:
+        kind, value = resources.get("XObject", name)
+        if kind != "xref":
+            raise RecolorUnsupported(f"missing XObject {name.decode('latin-1')}")
+        xref = int(value.split()[0])
+        plan["used"].add(xref)
+        subtype = self.doc.xref_get_key(xref, "Subtype")[1]
+        if subtype == "/Image":
+            decode = self._image_decode(xref)
+            if decode is not None:
+                plan["images"][xref] = decode
+            return
+        if subtype != "/Form" or xref in forms:
+            raise RecolorUnsupported("unsupported XObject")
+        form_resources = _Resources.of(self.doc, xref, inherit=False, fallback=resources)
+        # A form starts from the graphics state of its caller and cannot change it.
+        rewritten = self.rewrite_stream(self.doc.xref_stream(xref), form_resources, list(state), plan, forms + (xref,))
+        self._add_stream(plan, xref, rewritten)
+
+    def _add_stream(self, plan: dict, xref: int, rewritten: bytes) -> None:
+        if plan["streams"].get(xref, rewritten) != rewritten:
+            raise RecolorUnsupported("object drawn with different color spaces")
+        plan["streams"][xref] = rewritten
+        plan["used"].add(xref)
+
+    def plan_page(self, page_number: int) -> dict:
+        """Rewritten streams, image /Decode arrays and every object the page draws.
+
+        Raises RecolorUnsupported if the page cannot be recolored.
+        """
+        page_xref = self.doc.page_xref(page_number)
+        resources = _Resources.of(self.doc, page_xref, inherit=True)
+        plan = {"streams": {}, "images": {}, "extgstates": {}, "used": set()}
+        state = ["gray", "gray"]
+        for xref in self.doc[page_number].get_contents():
+            self._add_stream(plan, xref, self.rewrite_stream(self.doc.xref_stream(xref), resources, state, plan, ()))
+        return plan
+
+    def _drawn_objects(self, page_number: int) -> Set[int]:
+        """Every content stream, image and form a page may draw, from its resources."""
+        page = self.doc[page_number]
+        objects = set(page.get_contents())
+        objects.update(image[0] for image in page.get_images(full=True))
+        objects.update(form[0] for form in page.get_xobjects())
+        return objects
+
+    def recolor(self, page_numbers: range) -> Tuple[List[int], Dict[int, str]]:
+        """Recolor every page that can be; return those pages and the reason for each other page."""
+        plans: Dict[int, dict] = {}
+        fallback: Dict[int, str] = {}
+        for page_number in page_numbers:
+            try:
+                plans[page_number] = self.plan_page(page_number)
+            except RecolorUnsupported as e:
+                fallback[page_number] = str(e)
+
+        # An object rewritten differently for two pages cannot serve both.
+        rewrites: Dict[int, bytes] = {}
+        for page_number, plan in list(plans.items()):
+            for xref, data in plan["streams"].items():
+                if rewrites.setdefault(xref, data) != data:
+                    fallback[page_number] = "object drawn with different color spaces"
+        # Objects drawn by an overlay page must keep their colors, so any page sharing them
+        # falls back too, until no recolored page shares anything with an overlay page.
+        untouchable: Set[int] = set()
+        newly_fallen = list(fallback)
+        while newly_fallen:
+            for page_number in newly_fallen:
+                plans.pop(page_number, None)
+                untouchable |= self._drawn_objects(page_number)
+            newly_fallen = [page_number for page_number, plan in plans.items() if plan["used"] & untouchable]
+            for page_number in newly_fallen:
+                fallback[page_number] = "shares objects with a page that cannot be recolored"
+
+        inverse_states: Dict[str, int] = {}
+        for plan in plans.values():
+            for xref, data in plan["streams"].items():
+                self.doc.update_stream(xref, data)
+            for xref, decode in plan["images"].items():
+                self.doc.xref_set_key(xref, "Decode", decode)
+            for (target_xref, prefix, name), state in plan["extgstates"].items():
+                if state not in inverse_states:
+                    inverse_states[state] = self.doc.get_new_xref()
+                    self.doc.update_object(inverse_states[state], state)
+                self.doc.xref_set_key(target_xref, f"{prefix}{name[1:].decode('latin-1')}",
+                                      f"{inverse_states[state]} 0 R")
+        return sorted(plans), fallback
@@ -0,0 +1,226 @@
+"""asyncio HTTP service that inverts PDFs and images sent in the request body.
+
+Endpoints:
+    POST /invert/pdf                 PDF bytes in, inverted PDF bytes out
+    POST /invert/image[?format=PNG]  image bytes in, inverted image bytes out
+    GET  /health                     liveness check
+    GET  /metrics                    request counters and latency percentiles as JSON
+
+Inversions run in a process pool. When SERVICE_MAX_PENDING requests are already being
+served, new ones get 429 straight away instead of queueing without bound.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from configuration import config, logging_config
+from inverter import ImageInverter, PDFInverter
+import utils
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+IMAGE_CONTENT_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "GIF": "image/gif", "BMP": "image/bmp", "TIFF": "image/tiff"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _warm_up() -> None:
+    """Pool task that imports fitz and Pillow, which the inverters otherwise load on first use."""
+    utils.pdf_handler.fitz.Document
+    utils.image_handler.Image.Image
+
+
+class InversionService:
+    """Serves inversion requests over HTTP/1.1, one request per connection."""
+
+    def __init__(self, workers: int = config.SERVICE_WORKERS, max_pending: int = config.SERVICE_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.in_flight = 0
+        self.counters = {"requests": 0, "completed": 0, "failed": 0, "rejected": 0, "bytes_in": 0, "bytes_out": 0}
+        self.latencies = deque(maxlen=config.SERVICE_LATENCY_WINDOW)
+        self._started = time.monotonic()
+
+    def metrics(self) -> Dict[str, float]:
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction: float) -> float:
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else 0.0
+
+        return {
+            **self.counters,
+            "in_flight": self.in_flight,
+            "max_pending": self.max_pending,
+            "workers": self.workers,
+            "uptime_seconds": time.monotonic() - self._started,
+            "latency_p50_seconds": percentile(0.50),
+            "latency_p99_seconds": percentile(0.99),
+        }
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str]]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(400, "Request headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    async def _read_body(self, reader: asyncio.StreamReader, headers: Dict[str, str]) -> bytes:
+        if "content-length" not in headers:
+            raise HTTPError(411, "Content-Length is required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HTTPError(400, "Content-Length is not a number")
+        if length < 0:
+            raise HTTPError(400, "Content-Length is negative")
+        if length > config.SERVICE_MAX_BODY_BYTES:
+            raise HTTPError(413, f"Body larger than {config.SERVICE_MAX_BODY_BYTES} bytes")
+        return await reader.readexactly(length)
+
+    async def _send(self, writer: asyncio.StreamWriter, status: int, content_type: str, body: bytes) -> None:
+        """Send a response, streaming large bodies in chunks so the event loop stays responsive."""
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}", "Connection: close"]
+        if status == 429:
+            head.append("Retry-After: 1")
+        if len(body) <= config.SERVICE_CHUNK_SIZE:
+            head.append(f"Content-Length: {len(body)}")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        else:
+            head.append("Transfer-Encoding: chunked")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+            view = memoryview(body)
+            for start in range(0, len(body), config.SERVICE_CHUNK_SIZE):
+                chunk = view[start:start + config.SERVICE_CHUNK_SIZE]
+                writer.write(f"{len(chunk):x}\r\n".encode("latin-1"))
+                writer.write(chunk)
+                writer.write(b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict) -> None:
+        await self._send(writer, status, "application/json", json.dumps(payload).encode())
+
+    async def _invert(self, path: str, query: Dict[str, list], body: bytes) -> Tuple[bytes, str]:
+        """Run the CPU-bound inversion in the process pool."""
+        loop = asyncio.get_running_loop()
+        if path == "/invert/pdf":
+            output = await loop.run_in_executor(self.executor, PDFInverter.invert_pdf_bytes, body)
+            content_type = "application/pdf"
+        else:
+            output_format = query.get("format", [None])[0]
+            output = await loop.run_in_executor(self.executor, ImageInverter.invert_image_bytes, body, output_format)
+            content_type = IMAGE_CONTENT_TYPES.get((output_format or "").upper(), "application/octet-stream")
+        if output is None:
+            raise HTTPError(422, "Input could not be inverted")
+        return output, content_type
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        start = time.monotonic()
+        self.counters["requests"] += 1
+        admitted = False
+        try:
+            method, target, headers = await self._read_head(reader)
+            url = urlsplit(target)
+            if url.path == "/health":
+                await self._send_json(writer, 200, {"status": "ok"})
+                return
+            if url.path == "/metrics":
+                await self._send_json(writer, 200, self.metrics())
+                return
+            if url.path not in ("/invert/pdf", "/invert/image"):
+                raise HTTPError(404, f"Unknown path {url.path}")
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            # Reject before reading the body, so a saturated server does not buffer uploads.
+            if self.in_flight >= self.max_pending:
+                self.counters["rejected"] += 1
+                raise HTTPError(429, "Server is saturated, retry later")
+
+            self.in_flight += 1
+            admitted = True
+            body = await self._read_body(reader, headers)
+            self.counters["bytes_in"] += len(body)
+            output, content_type = await self._invert(url.path, parse_qs(url.query), body)
+            await self._send(writer, 200, content_type, output)
+            self.counters["completed"] += 1
+            self.counters["bytes_out"] += len(output)
+            self.latencies.append(time.monotonic() - start)
+        except HTTPError as e:
+            if admitted:
+                self.counters["failed"] += 1
+            await self._send_json(writer, e.status, {"error": str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logging.error(f"Inversion service request failed: {e}")
+            self.counters["failed"] += 1
+            await self._send_json(writer, 500, {"error": str(e)})
+        finally:
+            if admitted:
+                self.in_flight -= 1
+            writer.close()
+
+    async def serve(self, host: str = config.SERVICE_HOST, port: int = config.SERVICE_PORT) -> None:
+        """Start the pool and serve until cancelled."""
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            # Start every worker now and have it import fitz and Pillow, which are otherwise
+            # loaded lazily, so no request pays the process start-up or those imports.
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self.executor, _warm_up) for _ in range(self.workers)))
+            server = await asyncio.start_server(self.handle, host, port)
+            logging.info(f"Inversion service listening on {host}:{port} with {self.workers} workers")
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+
+def main():
+    logging_config.setup_logging()
+    try:
+        asyncio.run(InversionService().serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Warm worker: one long-lived process that inverts file after file, requested as JSON lines.
+
+Each line on stdin is a request such as
+
+    {"id": 7, "path": "/data/in/page.pdf", "output_folder": "/data/out", "pdf_mode": "copy", "compress": false}
+
+and gets exactly one line on stdout, in order: the request id plus the fields of its
+InversionResult. Only "path" is required. A PDF request may add "stamps", the fields of
+utils.stamp_handler.Stamps, e.g. {"page_numbers": true, "watermark": "DRAFT"}. The worker exits at end of input.
+
+For many small files the start-up of a fresh interpreter (fitz alone takes ~170 ms to import)
+costs more than the inversion itself; a warm worker pays it once. fitz and Pillow are still
+imported lazily, so a worker that only ever sees PDFs never loads Pillow, and vice versa.
+
+Usage: python invert_pdf_reader/worker.py < requests.jsonl > results.jsonl
+"""
+
+from dataclasses import asdict
+import json
+import logging
+import os
+import sys
+import time
+from typing import IO
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from configuration import config, logging_config
+from inverter import ImageInverter, InversionResult, PDFInverter
+import utils
+
+
+class WarmWorker:
+    """Serves inversion requests from a JSON-lines stream until it ends."""
+
+    def handle(request: dict) -> dict:
+        """Invert the file of one request and return the response record."""
+        path = request.get("path")
+        if not path:
+            result = InversionResult(input_path="", error="Request has no path")
+        elif not (utils.pdf_handler.is_pdf_file(path) or utils.image_handler.is_img_file(path)):
+            result = InversionResult(input_path=path, error=f"Unsupported file type {path}")
+        else:
+            input_folder = os.path.dirname(os.path.abspath(path))
+            output_folder = request.get("output_folder", config.OUTPUT_FOLDER)
+            os.makedirs(output_folder, exist_ok=True)
+            try:
+                if utils.pdf_handler.is_pdf_file(path):
+                    stamps = utils.stamp_handler.Stamps(**request["stamps"]) if request.get("stamps") else None
+                    result = PDFInverter.invert_pdf(path, request.get("pdf_mode", config.PDF_INVERSION_MODE),
+                                                    request.get("compress", config.PDF_COMPRESS_OUTPUT), stamps,
+                                                    input_folder, output_folder)
+                else:
+                    result = ImageInverter.invert_png_file(path, input_folder, output_folder)
+            except Exception as e:
+                logging.error(f"Worker failed on {path}: {e}")
+                result = InversionResult(input_path=path, error=str(e))
+        return {"id": request.get("id"), **asdict(result)}
+
+    def serve(requests: IO[str], responses: IO[str]) -> int:
+        """Answer every request line in order; return the number of requests served."""
+        served = 0
+        for line in requests:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("a request must be a JSON object")
+            except ValueError as e:
+                response = {"id": None, "status": "failed", "error": f"Invalid request: {e}"}
+            else:
+                response = WarmWorker.handle(request)
+            responses.write(json.dumps(response) + "\n")
+            responses.flush()
+            served += 1
+        return served
+
+
+def serve(requests: IO[str], responses: IO[str]) -> int:
+    """Wrapper function to serve JSON-lines inversion requests."""
+    return WarmWorker.serve(requests, responses)
+
+
+def main():
+    logging_config.setup_logging()
+    # Keep stdout for responses only: anything else writing to it, including warnings printed
+    # by native code, is sent to stderr instead.
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    start = time.perf_counter()
+    served = WarmWorker.serve(sys.stdin, responses)
+    logging.info(f"Worker served {served} requests in {time.perf_counter() - start:.1f}s")
+    responses.close()
+
+
+if __name__ == "__main__":
+    main()
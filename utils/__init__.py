@@ -1,10 +1,27 @@
 """
 utils package
 
-Provides utility modules for file, PDF, text, and image handling.
+Provides utility modules for file, PDF, text, and image handling, memory measurement, metrics, page stamps and input indexing.
+Submodules are imported on first access (utils.pdf_handler, ...), so importing the package is cheap.
 """
 
-from . import file_handler
-from . import pdf_handler
-from . import text_handler
-from . import image_handler
\ No newline at end of file
+import importlib
+
+__all__ = [
+    "file_handler",
+    "pdf_handler",
+    "text_handler",
+    "image_handler",
+    "import_handler",
+    "memory_handler",
+    "metrics_handler",
+    "stamp_handler",
+    "index_handler",
+]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        # import_module also binds the submodule on the package, so this runs once per name.
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,8 +2,10 @@
 General file and folder utility functions for existence checks.
 """
 
+import hashlib
 import logging
 import os
+from typing import Optional
 
 def exists_file_path(path_file: str) -> bool :
     if not os.path.exists(path_file):
@@ -28,4 +30,17 @@ def rename_file(old_path: str, new_path: str) -> bool :
         return True
     except Exception as e:
         logging.error(f"Failed to rename file {old_path}: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+def file_sha256(path_file: str, chunk_size: int = 1024 * 1024) -> Optional[str] :
+    """Return the hex SHA-256 of a file's contents, read in chunks, or None if it cannot be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(path_file, "rb") as file:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                digest.update(chunk)
+    except OSError as e:
+        logging.error(f"Failed to hash file {path_file}: {e}")
+        return None
+    return digest.hexdigest()
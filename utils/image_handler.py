@@ -1,15 +1,31 @@
 """Utility functions for handling image files, such as opening, listing, copying, deleting,
 renaming, and converting images to PDF files."""
 
+from __future__ import annotations  # annotations must not trigger the lazy Pillow import
+
+from dataclasses import dataclass
+import io
 import logging
-from PIL import Image
 import os
-from typing import Optional
+import struct
+from typing import Iterator, List, Optional, Tuple
+import zlib
 
 from .file_handler import exists_file_path, exists_folder, rename_file
+from .import_handler import lazy_module
+from .index_handler import IMAGE_KIND, index_files
 from .pdf_handler import is_pdf_file
 
-IMG_EXTENSIONS   = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
+
+def _configure_gif_plugin(image_module) -> None:
+    """Keep later GIF frames in P mode unless their palette differs, so they can be palette-inverted."""
+    from PIL import GifImagePlugin
+    GifImagePlugin.LOADING_STRATEGY = GifImagePlugin.LoadingStrategy.RGB_AFTER_DIFFERENT_PALETTE_ONLY
+
+
+Image = lazy_module("PIL.Image", on_load=_configure_gif_plugin)
+
+IMG_EXTENSIONS   = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff")
 
 def is_img_file(file_name: str) -> bool :
     """Check if the file is an image based on its extension."""
@@ -36,24 +52,20 @@ def get_img_file(input_folder: str, img_filename: str) -> Optional[Image.Image]
         logging.error(f"Failed to open PDF: {e}")
 
 def get_img_files(input_folder: str) -> Optional[Image.Image] :
-    """List all image files in the input folder."""
+    """List the image files in the input folder, largest first; misnamed files are left out."""
     img_files = []
     
     if not exists_folder(input_folder):
         return img_files
     
-    if not os.listdir(input_folder):
-        logging.error(f"Folder {input_folder} is empty")
-        return img_files
-    
-    try:
-        for entry in os.listdir(input_folder):
-            if is_img_file(entry):
-                img_files.append(os.path.join(input_folder, entry))
+    for item in index_files(input_folder, kinds=(IMAGE_KIND,), recursive=False, window=None):
+        if is_img_file(item.path):
+            img_files.append(item.path)
 
-        logging.info(f"Success at getting files from {input_folder}")
-    except Exception as e:
-        logging.error(f"Failed to get image files from {input_folder}: {e}")
+    if not img_files:
+        logging.error(f"Folder {input_folder} has no image files")
+        return img_files
+    logging.info(f"Success at getting files from {input_folder}")
     return img_files
 
 def copy_img_to_output(img_file: Image.Image, input_path: str, output_folder:str) -> None :
@@ -123,7 +135,11 @@ def save_image_as_pdf(img: Image.Image, output_pdf_path: str) -> None:
         return
     
 def merge_images_in_one_pdf(images: list[Image.Image], pdf_output_path: str) -> None:
-    """Merge multiple images into a single file."""
+    """Merge multiple images into a single file.
+
+    All images are held decoded at once and re-encoded by Pillow; for many pages use
+    merger.merge_images_to_pdf, which streams them through PDFStreamWriter.
+    """
     if not images:
         logging.error("No images provided to merge into PDF")
         return
@@ -141,4 +157,366 @@ def merge_images_in_one_pdf(images: list[Image.Image], pdf_output_path: str) ->
     except Exception as e:
         logging.error(f"Failed to merge images into PDF {pdf_output_path}: {e}")
         return
-    
\ No newline at end of file
+
+def _raw_strip_layout(image: Image.Image) -> Optional[list]:
+    """Return (y0, y1, offset, rawmode, stride, orientation) per raw tile, or None if the
+    pixel data is compressed and cannot be read a few rows at a time."""
+    layout = []
+    for tile in image.tile:
+        codec_name, extents, offset, args = tile
+        if codec_name != "raw" or extents[0] != 0 or extents[2] != image.width:
+            return None
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if not stride:
+            try:
+                stride = len(Image.new(image.mode, (image.width, 1)).tobytes("raw", rawmode))
+            except Exception:
+                return None
+        layout.append((extents[1], extents[3], offset, rawmode, stride, orientation))
+    return layout
+
+# TIFF tags a strip of the image needs to be decoded on its own; the layout tags are rewritten.
+TIFF_DECODING_TAGS = (256, 258, 259, 262, 266, 277, 278, 284, 317, 320, 322, 323, 338, 339, 340, 341,
+                      347, 529, 530, 531, 532)
+TIFF_LENGTH, TIFF_STRIP_OFFSETS, TIFF_STRIP_BYTE_COUNTS = 257, 273, 279
+TIFF_TILE_OFFSETS, TIFF_TILE_BYTE_COUNTS = 324, 325
+
+def _tiff_block_rows(image: Image.Image) -> Optional[Tuple[int, List[List[Tuple[int, int]]]]]:
+    """Return the height of a row of TIFF strips or tiles and the (offset, byte count) of the
+    blocks in each such row, or None if the image is not a single-plane striped or tiled TIFF."""
+    if image.format != "TIFF" or image.tag_v2.get(284, 1) != 1:
+        return None
+    tags = image.tag_v2
+    if 322 in tags:
+        block_width, block_height = tags[322], tags.get(323, 0)
+        offsets, counts = tags.get(TIFF_TILE_OFFSETS), tags.get(TIFF_TILE_BYTE_COUNTS)
+    else:
+        block_width, block_height = image.width, min(tags.get(278, image.height), image.height)
+        offsets, counts = tags.get(TIFF_STRIP_OFFSETS), tags.get(TIFF_STRIP_BYTE_COUNTS)
+    if not block_width or not block_height or offsets is None or counts is None:
+        return None
+    offsets = offsets if isinstance(offsets, tuple) else (offsets,)
+    counts = counts if isinstance(counts, tuple) else (counts,)
+    across = -(-image.width // block_width)
+    down = -(-image.height // block_height)
+    if len(offsets) != across * down or len(counts) != len(offsets):
+        return None
+    blocks = list(zip(offsets, counts))
+    return block_height, [blocks[row * across:(row + 1) * across] for row in range(down)]
+
+def _tiff_band(image: Image.Image, file, rows: int, blocks: List[Tuple[int, int]]) -> Image.Image:
+    """Decode consecutive rows of TIFF strips or tiles by wrapping them in a TIFF of their own."""
+    from PIL import TiffImagePlugin
+
+    source = image.tag_v2
+    tiled = 322 in source
+    offsets_tag = TIFF_TILE_OFFSETS if tiled else TIFF_STRIP_OFFSETS
+    counts_tag = TIFF_TILE_BYTE_COUNTS if tiled else TIFF_STRIP_BYTE_COUNTS
+    directory = TiffImagePlugin.ImageFileDirectory_v2(prefix=source.prefix)
+    for tag in TIFF_DECODING_TAGS:
+        if tag in source:
+            directory.tagtype[tag] = source.tagtype[tag]
+            directory[tag] = source[tag]
+    directory.tagtype[TIFF_LENGTH] = directory.tagtype[offsets_tag] = directory.tagtype[counts_tag] = 4  # LONG
+    directory[TIFF_LENGTH] = rows
+
+    data = []
+    for offset, count in blocks:
+        file.seek(offset)
+        data.append(file.read(count))
+    relative, position = [], 0
+    for block in data:
+        relative.append(position)
+        position += len(block)
+    directory[counts_tag] = tuple(len(block) for block in data)
+    # The directory moves strip offsets past its own data; tile offsets have to be set absolute.
+    directory[offsets_tag] = tuple(relative)
+    encoded = directory.tobytes(8)
+    if tiled:
+        directory[offsets_tag] = tuple(8 + len(encoded) + offset for offset in relative)
+        encoded = directory.tobytes(8)
+    header = source.prefix + struct.pack(">HI" if source.prefix == b"MM" else "<HI", 42, 8)
+    band = Image.open(io.BytesIO(header + encoded + b"".join(data)))
+    band.load()
+    if band.mode != image.mode or band.size != (image.width, rows):
+        raise ValueError(f"TIFF strip decoded as {band.mode} {band.size}")
+    return band
+
+def iter_image_strips(img_path: str, strip_height: int,
+                      memory_budget: Optional[int] = None) -> Iterator[Tuple[int, Image.Image]]:
+    """Yield (top row, strip image) pairs covering the image from top to bottom.
+
+    Uncompressed layouts (BMP, PPM, uncompressed TIFF) are read straight from the file a
+    strip at a time, and compressed TIFFs are decoded a few of their own strips or tiles at
+    a time, so memory does not depend on the image size. Other formats (PNG, JPEG, ...) are
+    decoded once and then cut into strips; a warning is logged when that exceeds memory_budget.
+    """
+    with Image.open(img_path) as image:
+        layout = _raw_strip_layout(image)
+        if layout is None:
+            block_rows = _tiff_block_rows(image)
+            if block_rows is not None:
+                yield from _iter_tiff_strips(image, img_path, strip_height, memory_budget, *block_rows)
+                return
+            decoded_bytes = len(Image.new(image.mode, (image.width, 1)).tobytes()) * image.height
+            if memory_budget is not None and decoded_bytes > memory_budget:
+                logging.warning(
+                    f"{img_path} ({image.format}) cannot be decoded a strip at a time; decoding all "
+                    f"{decoded_bytes / 2**20:.0f} MB of it exceeds the {memory_budget / 2**20:.0f} MB budget"
+                )
+            image.load()
+            for top in range(0, image.height, strip_height):
+                yield top, image.crop((0, top, image.width, min(top + strip_height, image.height)))
+            return
+
+        with open(img_path, "rb") as file:
+            for y0, y1, offset, rawmode, stride, orientation in layout:
+                for top in range(y0, y1, strip_height):
+                    rows = min(strip_height, y1 - top)
+                    # Bottom-up files (orientation -1) store the last row first.
+                    first_row = top - y0 if orientation >= 0 else y1 - top - rows
+                    file.seek(offset + first_row * stride)
+                    data = file.read(rows * stride)
+                    strip = Image.frombuffer(image.mode, (image.width, rows), data, "raw", rawmode, stride, orientation)
+                    yield top, strip
+
+def _iter_tiff_strips(image: Image.Image, img_path: str, strip_height: int, memory_budget: Optional[int],
+                      block_height: int, block_rows: List[List[Tuple[int, int]]]) -> Iterator[Tuple[int, Image.Image]]:
+    """Strips of a compressed TIFF, decoding as many rows of its own strips or tiles as fit in one."""
+    if block_height > strip_height and memory_budget is not None:
+        logging.warning(
+            f"{img_path} stores {block_height} rows per strip or tile, more than the {strip_height} "
+            f"rows the memory budget allows; each is decoded whole"
+        )
+    rows_per_band = max(1, strip_height // block_height)
+    with open(img_path, "rb") as file:
+        for first in range(0, len(block_rows), rows_per_band):
+            top = first * block_height
+            rows = min(rows_per_band * block_height, image.height - top)
+            blocks = [block for row in block_rows[first:first + rows_per_band] for block in row]
+            with _tiff_band(image, file, rows, blocks) as band:
+                for offset in range(0, rows, strip_height):
+                    yield top + offset, band.crop((0, offset, image.width, min(offset + strip_height, rows)))
+
+class PNGStreamWriter:
+    """Writes a PNG one horizontal strip at a time, so the full image never has to be in memory.
+
+    Each strip is compressed as an independent, sync-flushed raw deflate block. That lets
+    strips be encoded on several threads and still concatenate into one valid zlib stream.
+    """
+
+    # Output mode -> (bit depth, PNG color type, raw mode of the row bytes)
+    PNG_MODES = {
+        "L": (8, 0, "L"),
+        "LA": (8, 4, "LA"),
+        "RGB": (8, 2, "RGB"),
+        "RGBA": (8, 6, "RGBA"),
+        "I;16": (16, 0, "I;16B"),
+    }
+
+    def __init__(self, output_path: str, width: int, height: int, mode: str, compress_level: int = 6):
+        self.mode = PNGStreamWriter.png_mode(mode)
+        self.width = width
+        self.compress_level = compress_level
+        self._adler = 1
+        self._file = open(output_path, "wb")
+        bit_depth, color_type, _ = PNGStreamWriter.PNG_MODES[self.mode]
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0))
+        # zlib header for a 32K window; the deflate blocks follow in later IDAT chunks.
+        self._write_chunk(b"IDAT", b"\x78\x9c")
+
+    def png_mode(mode: str) -> str:
+        """Mode strips are converted to before encoding."""
+        if mode in PNGStreamWriter.PNG_MODES:
+            return mode
+        if mode in ("I", "I;16L", "I;16B"):
+            return "I;16"
+        return "RGBA" if "A" in mode else "RGB"
+
+    def _write_chunk(self, chunk_type: bytes, data: bytes) -> None:
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def encode_strip(self, strip: Image.Image) -> Tuple[bytes, bytes]:
+        """Return (filtered rows, deflate block) for a strip; safe to call from worker threads."""
+        if strip.mode != self.mode:
+            strip = strip.convert(self.mode)
+        data = strip.tobytes("raw", PNGStreamWriter.PNG_MODES[self.mode][2])
+        row_bytes = len(data) // strip.height
+        # Filter type 0 (None) in front of every row.
+        rows = b"".join(b"\x00" + data[start:start + row_bytes] for start in range(0, len(data), row_bytes))
+        compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return rows, compressor.compress(rows) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def write_encoded(self, rows: bytes, block: bytes) -> None:
+        """Append a strip returned by encode_strip; strips must be written top to bottom."""
+        self._adler = zlib.adler32(rows, self._adler)
+        self._write_chunk(b"IDAT", block)
+
+    def write_strip(self, strip: Image.Image) -> None:
+        """Encode and append the next strip."""
+        self.write_encoded(*self.encode_strip(strip))
+
+    def close(self) -> None:
+        """Terminate the deflate stream and write the trailing chunks."""
+        if self._file.closed:
+            return
+        final_block = zlib.compressobj(self.compress_level, zlib.DEFLATED, -zlib.MAX_WBITS).flush(zlib.Z_FINISH)
+        self._write_chunk(b"IDAT", final_block + struct.pack(">I", self._adler))
+        self._write_chunk(b"IEND", b"")
+        self._file.close()
+
+    def __enter__(self) -> "PNGStreamWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+@dataclass
+class PDFImage:
+    """An image XObject ready to be written by PDFStreamWriter, with its samples already encoded."""
+    width: int
+    height: int
+    colorspace: str  # PDF name, e.g. "/DeviceRGB"
+    bits: int
+    data: bytes
+    filter: str = "/FlateDecode"
+    decode: Optional[List[int]] = None
+    smask: Optional[bytes] = None  # 8-bit alpha channel, flate-compressed
+    dpi: Tuple[float, float] = (72.0, 72.0)
+
+
+def image_dpi(image: Image.Image) -> Tuple[float, float]:
+    """Horizontal and vertical resolution of an image, 72 dpi if it has none.
+
+    Values under 10 dpi are treated as missing: they are placeholders some writers store
+    (Pillow saves TIFFs at 1 dpi by default), not the resolution of a real page.
+    """
+    dpi = image.info.get("dpi")
+    if dpi and all(value >= 10 for value in dpi):
+        return float(dpi[0]), float(dpi[1])
+    return 72.0, 72.0
+
+
+class PDFStreamWriter:
+    """Writes a PDF one image page at a time, so pages are not kept in memory once written.
+
+    Every object goes to the file as soon as it is complete and only its offset is kept for
+    the cross-reference table. Object 1 is the catalog and object 2 the page tree, which is
+    written last because it lists every page.
+    """
+
+    # Output mode -> (PDF color space, bits per component, raw mode of the samples)
+    PDF_MODES = {
+        "L": ("/DeviceGray", 8, "L"),
+        "RGB": ("/DeviceRGB", 8, "RGB"),
+        "CMYK": ("/DeviceCMYK", 8, "CMYK"),
+        "I;16": ("/DeviceGray", 16, "I;16B"),
+    }
+
+    def __init__(self, output_path: str):
+        self._file = open(output_path, "wb")
+        self._offsets: List[int] = [0, 0, 0]  # index = object number; 1 and 2 are filled in by close()
+        self._page_numbers: List[int] = []
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def pdf_mode(mode: str) -> str:
+        """Mode images are converted to before their samples are encoded."""
+        if mode in PDFStreamWriter.PDF_MODES:
+            return mode
+        if mode in ("I", "I;16L", "I;16B"):
+            return "I;16"
+        return "L" if mode in ("1", "LA", "La") else "RGB"
+
+    def encode_image(image: Image.Image, compress_level: int = 6) -> PDFImage:
+        """Flate-compress the samples (and any alpha as a soft mask); safe to call from worker threads."""
+        smask = None
+        if image.has_transparency_data:
+            if "A" not in image.mode:
+                image = image.convert("LA" if image.mode in ("1", "L") else "RGBA")
+            smask = zlib.compress(image.getchannel("A").tobytes(), compress_level)
+        mode = PDFStreamWriter.pdf_mode(image.mode)
+        colorspace, bits, rawmode = PDFStreamWriter.PDF_MODES[mode]
+        dpi = image_dpi(image)
+        if mode != image.mode:
+            image = image.convert(mode)
+        data = zlib.compress(image.tobytes("raw", rawmode), compress_level)
+        return PDFImage(image.width, image.height, colorspace, bits, data, smask=smask, dpi=dpi)
+
+    def _write_object(self, body: bytes, stream: Optional[bytes] = None) -> int:
+        """Append the next object and return its number."""
+        number = len(self._offsets)
+        self._offsets.append(self._file.tell())
+        self._write_numbered(number, body, stream)
+        return number
+
+    def _write_numbered(self, number: int, body: bytes, stream: Optional[bytes] = None) -> None:
+        self._offsets[number] = self._file.tell()
+        self._file.write(b"%d 0 obj\n" % number)
+        if stream is None:
+            self._file.write(body + b"\nendobj\n")
+            return
+        self._file.write(body[:-2] + b" /Length %d >>\nstream\n" % len(stream))
+        self._file.write(stream)
+        self._file.write(b"\nendstream\nendobj\n")
+
+    def write_image_page(self, image: PDFImage) -> None:
+        """Append a page showing image at its resolution (72 dpi if unknown)."""
+        smask_ref = b""
+        if image.smask is not None:
+            smask_number = self._write_object(
+                b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray "
+                b"/BitsPerComponent 8 /Filter /FlateDecode >>" % (image.width, image.height), image.smask)
+            smask_ref = b" /SMask %d 0 R" % smask_number
+        decode = b""
+        if image.decode:
+            decode = b" /Decode [" + b" ".join(b"%d" % value for value in image.decode) + b"]"
+        image_number = self._write_object(
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent %d "
+            b"/Filter %s%s%s >>" % (image.width, image.height, image.colorspace.encode(), image.bits,
+                                    image.filter.encode(), decode, smask_ref), image.data)
+
+        width = image.width * 72.0 / image.dpi[0]
+        height = image.height * 72.0 / image.dpi[1]
+        content_number = self._write_object(b"<< >>", b"q %.4f 0 0 %.4f 0 0 cm /Im0 Do Q" % (width, height))
+        page_number = self._write_object(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] /Resources << /XObject << /Im0 %d 0 R >> >> "
+            b"/Contents %d 0 R >>" % (width, height, image_number, content_number))
+        self._page_numbers.append(page_number)
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_numbers)
+
+    def close(self) -> None:
+        """Write the page tree, the catalog and the cross-reference table."""
+        if self._file.closed:
+            return
+        kids = b" ".join(b"%d 0 R" % number for number in self._page_numbers)
+        self._write_numbered(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._page_numbers)))
+        self._write_numbered(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref_offset = self._file.tell()
+        self._file.write(b"xref\n0 %d\n0000000000 65535 f \n" % len(self._offsets))
+        for offset in self._offsets[1:]:
+            self._file.write(b"%010d 00000 n \n" % offset)
+        self._file.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                         % (len(self._offsets), xref_offset))
+        self._file.close()
+
+    def __enter__(self) -> "PDFStreamWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
@@ -0,0 +1,53 @@
+"""
+Utility functions for deferring the import of heavy modules (fitz, Pillow) until first use,
+so that a process only pays for the libraries its files actually need.
+"""
+
+import importlib
+import sys
+import threading
+import types
+from typing import Callable, Optional
+
+
+class LazyModule(types.ModuleType):
+    """Stands in for a module and imports it on the first attribute access.
+
+    on_load, if given, is called once with the real module right after it is imported.
+    """
+
+    def __init__(self, name: str, on_load: Optional[Callable[[types.ModuleType], None]] = None):
+        super().__init__(name)
+        self._lazy_on_load = on_load
+        self._lazy_module = None
+        self._lazy_lock = threading.Lock()
+
+    def _load(self) -> types.ModuleType:
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                module = importlib.import_module(self.__name__)
+                if self._lazy_on_load:
+                    self._lazy_on_load(module)
+                self._lazy_module = module
+        return self._lazy_module
+
+    def __getattr__(self, attribute: str):
+        # Only called for attributes the proxy itself lacks, i.e. everything of the real module.
+        module = self._lazy_module or self._load()
+        return getattr(module, attribute)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_module(name: str, on_load: Optional[Callable[[types.ModuleType], None]] = None) -> types.ModuleType:
+    """Return the module if it is already imported, otherwise a LazyModule for it."""
+    module = sys.modules.get(name)
+    if module is not None and on_load is None:
+        return module
+    return LazyModule(name, on_load)
+
+
+def is_loaded(name: str) -> bool:
+    """True if the module has really been imported in this process."""
+    return name in sys.modules
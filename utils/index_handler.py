@@ -0,0 +1,113 @@
+"""
+Index input folders with os.scandir: walk them recursively, classify files by their first
+bytes rather than their extension, and yield them largest first without listing everything.
+"""
+
+from dataclasses import dataclass
+import heapq
+import logging
+import os
+from typing import Collection, Iterator, Optional, Tuple
+
+PDF_KIND = "pdf"
+IMAGE_KIND = "image"
+SNIFF_BYTES = 1024  # readers accept a PDF header anywhere in the first 1024 bytes
+DEFAULT_WINDOW = 1024
+
+# Leading bytes of the image formats Pillow is used for here.
+IMAGE_SIGNATURES = (
+    b"\x89PNG\r\n\x1a\n",
+    b"\xff\xd8\xff",  # JPEG
+    b"GIF87a",
+    b"GIF89a",
+    b"BM",  # BMP
+    b"II*\x00",  # little-endian TIFF
+    b"MM\x00*",  # big-endian TIFF
+)
+EXTENSION_KINDS = {".pdf": PDF_KIND, ".png": IMAGE_KIND, ".jpg": IMAGE_KIND, ".jpeg": IMAGE_KIND,
+                   ".bmp": IMAGE_KIND, ".gif": IMAGE_KIND, ".tif": IMAGE_KIND, ".tiff": IMAGE_KIND}
+
+
+@dataclass(frozen=True)
+class IndexedFile:
+    """A file found by index_files, with the size and mtime of its single stat."""
+    path: str
+    relative_path: str  # relative to the indexed root
+    kind: str
+    size: int
+    mtime_ns: int
+
+
+def sniff_kind(head: bytes) -> Optional[str]:
+    """PDF_KIND or IMAGE_KIND for the first bytes of a file, or None if it is neither."""
+    if b"%PDF-" in head[:SNIFF_BYTES]:
+        return PDF_KIND
+    if head.startswith(IMAGE_SIGNATURES):
+        return IMAGE_KIND
+    return None
+
+def sniff_file(path: str) -> Optional[str]:
+    """Read the first bytes of path and classify them; unreadable files are None."""
+    try:
+        with open(path, "rb") as file:
+            return sniff_kind(file.read(SNIFF_BYTES))
+    except OSError as e:
+        logging.error(f"Could not read {path}: {e}")
+        return None
+
+def scan_files(root: str, recursive: bool = True) -> Iterator[os.DirEntry]:
+    """Yield the regular files under root, depth first; symlinked folders are not followed."""
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                folders.append(entry.path)
+                        elif entry.is_file():
+                            yield entry
+                    except OSError as e:
+                        logging.error(f"Could not inspect {entry.path}: {e}")
+        except OSError as e:
+            logging.error(f"Could not list folder {folder}: {e}")
+
+def _classify(entry: os.DirEntry, root: str, kinds: Collection[str]) -> Optional[IndexedFile]:
+    kind = sniff_file(entry.path)
+    expected = EXTENSION_KINDS.get(os.path.splitext(entry.name)[1].lower())
+    if expected and kind != expected:
+        logging.warning(f"{entry.path} is named as {expected} but contains {kind or 'neither a PDF nor an image'}")
+    if kind not in kinds:
+        return None
+    try:
+        stat = entry.stat()
+    except OSError as e:
+        logging.error(f"Could not stat {entry.path}: {e}")
+        return None
+    return IndexedFile(entry.path, os.path.relpath(entry.path, root), kind, stat.st_size, stat.st_mtime_ns)
+
+def index_files(root: str, kinds: Collection[str] = (PDF_KIND, IMAGE_KIND), recursive: bool = True,
+                window: Optional[int] = DEFAULT_WINDOW) -> Iterator[IndexedFile]:
+    """Yield the files under root whose content is one of kinds, largest first within a window.
+
+    Up to window files are held back and the largest of them is yielded whenever another one
+    is found, so the first items come out long before a huge tree has been walked. The order
+    is exactly by size when the tree has no more than window files; window=None always waits
+    for the whole tree.
+    """
+    pending: list = []  # min-heap on -size
+    order = 0
+    for entry in scan_files(root, recursive):
+        item = _classify(entry, root, kinds)
+        if item is None:
+            continue
+        entry_key: Tuple[int, int, IndexedFile] = (-item.size, order, item)
+        order += 1
+        if window is not None and len(pending) >= window:
+            yield heapq.heappushpop(pending, entry_key)[2]
+        else:
+            heapq.heappush(pending, entry_key)
+    while pending:
+        yield heapq.heappop(pending)[2]
@@ -0,0 +1,198 @@
+"""
+Utility functions and classes for timing pipeline stages, keeping counters and histograms,
+exporting them as Prometheus text or JSON lines, and profiling a single slow document.
+"""
+
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from typing import Dict, Iterator, Tuple
+
+# Upper bounds (seconds) of the histogram buckets; +Inf is always added.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _series_key(name: str, labels: Dict[str, object]) -> SeriesKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, identified by a name and a set of labels."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters: Dict[SeriesKey, float] = {}
+        # Per series: one count per bucket (not cumulative), then the sum and the count.
+        self._histograms: Dict[SeriesKey, list] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = _series_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _series_key(name, labels)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def record_file(self, pipeline: str, result) -> None:
+        """Count one finished file (an InversionResult) and observe the time of each of its stages."""
+        self.increment("invert_files_total", pipeline=pipeline, status=result.status)
+        if result.status != "ok":
+            return
+        self.increment("invert_pages_total", result.pages, pipeline=pipeline)
+        self.increment("invert_bytes_out_total", result.bytes_out, pipeline=pipeline)
+        self.observe("invert_file_seconds", result.seconds, pipeline=pipeline)
+        for stage, seconds in result.stages.items():
+            self.observe("invert_stage_seconds", seconds, pipeline=pipeline, stage=stage)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _snapshot(self) -> Tuple[Dict[SeriesKey, float], Dict[SeriesKey, list]]:
+        with self._lock:
+            return dict(self._counters), {key: list(series) for key, series in self._histograms.items()}
+
+    def to_prometheus(self) -> str:
+        """Render every series in the Prometheus text exposition format."""
+        counters, histograms = self._snapshot()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), series in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {series[-2]:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {series[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self) -> str:
+        """Render every series as one JSON object per line."""
+        counters, histograms = self._snapshot()
+        lines = []
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(json.dumps({"name": name, "type": "counter", "labels": dict(labels), "value": value}))
+        for (name, labels), series in sorted(histograms.items()):
+            buckets = {f"{bound:g}": count for bound, count in zip(self.buckets, series)}
+            buckets["+Inf"] = series[len(self.buckets)]
+            lines.append(json.dumps({"name": name, "type": "histogram", "labels": dict(labels),
+                                     "buckets": buckets, "sum": series[-2], "count": series[-1]}))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def export(self, path: str, format: str = "prometheus") -> None:
+        """Write the current metrics to path, replacing the previous export atomically."""
+        text = self.to_json_lines() if format == "jsonl" else self.to_prometheus()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        partial_path = f"{path}.part"
+        with open(partial_path, "w") as file:
+            file.write(text)
+        os.replace(partial_path, path)
+
+
+class NullRegistry(MetricsRegistry):
+    """A registry that drops everything, used when metrics are disabled."""
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        pass
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        pass
+
+
+_registry: MetricsRegistry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    """Return the registry the inversion pipeline reports to."""
+    return _registry
+
+
+def set_registry(registry: MetricsRegistry) -> None:
+    """Replace the process-wide registry, e.g. with a NullRegistry or a custom subclass."""
+    global _registry
+    _registry = registry
+
+
+class StageTimer:
+    """Accumulates the wall time spent in each named stage of processing one file."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def profiled(name: str, output_folder: str, top: int = 30) -> Iterator[None]:
+    """Run the block under cProfile and tracemalloc and write both reports to output_folder.
+
+    Writes <name>.prof (load it with pstats or snakeviz) and <name>.tracemalloc.txt with the
+    peak traced memory and the lines holding the most memory when the block ended.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(25)
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+
+        base_path = os.path.join(output_folder, name)
+        profiler.dump_stats(f"{base_path}.prof")
+        with open(f"{base_path}.tracemalloc.txt", "w") as file:
+            file.write(f"current {current / 2**20:.1f} MB, peak {peak / 2**20:.1f} MB\n")
+            for statistic in snapshot.statistics("lineno")[:top]:
+                file.write(f"{statistic}\n")
+        logging.info(f"Profile of {name} written to {base_path}.prof and {base_path}.tracemalloc.txt")
@@ -2,12 +2,18 @@
 Utility functions for handling PDF files, such as opening, listing, copying, deleting,
 renaming, and moving PDF files. Uses PyMuPDF for PDF operations.
 """
-import fitz
+from __future__ import annotations  # annotations must not trigger the lazy fitz import
+
+from concurrent.futures import ProcessPoolExecutor
 import logging
 import os
-from typing import List, Optional
+from typing import Iterable, List, Optional, Sequence, Tuple
 
 from .file_handler import exists_file_path, exists_folder
+from .import_handler import lazy_module
+from .index_handler import PDF_KIND, index_files
+
+fitz = lazy_module("fitz")
 
 PDF_EXTENSION = ".pdf"
 
@@ -22,6 +28,40 @@ def check_pdf_validity(pdf_path: str) -> bool :
         return False
     return True
 
+def inherited_resources(doc: fitz.Document, page_xref: int) -> str:
+    """Return the Resources dictionary a page inherits from its Pages ancestors, or an empty one."""
+    node_xref = page_xref
+    while True:
+        parent_type, parent_value = doc.xref_get_key(node_xref, "Parent")
+        if parent_type != "xref":
+            return "<<>>"
+        node_xref = int(parent_value.split()[0])
+        resources_type, resources_value = doc.xref_get_key(node_xref, "Resources")
+        if resources_type == "xref":
+            return doc.xref_object(int(resources_value.split()[0]), compressed=True)
+        if resources_type == "dict":
+            return resources_value
+
+def set_page_resource(doc: fitz.Document, page_xref: int, category: str, name: str, value: str) -> None:
+    """Set /category/name (e.g. ExtGState/GSDiff) in a page's Resources, following indirect dictionaries."""
+    resources_type, resources_value = doc.xref_get_key(page_xref, "Resources")
+    if resources_type == "xref":
+        target_xref, prefix = int(resources_value.split()[0]), ""
+    elif resources_type == "dict":
+        target_xref, prefix = page_xref, "Resources/"
+    else:
+        # Pages that inherit Resources from the page tree get their own copy, so that
+        # adding an entry does not hide the inherited fonts and images.
+        target_xref, prefix = doc.get_new_xref(), ""
+        doc.update_object(target_xref, inherited_resources(doc, page_xref))
+        doc.xref_set_key(page_xref, "Resources", f"{target_xref} 0 R")
+
+    category_type, category_value = doc.xref_get_key(target_xref, prefix + category)
+    if category_type == "xref":
+        doc.xref_set_key(int(category_value.split()[0]), name, value)
+    else:
+        doc.xref_set_key(target_xref, f"{prefix}{category}/{name}", value)
+
 def get_pdf_file(input_folder: str, pdf_filename: str) -> Optional[fitz.Document] :
     """Get a document object by reading a pdf with filename in the input folder"""
 
@@ -43,20 +83,19 @@ def get_pdf_file(input_folder: str, pdf_filename: str) -> Optional[fitz.Document
     
 
 def get_pdf_files(input_folder: str) -> List[str] :
-    """List all PDF files in the input folder."""
+    """List the PDF files in the input folder, largest first; a .pdf that is not a PDF is left out."""
     pdf_files = []
     
     if not exists_folder(input_folder):
         return pdf_files
     
-    if not os.listdir(input_folder):
-        logging.error(f"Folder {input_folder} is empty")
-        return pdf_files
-    
-    for entry in os.listdir(input_folder):
-        if is_pdf_file(entry):
-            pdf_files.append(os.path.join(input_folder, entry))
+    for item in index_files(input_folder, kinds=(PDF_KIND,), recursive=False, window=None):
+        if is_pdf_file(item.path):
+            pdf_files.append(item.path)
 
+    if not pdf_files:
+        logging.error(f"Folder {input_folder} has no PDF files")
+        return pdf_files
     logging.info(f"Success at getting files from {input_folder}")
     return pdf_files
 
@@ -141,6 +180,36 @@ def move_all_pdf_files(src_folder: str, dest_folder: str) -> None:
         file_path = os.path.join(src_folder, filename)
         move_pdf_file(file_path, dest_folder)
 
+def merge_pdf_files(pdf_paths: Iterable[str], output_path: str, **save_options) -> Optional[int]:
+    """Concatenate the PDFs in order into output_path and return the number of pages written.
+
+    pdf_paths may be any iterable, e.g. a generator over a huge folder: each input is opened,
+    copied and closed before the next one, so only the output stays open.
+    """
+    output_folder = os.path.dirname(output_path)
+    if output_folder and not exists_folder(output_folder):
+        return None
+
+    merged = fitz.open()
+    try:
+        for pdf_path in pdf_paths:
+            if not exists_file_path(pdf_path) or not check_pdf_validity(pdf_path):
+                logging.error(f"Merge into {output_path} stopped at {pdf_path}")
+                return None
+            with fitz.open(pdf_path) as pdf:
+                merged.insert_pdf(pdf)
+        if len(merged) == 0:
+            logging.error(f"No PDF provided to merge into {output_path}")
+            return None
+        merged.save(output_path, **save_options)
+        logging.info(f"Merged {len(merged)} pages into {output_path}")
+        return len(merged)
+    except Exception as e:
+        logging.error(f"Failed to merge PDFs into {output_path}: {e}")
+        return None
+    finally:
+        merged.close()
+
 def merge_two_pdf_files(pdf_file_path_1: str, pdf_file_path_2: str, output_folder: str) -> None:
     """Merge two pdf files in one file at the output folder by concateneting the begining of the second into the end of the first."""
     if not exists_file_path(pdf_file_path_1) or not exists_file_path(pdf_file_path_2):
@@ -158,56 +227,107 @@ def merge_two_pdf_files(pdf_file_path_1: str, pdf_file_path_2: str, output_folde
     name_2, _ = os.path.splitext(filename_2)
     new_filename = f"{name_1}_{name_2}_merged{PDF_EXTENSION}"
     new_path = os.path.join(output_folder, new_filename)
-    # Joins the two filenames and saves into the ouput folder
-    try: 
-        pdf_1 = fitz.open(pdf_file_path_1)
-        pdf_2 = fitz.open(pdf_file_path_2)
-        pdf_1.insert_pdf(pdf_2)
-        pdf_1.save(new_path)    
-        logging.info(f"Sucess at merging the pdfs {filename_1} and {filename_2} to {new_path}")
-    except Exception:
+    if merge_pdf_files([pdf_file_path_1, pdf_file_path_2], new_path) is None:
         logging.error(f"Merge of {filename_1} and {filename_2} failed.")
-    # Save the pdf in the ouput folder
-    finally:
-        pdf_1.close()
-        pdf_2.close()
+        return
+    logging.info(f"Sucess at merging the pdfs {filename_1} and {filename_2} to {new_path}")
 
 def add_page_number_to_pdf(pdf_file_path : str, output_folder: str) -> None:
     """Add page number in the pdf at the bottom right"""
-    if not exists_file_path(pdf_file_path):
-        return
-    
-    if not check_pdf_validity(pdf_file_path):
+    from .stamp_handler import Stamps, stamp_pdf
+
+    if not exists_folder(output_folder):
         return
-    
+
+    name, extension = os.path.splitext(os.path.basename(pdf_file_path))
+    output_path = os.path.join(output_folder, f"{name}_numbered{extension}")
+    if stamp_pdf(pdf_file_path, Stamps(page_numbers=True), output_path):
+        logging.info(f"Added page to {name}")
+
+def add_watermark_to_pdf(pdf_file_path: str, text: str, output_folder: str) -> None:
+    """Add a diagonal, translucent text watermark across every page."""
+    from .stamp_handler import Stamps, stamp_pdf
+
     if not exists_folder(output_folder):
         return
-    
 
+    name, extension = os.path.splitext(os.path.basename(pdf_file_path))
+    output_path = os.path.join(output_folder, f"{name}_watermarked{extension}")
+    if stamp_pdf(pdf_file_path, Stamps(watermark=text), output_path):
+        logging.info(f"Added watermark to {name}")
+
+def parse_page_ranges(spec: str, page_count: int) -> Optional[List[range]]:
+    """Turn a spec such as "1-10,11-50,51-" (1-based, inclusive; "-5" and "7" work too) into page ranges."""
+    page_ranges = []
+    for part in spec.split(","):
+        first, separator, last = part.strip().partition("-")
+        try:
+            start = int(first) if first.strip() else 1
+            stop = (int(last) if last.strip() else page_count) if separator else start
+        except ValueError:
+            logging.error(f"Invalid page range {part!r} in {spec!r}")
+            return None
+        if not 1 <= start <= stop <= page_count:
+            logging.error(f"Page range {part!r} is outside pages 1-{page_count}")
+            return None
+        page_ranges.append(range(start - 1, stop))
+    return page_ranges
+
+def _write_page_ranges(pdf: fitz.Document, parts: Sequence[Tuple[range, str]]) -> List[str]:
+    """Save each page range of the open pdf to its path."""
+    for page_range, output_path in parts:
+        with fitz.open() as part:
+            part.insert_pdf(pdf, from_page=page_range.start, to_page=page_range.stop - 1)
+            part.save(output_path)
+    return [output_path for _, output_path in parts]
+
+def _write_page_ranges_from_file(pdf_path: str, parts: Sequence[Tuple[range, str]]) -> List[str]:
+    """Process pool body: open the source once and write its share of the parts."""
+    with fitz.open(pdf_path) as pdf:
+        return _write_page_ranges(pdf, parts)
+
+def split_pdf_by_ranges(pdf_pathname: str, page_ranges: str, output_folder: str, workers: int = 1) -> List[str]:
+    """Write one PDF per page range of the spec, as <name>_part_<n>.pdf, and return their paths.
+
+    The source is opened once and every part is written from it; with workers > 1 the parts
+    are shared out over a process pool, each worker opening the source once.
+    """
+    if not exists_file_path(pdf_pathname) or not check_pdf_validity(pdf_pathname):
+        return []
+    if not exists_folder(output_folder):
+        return []
+
+    name, extension = os.path.splitext(os.path.basename(pdf_pathname))
     try:
-        pdf = fitz.open(pdf_file_path)
-        page_numbers = range(len(pdf))
-        for page_number in page_numbers:
-            page = pdf[page_number]
-            text = f"{page_number + 1} / {len(pdf)}"    # Format of the page number ouput 
-            # Position of the text
-            rect = page.rect
-            x: float = rect.x1 - 60
-            y: float = rect.y1 - 20
-            page.insert_text((x, y), text, fontsize=12, color=(0, 0, 0))    # Insert the page number with black color
-        
-        filename = os.path.basename(pdf_file_path)
-        name, extension = os.path.splitext(filename)
-        new_filename = f"{name}_numbered{extension}"
-        output_path = os.path.join(output_folder, new_filename)
-        pdf.save(output_path)
-        logging.info(f"Added page to {name}")
-    except Exception:
-        logging.error(f"Failed to add page numbers.")
-    finally:
-        pdf.close()
+        with fitz.open(pdf_pathname) as pdf:
+            ranges = parse_page_ranges(page_ranges, len(pdf))
+            if not ranges:
+                return []
+            parts = [(page_range, os.path.join(output_folder, f"{name}_part_{index}{extension}"))
+                     for index, page_range in enumerate(ranges, start=1)]
+            if workers <= 1 or len(parts) == 1:
+                written = _write_page_ranges(pdf, parts)
+                logging.info(f"Success at spliting {pdf_pathname} into {len(written)} parts")
+                return written
+    except Exception as e:
+        logging.error(f"Error at spliting {pdf_pathname}: {e}")
+        return []
+
+    try:
+        workers = min(workers, len(parts))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_write_page_ranges_from_file, pdf_pathname, parts[index::workers])
+                       for index in range(workers)]
+            for future in futures:
+                future.result()
+    except Exception as e:
+        logging.error(f"Error at spliting {pdf_pathname}: {e}")
+        return []
+    logging.info(f"Success at spliting {pdf_pathname} into {len(parts)} parts with {workers} workers")
+    return [output_path for _, output_path in parts]
 
 def split_pdf(pdf_pathname: str, page_number: int, output_folder: str) -> None:
+    """Split the pdf in two parts, the second one starting after page_number."""
     if not exists_file_path(pdf_pathname):
         return
     if not isinstance(page_number, int):
@@ -215,50 +335,12 @@ def split_pdf(pdf_pathname: str, page_number: int, output_folder: str) -> None:
         return
     if not exists_folder(output_folder):
         return
-
-    try:
-        pdf = fitz.open(pdf_pathname)
-        number_pages = len(pdf)
-        pdf.close()
-    except Exception:
-        logging.error(f"Error at opening {pdf_pathname}")
-        return
-    
-    if not (1 <= page_number < number_pages):
-        logging.error(f"page_number must be between 1 and {number_pages}")
-        pdf.close()
+    if page_number < 1:
+        logging.error("page_number must be at least 1")
         return
-    
-    name, extension = os.path.splitext(os.path.basename(pdf_pathname))
-    
-    # First part: pages 0 to page_number - 1
-    pdf_part_1 = fitz.open(pdf_pathname)
-    pdf_part_1.select(list(range(page_number)))
-    filename_1 = f"{name}_part_1{extension}"
-    output_path_1 = os.path.join(output_folder, filename_1)
-    try:
-        pdf_part_1.save(output_path_1)
-    except Exception as e:
-        logging.error(f"Error saving part 1: {e}")
-    finally: 
-        pdf_part_1.close()
 
-    # Second part    
-    if page_number + 1 >= number_pages:
-        return
-    
-    pdf_part_2 = fitz.open(pdf_pathname)
-    pdf_part_2.select(list(range(page_number, number_pages)))
-    filename_2 = f"{name}_part_2{extension}"
-    output_path_2 = os.path.join(output_folder, filename_2)
-    try:
-        pdf_part_2.save(output_path_2)
-    except Exception as e:
-        logging.error(f"Error saving part 2: {e}")
-    finally:
-        pdf_part_2.close()
-    
-    logging.info(f"Success at spliting {pdf_pathname} at the page number: {page_number}")
+    # A page_number at or past the last page fails the range check of the second part.
+    split_pdf_by_ranges(pdf_pathname, f"1-{page_number},{page_number + 1}-", output_folder)
 
-# TODO: features to add: compress a pdf, convert pdf to word, convert word to pdf, convert jpeg to pdf, convert pdf to jpeg
-#   add a watermark to pdf, rotate a pdf, html to pdf.
\ No newline at end of file
+# TODO: features to add: convert pdf to word, convert word to pdf, convert jpeg to pdf,
+#   rotate a pdf, html to pdf.
\ No newline at end of file
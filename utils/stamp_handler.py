@@ -0,0 +1,211 @@
+"""Stamp page numbers, a header, a footer and a watermark onto PDF pages with shared objects.
+
+The font, the watermark opacity and the watermark/header/footer Form XObjects are created
+once per document and referenced from every page, and so is the stream placing them on a
+page of a given size. Only the page-number text gets a small stream of its own per page.
+"""
+from __future__ import annotations  # annotations must not trigger the lazy fitz import
+
+from dataclasses import dataclass
+import logging
+import math
+from typing import Callable, Dict, Optional, Tuple
+
+from .file_handler import exists_file_path
+from .pdf_handler import check_pdf_validity, fitz, set_page_resource
+
+FONT_NAME = "StampF"
+MARGIN = 20  # points between the page edge and the baseline of a header, footer or page number
+PAGE_NUMBER_RIGHT_MARGIN = 30
+
+
+@dataclass
+class Stamps:
+    """What to stamp on every page; colors are (r, g, b) in 0..1 as they should look on the source."""
+    page_numbers: bool = False
+    page_number_format: str = "{page} / {pages}"
+    header: Optional[str] = None
+    footer: Optional[str] = None
+    watermark: Optional[str] = None
+    font_size: float = 12
+    color: Tuple[float, float, float] = (0, 0, 0)
+    watermark_size: float = 60
+    watermark_color: Tuple[float, float, float] = (0.5, 0.5, 0.5)
+    watermark_opacity: float = 0.15
+    watermark_angle: float = 45
+
+
+def _pdf_string(text: str) -> str:
+    """text as a PDF literal string in WinAnsiEncoding; characters it lacks become "?"."""
+    escaped = []
+    for byte in text.encode("cp1252", errors="replace"):
+        if byte in b"()\\":
+            escaped.append("\\" + chr(byte))
+        elif 32 <= byte < 127:
+            escaped.append(chr(byte))
+        else:
+            escaped.append(f"\\{byte:03o}")
+    return "(" + "".join(escaped) + ")"
+
+def _text_width(text: str, size: float) -> float:
+    # Summed per character: fitz measures whole strings with non-ASCII characters too short.
+    return sum(fitz.get_text_length(character, fontname="helv", fontsize=size) for character in text)
+
+def _matrix(matrix: fitz.Matrix) -> str:
+    return " ".join(f"{value:.4f}" for value in matrix)
+
+
+class PageStamper:
+    """Adds one set of Stamps to pages of a document.
+
+    With inverted, every color is replaced by its inverse, so the stamps look as asked once
+    they are drawn on top of an inverted page.
+    """
+
+    def __init__(self, doc: fitz.Document, stamps: Stamps, inverted: bool = False, page_count: Optional[int] = None):
+        self.doc = doc
+        self.stamps = stamps
+        self.inverted = inverted
+        self.page_count = len(doc) if page_count is None else page_count
+        self._xrefs: Dict[Tuple, int] = {}
+        self.created = 0
+        self.requested = 0
+
+    @property
+    def deduplicated(self) -> int:
+        """Number of objects that would have been created without sharing."""
+        return self.requested - self.created
+
+    def _shared(self, key: Tuple, create: Callable[[], int]) -> int:
+        """Return the xref registered under key, creating it on first use."""
+        self.requested += 1
+        if key not in self._xrefs:
+            self._xrefs[key] = create()
+            self.created += 1
+        return self._xrefs[key]
+
+    def _new_object(self, body: str, stream: Optional[str] = None) -> int:
+        xref = self.doc.get_new_xref()
+        self.doc.update_object(xref, body)
+        if stream is not None:
+            self.doc.update_stream(xref, stream.encode())
+        return xref
+
+    def _color(self, color: Tuple[float, float, float]) -> str:
+        if self.inverted:
+            color = tuple(1 - component for component in color)
+        return " ".join(f"{component:.4f}" for component in color) + " rg"
+
+    def _font(self) -> int:
+        return self._shared(("font",), lambda: self._new_object(
+            "<</Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding>>"))
+
+    def _opacity(self) -> int:
+        opacity = self.stamps.watermark_opacity
+        return self._shared(("opacity",), lambda: self._new_object(
+            f"<</Type /ExtGState /ca {opacity:.4f} /CA {opacity:.4f}>>"))
+
+    def _text_form(self, name: str, text: str, size: float, color: Tuple[float, float, float]) -> int:
+        """A Form XObject showing text from its origin, on the baseline."""
+        def create() -> int:
+            bbox = f"0 {-0.25 * size:.4f} {_text_width(text, size):.4f} {size:.4f}"
+            return self._new_object(
+                f"<</Type /XObject /Subtype /Form /BBox [{bbox}] "
+                f"/Resources <</Font <</{FONT_NAME} {self._font()} 0 R>>>>>>",
+                f"BT /{FONT_NAME} {size:.4f} Tf {self._color(color)} 0 0 Td {_pdf_string(text)} Tj ET\n",
+            )
+        return self._shared(("form", name), create)
+
+    def _forms(self) -> Dict[str, int]:
+        """The Form XObjects of the stamps that look the same on every page, by resource name."""
+        stamps = self.stamps
+        forms = {}
+        if stamps.watermark:
+            forms["StampWatermark"] = self._text_form("watermark", stamps.watermark, stamps.watermark_size,
+                                                      stamps.watermark_color)
+        if stamps.header:
+            forms["StampHeader"] = self._text_form("header", stamps.header, stamps.font_size, stamps.color)
+        if stamps.footer:
+            forms["StampFooter"] = self._text_form("footer", stamps.footer, stamps.font_size, stamps.color)
+        return forms
+
+    def placement(page: fitz.Page) -> fitz.Matrix:
+        """Map the page as displayed, origin at the bottom left, to its unrotated user space."""
+        flip = fitz.Matrix(1, 0, 0, -1, 0, page.rect.height)
+        return flip * page.derotation_matrix * ~page.transformation_matrix
+
+    def _static_stream(self, page: fitz.Page) -> int:
+        """The stream drawing the watermark, header and footer on pages with this box and rotation."""
+        stamps = self.stamps
+        width, height = page.rect.width, page.rect.height
+
+        def create() -> int:
+            ops = [f"q {_matrix(PageStamper.placement(page))} cm\n"]
+            if stamps.watermark:
+                # Rotate about the middle of the text, then move that to the middle of the page.
+                angle = math.radians(stamps.watermark_angle)
+                cos, sin = math.cos(angle), math.sin(angle)
+                center_x = _text_width(stamps.watermark, stamps.watermark_size) / 2
+                center_y = stamps.watermark_size / 3
+                x = width / 2 - (cos * center_x - sin * center_y)
+                y = height / 2 - (sin * center_x + cos * center_y)
+                ops.append(f"q /StampGS gs {cos:.4f} {sin:.4f} {-sin:.4f} {cos:.4f} {x:.4f} {y:.4f} cm /StampWatermark Do Q\n")
+            if stamps.header:
+                x = (width - _text_width(stamps.header, stamps.font_size)) / 2
+                ops.append(f"q 1 0 0 1 {x:.4f} {height - MARGIN - stamps.font_size:.4f} cm /StampHeader Do Q\n")
+            if stamps.footer:
+                x = (width - _text_width(stamps.footer, stamps.font_size)) / 2
+                ops.append(f"q 1 0 0 1 {x:.4f} {MARGIN:.4f} cm /StampFooter Do Q\n")
+            ops.append("Q\n")
+            return self._new_object("<<>>", "".join(ops))
+
+        key = ("static", tuple(page.mediabox), tuple(page.cropbox), page.rotation)
+        return self._shared(key, create)
+
+    def _page_number_stream(self, page: fitz.Page, page_number: int) -> int:
+        """A stream of this page's own with its number, right-aligned at the bottom."""
+        stamps = self.stamps
+        text = stamps.page_number_format.format(page=page_number + 1, pages=self.page_count)
+        x = page.rect.width - PAGE_NUMBER_RIGHT_MARGIN - _text_width(text, stamps.font_size)
+        return self._new_object("<<>>", (
+            f"q {_matrix(PageStamper.placement(page))} cm BT /{FONT_NAME} {stamps.font_size:.4f} Tf "
+            f"{self._color(stamps.color)} {x:.4f} {MARGIN:.4f} Td {_pdf_string(text)} Tj ET Q\n"
+        ))
+
+    def stamp(self, page: fitz.Page, page_number: Optional[int] = None) -> None:
+        """Draw the stamps over page; page_number (0-based) defaults to the page's own index."""
+        doc = self.doc
+        forms = self._forms()
+        for name, xref in forms.items():
+            set_page_resource(doc, page.xref, "XObject", name, f"{xref} 0 R")
+        if self.stamps.watermark:
+            set_page_resource(doc, page.xref, "ExtGState", "StampGS", f"{self._opacity()} 0 R")
+        if self.stamps.page_numbers:
+            set_page_resource(doc, page.xref, "Font", FONT_NAME, f"{self._font()} 0 R")
+
+        # Wrap the page's content in q/Q so whatever state it leaves behind cannot move the stamps.
+        stamp_xrefs = [self._shared(("restore",), lambda: self._new_object("<<>>", "Q\n"))]
+        if forms:
+            stamp_xrefs.append(self._static_stream(page))
+        if self.stamps.page_numbers:
+            stamp_xrefs.append(self._page_number_stream(page, page.number if page_number is None else page_number))
+        save_xref = self._shared(("save",), lambda: self._new_object("<<>>", "q\n"))
+        refs = " ".join(f"{x} 0 R" for x in [save_xref] + page.get_contents() + stamp_xrefs)
+        doc.xref_set_key(page.xref, "Contents", f"[{refs}]")
+
+
+def stamp_pdf(pdf_path: str, stamps: Stamps, output_path: str) -> bool:
+    """Write a copy of the PDF with the stamps on every page."""
+    if not exists_file_path(pdf_path) or not check_pdf_validity(pdf_path):
+        return False
+    try:
+        with fitz.open(pdf_path) as pdf:
+            stamper = PageStamper(pdf, stamps)
+            for page in pdf:
+                stamper.stamp(page)
+            pdf.save(output_path, garbage=1, deflate=True)
+        logging.info(f"Stamped {pdf_path} to {output_path} ({stamper.deduplicated} shared objects reused)")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to stamp {pdf_path}: {e}")
+        return False